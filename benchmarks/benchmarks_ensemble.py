@@ -0,0 +1,98 @@
+import os
+
+from . import synthetic
+
+# Ensemble regridding, means and trends on interim-style datasets, and zarr output.
+
+class EnsembleOperations:
+    params = ([3, 9],)
+    param_names = ["runs"]
+    timeout = 900
+
+    def setup(self, runs):
+        self.root = synthetic.workspace()
+        self.files = [
+            synthetic.write_interim_file(os.path.join(self.root, "data", "interim", f"run{r}.nc"), f"run{r}")
+            for r in range(runs)
+        ]
+
+    def ensemble(self):
+        import ensemble
+        return ensemble.Ensemble("synthetic", [ensemble.open_dataset(f, name=f"run{r}") for r, f in enumerate(self.files)])
+
+    def gridded(self):
+        ens = self.ensemble()
+        ens.to_default_grid(years=[1990, 2020])
+        ens.generate_ensemble("tas")
+        return ens
+
+    def time_to_default_grid(self, runs):
+        self.ensemble().to_default_grid(years=[1990, 2020])
+
+    def peakmem_to_default_grid(self, runs):
+        self.ensemble().to_default_grid(years=[1990, 2020])
+
+    def time_multi_model_mean(self, runs):
+        self.gridded().multi_model_mean()
+
+    def time_calc_trends(self, runs):
+        ens = self.ensemble()
+        ens.generate_ensemble("tas")
+        ens.ds = ens.ds.isel(latitude=slice(0, 8)) # per-cell polyfit loop
+        ens.calc_trends("tas")
+
+    def time_anomalies(self, runs):
+        ens = self.ensemble()
+        ens.to_anomalies("tas", baseline=(1995, 2014))
+        ens.generate_ensemble("tas")
+        ens.ds["tas"].load()
+
+    def time_calc_rolling_trends(self, runs):
+        ens = self.ensemble()
+        ens.generate_ensemble("tas")
+        ens.calc_rolling_trends("tas", window=120, step=12)
+
+class ZarrWrite:
+    params = ([1, 4],)
+    param_names = ["decades"]
+
+    def setup(self, decades):
+        import zarr_util
+        self.root = synthetic.workspace()
+        zarr_util.zarr_dir = os.path.join(self.root, "data", "zarr")+"/"
+        self.ds = synthetic.interim_dataset("GFDL", nt=120*decades)
+        self.nbytes = self.ds.nbytes
+
+    def write(self):
+        import catalog
+        import zarr_util
+        zarr_util.write_zarr(self.ds, "FAR", "tas_decadal_FAR_GFDL-1P.nc", "tas", catalog.new_catalog_dict())
+
+    def time_write_zarr(self, decades):
+        self.write()
+
+    def track_write_throughput(self, decades):
+        import time
+        start = time.perf_counter()
+        self.write()
+        return self.nbytes/1e6/(time.perf_counter()-start)
+    track_write_throughput.unit = "MB/s"
+
+class PointTimeSeries:
+    params = (["map", "timeseries"],)
+    param_names = ["chunking"]
+
+    def setup(self, chunking):
+        import rechunk
+        root = synthetic.workspace()
+        ds = synthetic.interim_dataset("GFDL", nt=1200).chunk({"time": 1})
+        self.path = os.path.join(root, "data", "zarr", "map.zarr")
+        ds.to_zarr(self.path, mode="w", consolidated=True)
+        if chunking == "timeseries":
+            target = os.path.join(root, "data", "zarr", "timeseries.zarr")
+            rechunk.rechunk_store(self.path, target, max_mem=ds["tas"].nbytes/4)
+            self.path = target
+
+    def time_point_series(self, chunking):
+        import xarray as xr
+        xr.open_zarr(self.path)["tas"].isel(latitude=10, longitude=20).load()
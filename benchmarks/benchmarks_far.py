@@ -0,0 +1,91 @@
+import os
+import numpy as np
+
+from . import synthetic
+
+# Decoding of the FAR binaries (synthetic files in the cipher layouts of each model),
+# unit conversion and annual averaging as done in scripts/decode_FAR.py.
+
+class array_variable:
+    # in-memory stand-in for a netCDF4 variable (the unit conversions assign through [...])
+    def __init__(self, values):
+        self.values = values
+        self.units = None
+    def __getitem__(self, key):
+        return self.values[key]
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+class DecodeFAR:
+    params = (["GFDL", "UKTR", "GISS"], [1, 2])
+    param_names = ["model", "scale"]
+    timeout = 600
+
+    def setup(self, model_name, scale):
+        self.root = synthetic.workspace()
+        import models
+        self.model = synthetic.scaled(getattr(models, model_name.lower()), scale)
+        self.files = synthetic.write_far_files(self.root, self.model)
+        self.nbytes = sum(os.path.getsize(f) for f in self.files)
+
+    def decode(self):
+        import fortran_records
+        return [
+            np.array(self.model.decode(fortran_records.record_file(f, use_cache=False)), dtype=np.float32)
+            for f in self.files
+        ]
+
+    def time_decode(self, model_name, scale):
+        self.decode()
+
+    def peakmem_decode(self, model_name, scale):
+        self.decode()
+
+    def track_decode_throughput(self, model_name, scale):
+        import time
+        start = time.perf_counter()
+        self.decode()
+        return self.nbytes/1e6/(time.perf_counter()-start)
+    track_decode_throughput.unit = "MB/s"
+
+class UnitConversion:
+    params = ([1, 4],)
+    param_names = ["scale"]
+
+    def setup(self, scale):
+        synthetic.workspace()
+        import unit_conversion
+        self.conversions = [
+            unit_conversion.cm_per_day_to_kg_per_m_squared_s, unit_conversion.cm_to_kg_per_m_squared,
+            unit_conversion.ly_per_min_to_W_per_m_squared, unit_conversion.C_to_K,
+        ]
+        rng = np.random.default_rng(synthetic.seed)
+        self.values = rng.uniform(0., 50., size=(10, 40*scale, 48*scale)).astype(np.float32)
+
+    def time_unit_conversions(self, scale):
+        for convert_units in self.conversions:
+            convert_units(array_variable(self.values.copy()))
+
+class AnnualMean:
+    # monthly to annual means of UKTR (loop over months) and GISS (weighted einsum) fields
+    params = (["UKTR", "GISS"],)
+    param_names = ["model"]
+
+    def setup(self, model_name):
+        synthetic.workspace()
+        import models
+        model = getattr(models, model_name.lower())
+        rng = np.random.default_rng(synthetic.seed)
+        nt = 3 if model_name == "UKTR" else model.nt
+        self.Vmonth = rng.uniform(0., 50., size=(model.nv, nt, 12, model.ny, model.nx)).astype(np.float32)
+        days_in_month = [31, 28.25, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+        self.month_weights = np.array(days_in_month)/np.sum(days_in_month)
+
+    def time_annual_mean_loop(self, model_name):
+        V = np.zeros(self.Vmonth.shape[:2]+self.Vmonth.shape[3:], dtype=np.float32)
+        for t_idx in range(self.Vmonth.shape[1]):
+            for m_idx in range(12):
+                V[:,t_idx,:,:] += self.Vmonth[:,t_idx,m_idx,:,:]*self.month_weights[m_idx]
+
+    def time_annual_mean_einsum(self, model_name):
+        np.einsum("vtmyx,m->vtyx", self.Vmonth, self.month_weights)
@@ -0,0 +1,59 @@
+import os
+
+from . import synthetic
+
+# Reading and normalizing SAR/TAR-shaped GRIB1 files (as in scripts/reformat_SAR_and_TAR.py).
+
+class DecodeGRIB1:
+    params = ([120, 1200],)
+    param_names = ["months"]
+    timeout = 600
+
+    def setup(self, months):
+        self.root = synthetic.workspace()
+        self.file_name = synthetic.write_grib1_file(
+            synthetic.raw_dir(self.root, "SAR")+f"UKMO/tas/synthetic_{months}.grb", nt=months,
+        )
+        self.nbytes = os.path.getsize(self.file_name)
+
+    def open(self):
+        import grib1
+        grib1._index_cache.clear()
+        return grib1.open_grib1(self.file_name)
+
+    def time_index(self, months):
+        self.open()
+
+    def time_decode(self, months):
+        self.open().load()
+
+    def peakmem_decode(self, months):
+        self.open().load()
+
+    def track_decode_throughput(self, months):
+        import time
+        start = time.perf_counter()
+        self.open().load()
+        return self.nbytes/1e6/(time.perf_counter()-start)
+    track_decode_throughput.unit = "MB/s"
+
+class Normalize:
+    params = ([120, 1200],)
+    param_names = ["months"]
+
+    def setup(self, months):
+        import xarray as xr
+        synthetic.workspace()
+        values = synthetic.sar_field(months, 73, 96)
+        values[:, :5, :] = -999. # missing values
+        self.ds = xr.Dataset({"pr": (("time", "lat", "lon"), values)})
+
+    def time_normalize(self, months):
+        import normalization
+        ds = self.ds.copy(deep=True)
+        rule = normalization.compile_rules("SAR", "UKMO", "pr")
+        normalization.normalize(ds, "pr", rule)
+
+    def time_bitround(self, months):
+        import precision
+        precision.bitround(self.ds["pr"].values, 12)
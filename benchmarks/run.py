@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import itertools
+import importlib
+import subprocess
+import multiprocessing
+
+# Runs the benchmark suite without asv (python -m benchmarks.run from the repository root):
+# every benchmark runs in its own process, so the reported peak RSS is its own, and the
+# results are appended to benchmarks/results/<commit>.jsonl for comparison across commits.
+# With asv installed, `asv run` / `asv compare` use the same benchmark classes.
+
+modules = ["benchmarks_far", "benchmarks_sar_tar", "benchmarks_ensemble"]
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def benchmarks(pattern=None):
+    for module_name in modules:
+        module = importlib.import_module("benchmarks."+module_name)
+        for class_name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__: continue
+            params = getattr(cls, "params", ())
+            if params and not isinstance(params[0], (list, tuple)): params = (params,)
+            for method_name in sorted(dir(cls)):
+                if not method_name.startswith(("time_", "peakmem_", "track_")): continue
+                for param in itertools.product(*params):
+                    name = f"{module_name}.{class_name}.{method_name}"
+                    if pattern and pattern not in name: continue
+                    yield name, cls, method_name, param
+
+def run_one(cls, method_name, param, repeat, queue):
+    import resource
+    instance = cls()
+    if hasattr(instance, "setup"): instance.setup(*param)
+    method = getattr(instance, method_name)
+    result = {}
+    if method_name.startswith("time_"):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            method(*param)
+            timings.append(time.perf_counter()-start)
+        result["seconds"] = min(timings)
+    elif method_name.startswith("track_"):
+        result["value"] = method(*param)
+        result["unit"] = getattr(method, "unit", "")
+    else:
+        method(*param)
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+    queue.put(result)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pattern", nargs="?", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    commit = git_commit()
+    os.makedirs(results_dir, exist_ok=True)
+    results_file = os.path.join(results_dir, f"{commit}.jsonl")
+    context = multiprocessing.get_context("fork")
+    for name, cls, method_name, param in benchmarks(args.pattern):
+        queue = context.Queue()
+        process = context.Process(target=run_one, args=(cls, method_name, param, args.repeat, queue))
+        process.start()
+        process.join(getattr(cls, "timeout", 300))
+        if process.is_alive():
+            process.terminate()
+            result = {"error": "timeout"}
+        elif process.exitcode != 0:
+            result = {"error": f"exit code {process.exitcode}"}
+        else:
+            result = queue.get()
+        result.update({"benchmark": name, "params": list(param), "commit": commit})
+        print(json.dumps(result))
+        sys.stdout.flush()
+        with open(results_file, "a") as f:
+            f.write(json.dumps(result)+"\n")
+
+if __name__ == "__main__":
+    main()
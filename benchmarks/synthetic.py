@@ -0,0 +1,261 @@
+import os
+import sys
+import copy
+import struct
+import tempfile
+import numpy as np
+
+# Synthetic stand-ins for the (non-redistributable) raw archives.
+#
+# workspace() creates a directory tree with the layout of the repository
+# (<root>/data/raw/..., <root>/scripts) and makes <root>/scripts the working directory,
+# since models.py and the scripts use paths relative to it. The FAR binaries are written
+# by inverting the cipher of each model (get_byte_index gives the position of every value,
+# the Fortran record markers and headers fill the gaps), so they decode exactly like the
+# originals; grids can be scaled up to measure how the decoders scale. SAR/TAR inputs are
+# simple-packed GRIB1 files and interim-style NetCDF files.
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_dir, "process-ipcc"))
+
+seed = 0
+
+def workspace(root=None):
+    if root is None: root = tempfile.mkdtemp(prefix="process-ipcc-bench-")
+    os.makedirs(os.path.join(root, "scripts"), exist_ok=True)
+    write_gfdl_var_list(root)
+    os.chdir(os.path.join(root, "scripts"))
+    return root
+
+def raw_dir(root, activity):
+    return os.path.join(root, "data", "raw", activity)+"/"
+
+#=========== FAR ==============
+# (index range, name, description, units) in the format of the GFDL documentation
+gfdl_var_list = [
+    ("1-9", "T1 - T9", "TEMPERATURE", "degrees K"),
+    ("10-18", "U1 - U9", "ZONAL WIND", "cm/s"),
+    ("19-27", "V1 - V9", "MERIDIONAL WIND", "cm/s"),
+    ("28", "PRECIP", "PRECIPITATION", "cm/day"),
+    ("29", "SOILM", "SOIL MOISTURE", "cm"),
+    ("30", "SNWDPT", "SNOW DEPTH", "cm"),
+    ("31", "SWTOP", "NET SOLAR RADIATION AT TOP", "ly/min"),
+    ("32", "LWTOP", "OUTGOING LONGWAVE AT TOP", "ly/min"),
+    ("33", "SWBOT", "NET SOLAR RADIATION AT SURFACE", "ly/min"),
+    ("34", "LWBOT", "NET LONGWAVE AT SURFACE", "ly/min"),
+    ("35", "PSTAR", "SURFACE PRESSURE", "dyne/cm^2"),
+]
+
+def write_gfdl_var_list(root):
+    path = os.path.join(raw_dir(root, "FAR"), "GFDL_1P", "add_info_var_list_R15_170")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        for index, name, description, units in gfdl_var_list:
+            f.write(f"{index:<9}{name:<12}{description:<38}{units}\n")
+
+# GISS record titles: name (40 characters), units in parentheses (18), description
+giss_names = {
+    0: ("COMPOSITE SURFACE AIR TEMPERATURE", "C"),
+    1: ("U COMPON OF COMPOSITE SURFACE AIR WIND", "M/S"),
+    2: ("V COMPON OF COMPOSITE SURFACE AIR WIND", "M/S"),
+    3: ("PRECIPITATION", "MM/DAY"),
+    4: ("TOTAL CLOUD COVER", "%"),
+    5: ("COMPOSITE SNOW DEPTH", "KG/M2"),
+    6: ("OCEAN ICE COVERAGE", "%"),
+    7: ("1000 MB GEOPOTENTIAL HEIGHT", "M"),
+    14: ("NET SOLAR RADIATION AT P0", "W/M2"),
+    15: ("NET THERMAL RADIATION AT P0", "W/M2"),
+    16: ("COMPOSITE NET SOLAR RADIATION AT SURFCE", "W/M2"),
+    17: ("COMPOSITE NET RADIATION AT SURFACE", "W/M2"),
+}
+
+def giss_titles(nv):
+    titles = []
+    for v in range(nv):
+        name, units = giss_names.get(v, (f"SYNTHETIC VARIABLE {v}", "1"))
+        if 8 <= v <= 13: name = f"{1000-150*(v-7)} MB GEOPOTENTIAL HEIGHT"
+        titles.append(f"{name:<40}{'('+units+')':<18}{'SYNTHETIC':<22}"[:80].encode("ascii"))
+    return titles
+
+def scaled(model, scale=1):
+    # copy of a model cipher with a horizontal grid refined by an integer factor
+    model = copy.copy(model)
+    if scale == 1: return model
+    model.nx, model.ny = model.nx*scale, model.ny*scale
+    model.lon = np.linspace(0., 360., model.nx, endpoint=False)
+    model.lat = np.linspace(-90., 90., model.ny+2)[1:-1]
+    if model.name == "GFDL":
+        model.dims = (model.nv, model.nx, model.ny)
+    else:
+        model.dims = (model.nx, model.ny)+tuple(model.dims[2:])
+    model.record_values = int(np.prod(model.dims[:model.data_cw_dim+1]))
+    return model
+
+def land_pattern(ny, nx):
+    lat = np.linspace(-np.pi/2, np.pi/2, ny)[:,np.newaxis]
+    lon = np.linspace(0, 2*np.pi, nx, endpoint=False)[np.newaxis,:]
+    return (np.sin(3*lon)*np.cos(2*lat) > 0.3)
+
+def far_values(model, rng=None):
+    # values in cipher dimension order, with the sentinels of the land-only fields
+    if rng is None: rng = np.random.default_rng(seed)
+    values = rng.uniform(0., 50., size=model.dims).astype(np.float32)
+    if model.name == "GFDL":
+        land = land_pattern(model.ny, model.nx).T # (nx, ny)
+        values[28][~land] = 15. # SOILM
+    elif model.name == "UKTR":
+        land = land_pattern(model.ny, model.nx).T[:,:,np.newaxis]
+        field = values[:,:,0]
+        values[:,:,0] = np.where(land, field, 100. + 20.*field) # soil moisture or sea ice + 100
+    return values
+
+def write_cipher_file(model, values, path, titles=None):
+    # Fortran sequential file in which every value sits where get_byte_index says
+    offsets = model.get_byte_index(np.indices(model.dims)).ravel(order="F")
+    rv, skip = model.record_values, model.record_skip
+    record_data = offsets[::rv]
+    record_length = rv*model.bytes_per_data_entry + skip
+    record_starts = record_data - skip
+
+    size = int(record_starts[-1]) + record_length + 4
+    buf = bytearray(size)
+    marker = lambda length: struct.pack(">I", length)
+
+    fields = np.asarray(values, dtype=">f4").ravel(order="F").reshape(-1, rv)
+    previous_end = 0
+    for k, start in enumerate(record_starts):
+        start = int(start)
+        # header record in the gap before this record (e.g. UKTR's 256-byte headers)
+        gap = start-4-previous_end
+        if gap >= 8:
+            buf[previous_end:previous_end+4] = marker(gap-8)
+            buf[previous_end+gap-4:previous_end+gap] = marker(gap-8)
+        elif gap != 0:
+            raise ValueError(f"{model.name}: no room for Fortran record markers before byte {start}")
+        buf[start-4:start] = marker(record_length)
+        if titles is not None:
+            buf[start:start+skip] = titles[k % len(titles)][:skip].ljust(skip)
+        buf[start+skip:start+record_length] = fields[k].tobytes()
+        buf[start+record_length:start+record_length+4] = marker(record_length)
+        previous_end = start+record_length+4
+
+    with open(path, "wb") as f:
+        f.write(buf)
+    return path
+
+def write_far_files(root, model, n_files=None):
+    # raw files of a (scaled) FAR model in the directory layout decode_FAR.py expects
+    rng = np.random.default_rng(seed)
+    if model.name == "GFDL":
+        directory = raw_dir(root, "FAR")+"GFDL_1P/IPCC_DDC_FAR_GFDL_R15TR1P_D_1/"
+        names = [f"ann.dec.{(t+1)*10}" for t in range(n_files or 10)]
+        titles = None
+    elif model.name == "UKTR":
+        directory = raw_dir(root, "FAR")+"UKTR_1P/IPCC_DDC_FAR_UKTR_1P_D_1/"
+        names = [f"trans_years{years}.bin" for years in ["1-10","51-60","66-75"][:n_files or 3]]
+        titles = None
+    else:
+        directory = raw_dir(root, "FAR")+"GISS_1P/IPCC_DDC_FAR_GISS_SCA_DATA_1/"
+        names = ["10yr_climo_1960-2059.bin"]
+        titles = giss_titles(model.nv)
+    os.makedirs(directory, exist_ok=True)
+    return [write_cipher_file(model, far_values(model, rng), directory+name, titles) for name in names]
+
+#=========== SAR/TAR ==============
+def grib_int(value, nbytes):
+    # sign-and-magnitude integer
+    magnitude = abs(int(round(value)))
+    if value < 0: magnitude |= 1 << (8*nbytes-1)
+    return magnitude.to_bytes(nbytes, "big")
+
+def ibm_bytes(value, round_down=True):
+    # IBM single precision float (rounded towards -inf so packed values stay >= 0)
+    if value == 0: return b"\0\0\0\0"
+    sign = value < 0
+    magnitude = abs(value)
+    exponent = int(np.floor(np.log(magnitude)/np.log(16.)))+1
+    mantissa = magnitude/16.**exponent*2**24
+    mantissa = int(np.ceil(mantissa) if (sign == round_down) else np.floor(mantissa))
+    if mantissa >= 2**24:
+        mantissa //= 16
+        exponent += 1
+    return struct.pack(">I", (sign << 31) | ((exponent+64) << 24) | mantissa)
+
+def grib1_message(field, time, lat, lon, parameter=11, level_type=105, level=2, center=74, nbits=16, decimal_scale=2):
+    import grib1
+    nj, ni = field.shape
+    year = int(str(time)[:4])
+    century = (year-1)//100+1
+    month, day = int(str(time)[5:7]), int(str(time)[8:10])
+    pds = (
+        (28).to_bytes(3, "big") + bytes([2, center, 0, 255, 128, parameter, level_type])
+        + level.to_bytes(2, "big") + bytes([year-(century-1)*100, month, day, 0, 0, 1, 0, 0, 0])
+        + (0).to_bytes(2, "big") + bytes([0, century, 0]) + grib_int(decimal_scale, 2)
+    )
+    gds = (
+        (32).to_bytes(3, "big") + bytes([0, 255, 0]) + ni.to_bytes(2, "big") + nj.to_bytes(2, "big")
+        + grib_int(lat[0]*1000, 3) + grib_int(lon[0]*1000, 3) + bytes([128])
+        + grib_int(lat[-1]*1000, 3) + grib_int(lon[-1]*1000, 3)
+        + grib_int(abs(lon[1]-lon[0])*1000, 2) + grib_int(abs(lat[1]-lat[0])*1000, 2)
+        + bytes([0 if lat[0] > lat[-1] else 64]) + bytes(4)
+    )
+
+    scaled_field = field.astype(np.float64).ravel()*10.**decimal_scale
+    reference = grib1.ibm_float(ibm_bytes(scaled_field.min()), 0)
+    span = scaled_field.max()-reference
+    binary_scale = int(np.ceil(np.log2(span/(2**nbits-1)))) if span > 0 else 0
+    packed = np.round((scaled_field-reference)/2.**binary_scale).astype(np.uint64)
+    packed = np.clip(packed, 0, 2**nbits-1)
+    # big-endian bits of every value, packed without padding between values
+    bits = (packed[:,np.newaxis] >> np.arange(nbits-1, -1, -1, dtype=np.uint64)) & np.uint64(1)
+    data = np.packbits(bits.astype(np.uint8).ravel()).tobytes()
+    unused = 8*len(data)-packed.size*nbits
+    bds_length = 11+len(data)
+    padding = bds_length % 2
+    bds = (
+        (bds_length+padding).to_bytes(3, "big") + bytes([unused+8*padding]) + grib_int(binary_scale, 2)
+        + ibm_bytes(scaled_field.min()) + bytes([nbits]) + data + bytes(padding)
+    )
+
+    body = pds+gds+bds+b"7777"
+    return b"GRIB" + (8+len(body)).to_bytes(3, "big") + bytes([1]) + body
+
+def sar_field(nt, ny, nx, rng=None):
+    if rng is None: rng = np.random.default_rng(seed)
+    lat = np.linspace(90., -90., ny)
+    seasonal = 15.*np.cos(np.deg2rad(lat))[np.newaxis,:,np.newaxis]
+    cycle = 5.*np.sin(2*np.pi*np.arange(nt)/12.)[:,np.newaxis,np.newaxis]
+    return (250. + seasonal + cycle + rng.standard_normal((nt, ny, nx))).astype(np.float32)
+
+def write_grib1_file(path, nt=120, ny=73, nx=96, start="1990-01", **kwargs):
+    # monthly fields on a regular grid, north to south, as in the SAR/TAR archives
+    lat = np.linspace(90., -90., ny)
+    lon = np.linspace(0., 360., nx, endpoint=False)
+    times = np.arange(np.datetime64(start, "M"), np.datetime64(start, "M")+nt).astype("datetime64[D]")
+    values = sar_field(nt, ny, nx)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        for t in range(nt):
+            f.write(grib1_message(values[t], times[t], lat, lon, **kwargs))
+    return path
+
+def interim_dataset(name, nt=360, ny=48, nx=96, var_name="tas", start="1990-01"):
+    # dataset shaped like the interim/zarr output (time, latitude, longitude)
+    import xarray as xr
+    rng = np.random.default_rng(abs(hash(name)) % 2**32)
+    time = np.arange(np.datetime64(start, "M"), np.datetime64(start, "M")+nt).astype("datetime64[D]")
+    lat = np.linspace(-90.+180./ny/2, 90.-180./ny/2, ny)
+    lon = np.arange(nx)*360./nx
+    trend = 0.02*np.arange(nt)[:,np.newaxis,np.newaxis]/12.
+    values = sar_field(nt, ny, nx, rng) + trend
+    ds = xr.Dataset(
+        {var_name: (("time","latitude","longitude"), values.astype(np.float32), {"units": "K"})},
+        coords={"time": time, "latitude": lat, "longitude": lon},
+        attrs={"name": name, "institution": name},
+    )
+    return ds
+
+def write_interim_file(path, name, **kwargs):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    interim_dataset(name, **kwargs).to_netcdf(path)
+    return path
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import functools
+
+# Opt-in on-disk memoization of Ensemble operations.
+#
+# Every Ensemble carries a token identifying its state. It starts as a hash of its input
+# datasets (path, size and modification time of the source files, or of all files of a
+# zarr store; a content hash for data without a source) and every memoized operation
+# replaces it by the key of that operation: hash(version, operation, previous token,
+# arguments). The result of an operation (the runs, the generated ensemble or a returned
+# dataset) is stored as zarr under <cache_dir>/<key>/ and loaded instead of recomputed
+# when the same key comes up again, so a change to any upstream file changes all
+# downstream keys. Entries beyond size_limit bytes are evicted least recently used first.
+
+cache_dir = None # disabled
+size_limit = 20e9
+version = 1
+
+def enable(path, limit=None):
+    global cache_dir, size_limit
+    cache_dir = path
+    if limit is not None: size_limit = limit
+    os.makedirs(cache_dir, exist_ok=True)
+
+def disable():
+    global cache_dir
+    cache_dir = None
+
+def hash_strings(*strings):
+    h = hashlib.sha1()
+    for s in strings:
+        h.update(str(s).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def file_state(path):
+    # (path, size, mtime) of a file or of every file of a directory (zarr store)
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)]
+    state = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            state.append((os.path.relpath(os.path.join(root, name), path), stat.st_size, stat.st_mtime_ns))
+    return [os.path.abspath(path)]+state
+
+def dataset_token(ds):
+    source = ds.encoding.get("source")
+    if (source is not None) and os.path.exists(source):
+        return hash_strings("source", file_state(source))
+    import dask.base
+    return hash_strings("data", dask.base.tokenize(ds))
+
+def argument_token(value):
+    # stable representation of operation arguments (arrays by content)
+    import numpy as np
+    if isinstance(value, dict):
+        return "{"+",".join(f"{k!r}:{argument_token(v)}" for k, v in sorted(value.items(), key=lambda kv: repr(kv[0])))+"}"
+    if isinstance(value, (list, tuple)):
+        return "["+",".join(argument_token(v) for v in value)+"]"
+    if isinstance(value, np.ndarray):
+        return hash_strings(value.dtype.str, value.shape, value.tobytes())
+    if hasattr(value, "dims") and hasattr(value, "attrs"):
+        import dask.base
+        return dask.base.tokenize(value)
+    return repr(value)
+
+def operation_key(name, token, args, kwargs):
+    return hash_strings(version, name, token, argument_token(list(args)), argument_token(kwargs))
+
+#=========== STORAGE ==============
+def touch(path):
+    with open(os.path.join(path, "last_used"), "w") as f:
+        f.write(str(time.time()))
+
+def last_used(path):
+    try:
+        return os.path.getmtime(os.path.join(path, "last_used"))
+    except OSError:
+        return 0.
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+def evict():
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    entries = sorted([entry for entry in entries if os.path.isdir(entry)], key=last_used)
+    sizes = {entry: directory_size(entry) for entry in entries}
+    total = sum(sizes.values())
+    for entry in entries:
+        if total <= size_limit: break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+
+def store(key, datasets, meta):
+    # datasets: dict of name -> Dataset; written to a temporary directory and renamed
+    path = os.path.join(cache_dir, key)
+    tmp_path = path+f".tmp{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    names = list(datasets.keys())
+    for i, name in enumerate(names):
+        ds = datasets[name].copy()
+        for var in ds.variables.values(): var.encoding = {}
+        ds.to_zarr(os.path.join(tmp_path, str(i)), mode="w", consolidated=True)
+    with open(os.path.join(tmp_path, "entry.json"), "w") as f:
+        json.dump({"names": names, **meta}, f)
+    touch(tmp_path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError: # stored concurrently
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    evict()
+
+def load(key):
+    import xarray as xr
+    path = os.path.join(cache_dir, key)
+    if not os.path.isfile(os.path.join(path, "entry.json")): return None
+    with open(os.path.join(path, "entry.json")) as f:
+        entry = json.load(f)
+    touch(path)
+    return {name: xr.open_zarr(os.path.join(path, str(i)), consolidated=True) for i, name in enumerate(entry["names"])}
+
+#=========== ENSEMBLE OPERATIONS ==============
+def memoized(output):
+    # output: "runs" (the operation updates ds_dict), "ensemble" (it updates ds) or
+    # "return" (it returns a Dataset and leaves the ensemble unchanged)
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            # nested operations are part of the outer one
+            if getattr(self, "_in_operation", False):
+                return method(self, *args, **kwargs)
+            if cache_dir is None:
+                # state no longer follows from the token chain; rehash when needed
+                if output != "return": self.token = None
+                return method(self, *args, **kwargs)
+            key = operation_key(method.__name__, self.token, args, kwargs)
+
+            cached = load(key)
+            self._in_operation = True
+            try:
+                if cached is None:
+                    result = method(self, *args, **kwargs)
+                    if output == "runs": datasets = self.ds_dict
+                    elif output == "ensemble": datasets = {"ensemble": self.ds}
+                    else: datasets = {"result": result}
+                    store(key, datasets, {"operation": method.__name__})
+                elif output == "runs":
+                    self.ds_dict = cached
+                    result = None
+                elif output == "ensemble":
+                    self.ds = cached["ensemble"]
+                    result = None
+                else:
+                    result = cached["result"]
+            finally:
+                self._in_operation = False
+
+            if output != "return": self.token = key
+            return result
+        return wrapper
+    return decorator
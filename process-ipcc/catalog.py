@@ -0,0 +1,149 @@
+import json
+import numpy as np
+import pandas as pd
+
+# Columns of the esm-collection catalogs, in the order they are written.
+# The leading key columns are also the sort order of the catalog rows, so that
+# rows of a single dataset (and of a single activity/experiment) are contiguous.
+catalog_columns = [
+    "activity_id",
+    "institution_id",
+    "source_id",
+    "experiment_id",
+    "member_id",
+    "table_id",
+    "variable_id",
+    "grid_label",
+    "zstore",
+    "dcpp_init_year",
+    "zstore_timeseries",
+    "zstore_pyramid",
+]
+catalog_keys = catalog_columns[:8]
+
+# Columns added after catalogs were first published, with their value for older catalogs.
+# zstore_timeseries is the time-contiguous copy of a store (see process-ipcc/rechunk.py),
+# zstore_pyramid its multiscale pyramid (see process-ipcc/pyramid.py).
+optional_columns = {"zstore_timeseries": "", "zstore_pyramid": ""}
+
+# Columns that are stored dictionary-encoded (pandas categoricals / parquet
+# dictionary pages) and that can be searched through the catalog index.
+indexed_columns = catalog_keys
+
+def new_catalog_dict():
+    return {column: [] for column in catalog_columns}
+
+def to_dataframe(fs_dict):
+    df = pd.DataFrame.from_dict(fs_dict)
+    for (column, default) in optional_columns.items():
+        if column not in df: df[column] = default
+    df = df[catalog_columns]
+    df = df.sort_values(catalog_keys, kind="mergesort").reset_index(drop=True)
+    for column in indexed_columns:
+        df[column] = df[column].astype("category")
+    return df
+
+def write_catalog(fs_dict, path, file_format="parquet"):
+    # fs_dict is either a dict of lists (as built row by row by the pipeline
+    # scripts) or an existing catalog DataFrame.
+    if isinstance(fs_dict, pd.DataFrame): df = to_dataframe(fs_dict.to_dict("list"))
+    else: df = to_dataframe(fs_dict)
+
+    if file_format == "parquet":
+        df.to_parquet(path, index=False)
+    elif file_format == "csv":
+        df.to_csv(path, index=False)
+    else:
+        raise ValueError(f"unknown catalog format '{file_format}'")
+    return df
+
+def read_catalog(path):
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return to_dataframe(df.to_dict("list"))
+
+def write_collection_json(template_path, json_path, catalog_file):
+    # Copy the static esm-collection description, pointing it to the catalog
+    # file actually written (a csv file: intake-esm reads catalog_file as csv).
+    with open(template_path, "r") as f:
+        collection = json.load(f)
+    collection["catalog_file"] = catalog_file
+    with open(json_path, "w") as f:
+        json.dump(collection, f, indent=2)
+
+class Catalog:
+    """
+    In-memory catalog with an inverted index on the key columns
+    """
+    def __init__(self, df):
+        self.df = to_dataframe(df.to_dict("list"))
+        self.zstore = self.df["zstore"].values.astype(str)
+        timeseries = self.df["zstore_timeseries"].values.astype(str)
+        self.zstore_timeseries = np.where(timeseries != "", timeseries, self.zstore)
+        self.zstore_pyramid = self.df["zstore_pyramid"].values.astype(str)
+
+        # For every indexed column, map each value to the (sorted) row positions
+        # holding it. Dictionary codes make this a single argsort per column.
+        self.index = {}
+        for column in indexed_columns:
+            codes = self.df[column].cat.codes.values
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(self.df[column].cat.categories)+1))
+            self.index[column] = {
+                value: order[bounds[i]:bounds[i+1]]
+                for (i, value) in enumerate(self.df[column].cat.categories)
+            }
+        self._cache = {}
+
+    @classmethod
+    def from_files(cls, paths):
+        return cls.merge([cls(read_catalog(path)) for path in paths])
+
+    @classmethod
+    def merge(cls, catalogs):
+        return cls(pd.concat([cat.df.astype(str) for cat in catalogs], ignore_index=True))
+
+    def __len__(self):
+        return len(self.df)
+
+    def _rows(self, column, values):
+        if column not in self.index:
+            raise KeyError(f"'{column}' is not an indexed catalog column")
+        if isinstance(values, str): values = [values]
+        hits = [self.index[column][value] for value in values if value in self.index[column]]
+        if len(hits) == 0: return np.array([], dtype=np.intp)
+        if len(hits) == 1: return hits[0]
+        return np.sort(np.concatenate(hits))
+
+    def search_rows(self, **query):
+        key = tuple(sorted(
+            (column, (values,) if isinstance(values, str) else tuple(values))
+            for (column, values) in query.items()
+        ))
+        if key in self._cache: return self._cache[key]
+
+        # intersect the smallest posting lists first
+        hits = sorted([self._rows(column, values) for (column, values) in query.items()], key=len)
+        if len(hits) == 0:
+            rows = np.arange(len(self.df))
+        else:
+            rows = hits[0]
+            for other in hits[1:]:
+                if rows.size == 0: break
+                rows = np.intersect1d(rows, other, assume_unique=True)
+        self._cache[key] = rows
+        return rows
+
+    def search(self, **query):
+        return self.df.iloc[self.search_rows(**query)]
+
+    def zstores(self, timeseries=False, **query):
+        # timeseries=True: the time-contiguous copies where they exist (for point time series)
+        zstore = self.zstore_timeseries if timeseries else self.zstore
+        return list(zstore[self.search_rows(**query)])
+
+    def pyramids(self, **query):
+        # the multiscale pyramids of the matching stores that have one (for quick looks)
+        return [zstore for zstore in self.zstore_pyramid[self.search_rows(**query)] if zstore != ""]
@@ -0,0 +1,234 @@
+import os
+import re
+import csv
+import json
+import concurrent.futures
+
+import cfconventions
+import worklist
+
+# Header-only audit of the interim NetCDF files and zarr stores.
+#
+# Only metadata is read: the header of every NetCDF file (netCDF4 reads no variable data
+# on opening) and the consolidated .zmetadata of every zarr store (or its .zarray/.zattrs
+# files if it isn't consolidated), in parallel worker processes. The variables are checked
+# against the CF metadata of the pipeline (cfconventions.standard_names/long_names and
+# standard_dict) and the coordinates against the CF conventions, giving
+#   findings: one row per problem (path, variable, check, severity, message)
+#   files:    one row per file or store (variables, numbers of errors/warnings/notes)
+#
+#   findings, files = cfcheck.scan_activities(["FAR", "SAR", "TAR"])
+#   cfcheck.write_table(findings, "findings.csv")
+#   cfcheck.write_table(files, "files.csv", cfcheck.file_columns)
+
+workers = os.cpu_count() or 1
+severities = ["error", "warning", "note"]
+
+finding_columns = ["path", "variable", "check", "severity", "message"]
+file_columns = ["path", "format", "status", "variables", "data_variables"]+[s+"s" for s in severities]
+
+latitude_units = {"degrees_north", "degree_north", "degree_N", "degrees_N", "degreeN", "degreesN"}
+longitude_units = {"degrees_east", "degree_east", "degree_E", "degrees_E", "degreeE", "degreesE"}
+time_units = re.compile(r"^\s*(days|hours|minutes|seconds|months|years)\s+since\s+\d", re.IGNORECASE)
+
+def expected_attrs(var_name):
+    # {attribute: accepted values} of a variable (both metadata tables, where they list it)
+    expected = {}
+    for attrs_name, table in (("standard_name", cfconventions.standard_names), ("long_name", cfconventions.long_names)):
+        if var_name in table: expected.setdefault(attrs_name, set()).add(table[var_name])
+    for attrs_name in ("standard_name", "long_name", "units"):
+        if var_name in cfconventions.standard_dict[attrs_name]:
+            expected.setdefault(attrs_name, set()).add(cfconventions.standard_dict[attrs_name][var_name])
+    return expected
+
+# Headers: {"path", "format", "attrs", "variables": {name: {"group", "dims", "shape", "dtype", "attrs"}}}
+# with names relative to the root group ("<group>/<name>" in groups)
+
+def netcdf_header(path):
+    import netCDF4 as nc
+    header = {"path": path, "format": "netcdf", "attrs": {}, "variables": {}}
+    with nc.Dataset(path) as ncdata:
+        header["attrs"] = {name: ncdata.getncattr(name) for name in ncdata.ncattrs()}
+        groups = [("", ncdata)]+[(name+"/", group) for (name, group) in ncdata.groups.items()]
+        for prefix, group in groups:
+            for name, ncvar in group.variables.items():
+                header["variables"][prefix+name] = {
+                    "group": prefix, "dims": list(ncvar.dimensions), "shape": list(ncvar.shape),
+                    "dtype": str(ncvar.dtype), "attrs": {a: ncvar.getncattr(a) for a in ncvar.ncattrs()},
+                }
+    return header
+
+def zarr_metadata(path):
+    # {key: metadata} of a store, from .zmetadata or else from the metadata files themselves
+    consolidated = os.path.join(path, ".zmetadata")
+    if os.path.exists(consolidated):
+        with open(consolidated) as f:
+            return json.load(f)["metadata"], True
+    metadata = {}
+    for directory, _, files in os.walk(path):
+        for name in files:
+            if name in (".zarray", ".zattrs", ".zgroup"):
+                key = os.path.relpath(os.path.join(directory, name), path).replace(os.sep, "/")
+                with open(os.path.join(directory, name)) as f:
+                    metadata[key] = json.load(f)
+    return metadata, False
+
+def zarr_header(path):
+    metadata, consolidated = zarr_metadata(path)
+    header = {"path": path, "format": "zarr", "attrs": dict(metadata.get(".zattrs", {})), "variables": {}, "consolidated": consolidated}
+    for key, zarray in metadata.items():
+        if not key.endswith("/.zarray"): continue
+        name = key[:-len("/.zarray")]
+        attrs = dict(metadata.get(name+"/.zattrs", {}))
+        dims = attrs.pop("_ARRAY_DIMENSIONS", None)
+        header["variables"][name] = {
+            "group": name[:name.rfind("/")+1], "dims": dims, "shape": zarray["shape"],
+            "dtype": str(zarray["dtype"]), "attrs": attrs,
+        }
+    return header
+
+def read_header(path):
+    if os.path.isdir(path): return zarr_header(path)
+    return netcdf_header(path)
+
+def numeric(variable):
+    return variable["dtype"].lstrip("<>|=")[:1] in ("f", "i", "u", "c")
+
+def coordinate_names(header):
+    # names of the coordinates: coordinate variables (1D, named as their dimension) and the
+    # auxiliary and scalar coordinates listed in "coordinates" attributes
+    variables = header["variables"]
+    names = {name.split("/")[-1] for name, variable in variables.items() if variable["dims"] == [name.split("/")[-1]]}
+    for attrs in [header["attrs"]]+[variable["attrs"] for variable in variables.values()]:
+        names.update(str(attrs.get("coordinates", "")).split())
+    return names
+
+def bounds_names(header):
+    return {str(variable["attrs"]["bounds"]) for variable in header["variables"].values() if "bounds" in variable["attrs"]}
+
+def data_variable_names(header):
+    other = coordinate_names(header) | bounds_names(header)
+    return [
+        name for name, variable in header["variables"].items()
+        if variable["dims"] is not None and name.split("/")[-1] not in other
+    ]
+
+def check_coordinate(name, variable):
+    units = str(variable["attrs"].get("units", ""))
+    base = name.split("/")[-1]
+    if base == "latitude" and units not in latitude_units:
+        yield "coordinate-units", "warning", f"latitude units '{units}' (CF: degrees_north)"
+    elif base == "longitude" and units not in longitude_units:
+        yield "coordinate-units", "warning", f"longitude units '{units}' (CF: degrees_east)"
+    elif base == "time" and not time_units.match(units):
+        yield "coordinate-units", "error", f"time units '{units}' are not '<unit> since <date>'"
+    elif base not in ("latitude", "longitude", "time") and units == "" and "compress" not in variable["attrs"] and numeric(variable):
+        yield "coordinate-units", "warning", "no units"
+
+def check_variable(name, variable, coordinates):
+    base = name.split("/")[-1]
+    attrs = variable["attrs"]
+    expected = expected_attrs(base)
+    if len(expected) == 0:
+        yield "unknown-variable", "note", f"'{base}' is in neither cfconventions nor standard_dict"
+    for attrs_name, severity in (("standard_name", "error"), ("units", "error"), ("long_name", "warning")):
+        if attrs_name not in attrs:
+            yield f"missing-{attrs_name}", severity, f"no {attrs_name} attribute"
+        elif attrs_name in expected and str(attrs[attrs_name]) not in expected[attrs_name]:
+            accepted = " or ".join(f"'{value}'" for value in sorted(expected[attrs_name]))
+            yield f"wrong-{attrs_name}", severity, f"{attrs_name} '{attrs[attrs_name]}' (expected {accepted})"
+    for dim in variable["dims"]:
+        if dim not in coordinates:
+            yield "missing-coordinate", "error", f"no coordinate variable for dimension '{dim}'"
+
+def check_header(header):
+    # [(variable, check, severity, message)] of a header
+    findings = []
+    if header.get("consolidated") is False:
+        findings.append(("", "unconsolidated", "warning", "no .zmetadata (zarr.consolidate_metadata)"))
+    if "Conventions" not in header["attrs"]:
+        findings.append(("", "missing-conventions", "note", "no global Conventions attribute"))
+    variables = header["variables"]
+    undefined = [name for name, variable in variables.items() if variable["dims"] is None]
+    for name in undefined:
+        findings.append((name, "missing-dimensions", "error", "no _ARRAY_DIMENSIONS attribute"))
+
+    # coordinate variables (1D, named as their dimension) are visible in their group and below
+    dimension_coordinates = {name: variable for name, variable in variables.items() if variable["dims"] == [name.split("/")[-1]]}
+    coordinates = coordinate_names(header)
+    bounds = bounds_names(header)
+    for name, variable in variables.items():
+        if name in undefined: continue
+        base = name.split("/")[-1]
+        if base in coordinates:
+            found = check_coordinate(name, variable)
+        elif base in bounds:
+            continue
+        else:
+            visible = {
+                coordinate.split("/")[-1] for coordinate in dimension_coordinates
+                if variable["group"].startswith(dimension_coordinates[coordinate]["group"])
+            }
+            found = check_variable(name, variable, visible)
+        findings += [(name, check, severity, message) for (check, severity, message) in found]
+    return findings
+
+def scan_file(path):
+    # (header summary, findings) of one file or store; unreadable ones are a finding
+    try:
+        header = read_header(path)
+    except Exception as e:
+        finding = {"path": path, "variable": "", "check": "unreadable", "severity": "error", "message": f"{type(e).__name__}: {e}"}
+        summary = {"path": path, "format": "zarr" if os.path.isdir(path) else "netcdf", "variables": 0, "data_variables": ""}
+        return summary, [finding]
+    findings = [
+        {"path": path, "variable": variable, "check": check, "severity": severity, "message": message}
+        for (variable, check, severity, message) in check_header(header)
+    ]
+    data_variables = data_variable_names(header)
+    summary = {"path": path, "format": header["format"], "variables": len(header["variables"]), "data_variables": " ".join(data_variables)}
+    return summary, findings
+
+def scan(paths, workers=None):
+    # (findings, files) tables (lists of dicts) of the files and stores in paths
+    workers = workers or globals()["workers"]
+    if workers <= 1 or len(paths) <= 1:
+        results = [scan_file(path) for path in paths]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(min(workers, len(paths))) as pool:
+            results = list(pool.map(scan_file, paths, chunksize=max(1, len(paths)//(4*workers))))
+    findings, files = [], []
+    for summary, found in results:
+        for severity in severities:
+            summary[severity+"s"] = sum(1 for finding in found if finding["severity"] == severity)
+        summary["status"] = next((severity for severity in severities if summary[severity+"s"] > 0), "ok")
+        files.append(summary)
+        findings += found
+    return findings, files
+
+def activity_paths(activity_id, interim=True, zarr=True):
+    paths = []
+    if interim: paths += [worklist.data_dir+f"interim/{activity_id}/"+name for name in worklist.interim_files(activity_id)]
+    if zarr: paths += [worklist.data_dir+f"zarr/{activity_id}/"+name for name in worklist.zarr_stores(activity_id)]
+    return paths
+
+def scan_activities(activity_ids=None, interim=True, zarr=True, workers=None):
+    paths = []
+    for activity_id in activity_ids or worklist.activity_ids:
+        paths += activity_paths(activity_id, interim, zarr)
+    return scan(paths, workers)
+
+def write_table(rows, path, columns=finding_columns):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+def counts(findings):
+    # {(check, severity): number of findings}
+    totals = {}
+    for finding in findings:
+        key = (finding["check"], finding["severity"])
+        totals[key] = totals.get(key, 0)+1
+    return totals
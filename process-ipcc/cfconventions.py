@@ -26,4 +26,62 @@ long_names["sic"] = "Sea Ice Area Fraction"
 long_names["rsdt"] = "TOA Incident Shortwave Radiation"
 long_names["rlut"] = "TOA Outgoing Longwave Radiation"
 long_names["rss"] = "Surface Net Shortwave Radiation"
-long_names["rls"] = "Surface Net Longwave Radiation"
\ No newline at end of file
+long_names["rls"] = "Surface Net Longwave Radiation"
+
+# Variable metadata copied from http://cfconventions.org/Data/cf-standard-names/27/build/cf-standard-name-table.html
+standard_dict = {}
+standard_dict['long_name'] = {
+    'tas': 'Near-Surface Air Temperature',
+    'psl': 'Sea Level Pressure',
+    'pr': 'Precipitation',
+    'rsds': 'Downwelling Shortwave Flux at Surface',
+    'sn': 'Snow Amount',
+    'tasmax': 'Maximum Near-Surface Air Temperature',
+    'tasmin': 'Minimum Near-Surface Air Temperature',
+    'sfcWind': 'Near-Surface Wind Speed'
+}
+standard_dict['description'] = {
+    'tas': 'temperature at 2-meter height',
+    'psl': 'not, in general, the same as surface pressure',
+    'pr': 'at surface; includes both liquid and solid phases from all types of clouds',
+    'rsds': """
+    The surface called "surface" means the lower boundary of the atmosphere. 
+    "shortwave" means shortwave radiation. Downwelling radiation is radiation from above.
+    It does not mean "net downward". Surface downwelling shortwave is the sum of direct
+    and diffuse solar radiation incident on the surface, and is sometimes called "global
+    radiation". When thought of as being incident on a surface, a radiative flux is
+    sometimes called "irradiance". In addition, it is identical with the quantity measured
+    by a cosine-collector light-meter and sometimes called "vector irradiance". In
+    accordance with common usage in geophysical disciplines, "flux" implies
+    per unit area, called "flux density" in physics.
+    """,
+    'sn': '"Amount" means mass per unit area.',
+    'tasmax': 'Monthly-mean daily-maximum temperature at 2-meter height',
+    'tasmin': 'Monthly-mean daily-minimum temperature at 2-meter height',
+    'sfcWind': """
+    'Speed is the magnitude of velocity. Wind is defined as a two-dimensional (horizontal)
+    air velocity vector, with no vertical component. (Vertical motion in the atmosphere has
+    the standard name upward_air_velocity.) The wind speed is the magnitude of the wind
+    velocity.'
+    """
+}
+standard_dict['standard_name'] = {
+    'tas': 'air_temperature',
+    'psl': 'air_pressure_at_sea_level',
+    'pr': 'precipitation_flux',
+    'rsds': 'surface_downwelling_shortwave_flux',
+    'sn': 'snow_amount',
+    'tasmax': 'air_temperature',
+    'tasmin': 'air_temperature',
+    'sfcWind': 'wind_speed'
+}
+standard_dict['units'] = {
+    'tas': 'K',
+    'psl': 'Pa',
+    'pr': 'kg m^-2 s^-1',
+    'rsds': 'W m^-2',
+    'sn': 'kg m^-2',
+    'tasmax': 'K',
+    'tasmin': 'K',
+    'sfcWind': 'm s^-1'
+}
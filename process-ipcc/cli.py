@@ -0,0 +1,184 @@
+import os
+import sys
+import argparse
+
+import worklist
+
+# Command line interface of the pipeline (scripts/process-ipcc):
+#
+#   process-ipcc decode-far                  # raw FAR binaries -> data/interim/FAR/
+#   process-ipcc reformat [SAR TAR]          # raw SAR/TAR GRIB1 files -> data/interim/<activity>/
+#   process-ipcc zarrify [FAR SAR TAR]       # interim NetCDF -> data/zarr/<activity>/ + catalogs
+#   process-ipcc rechunk [FAR SAR TAR]       # time-contiguous copies of the zarr stores
+#   process-ipcc catalog [FAR SAR TAR]       # rebuild the catalogs from the stores on disk
+#   process-ipcc publish [FAR SAR TAR]       # push stores and catalogs to Google Cloud Storage
+#   process-ipcc scan [FAR SAR TAR]          # header-only CF metadata audit of files and stores
+#
+# Every command builds its work list in one pass over the data directories and imports the
+# modules that do the work (xarray, netCDF4, the model definitions, ...) only when it runs,
+# so --help and --dry-run (print the work list and exit) return immediately.
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def enter_scripts_dir():
+    # the pipeline scripts use paths relative to scripts/
+    os.chdir(os.path.join(root, "scripts"))
+    for path in (os.path.join(root, "process-ipcc"), os.path.join(root, "scripts")):
+        if path not in sys.path: sys.path.append(path)
+
+def print_work(title, items):
+    print(f"{title}: {len(items)}")
+    for item in items:
+        print("  "+item)
+
+def catalog_path(activity_id, file_format):
+    return worklist.data_dir+f"zarr/{activity_id}/pangeo-{activity_id.lower()}.{file_format}"
+
+def decode_far_command(args):
+    files = worklist.far_files()
+    if args.dry_run: return print_work("FAR raw files", files)
+    import runpy
+    runpy.run_path("decode_FAR.py", run_name="__main__")
+
+def reformat_command(args):
+    work = {activity_id: worklist.raw_files(activity_id) for activity_id in args.activity_ids}
+    if args.dry_run:
+        for activity_id, files in work.items():
+            print_work(f"{activity_id} raw files", ["/".join(f) for f in files])
+        return
+    import reformat_SAR_and_TAR
+    reformat_SAR_and_TAR.write_netcdf = not args.no_netcdf
+    reformat_SAR_and_TAR.write_zarr = args.zarr
+    reformat_SAR_and_TAR.catalog_format = args.catalog_format
+    for activity_id, files in work.items():
+        reformat_SAR_and_TAR.reformat_activity(activity_id, files)
+
+def zarrify_command(args):
+    work = {activity_id: worklist.interim_files(activity_id) for activity_id in args.activity_ids}
+    if args.dry_run:
+        for activity_id, files in work.items():
+            print_work(f"{activity_id} interim files", files)
+        return
+    import catalog
+    import zarr_util
+    import zarrify_and_push_to_gcs
+    zarrify_and_push_to_gcs.write_pyramids = args.pyramids
+    for activity_id, files in work.items():
+        os.makedirs(zarr_util.zarr_dir+activity_id, exist_ok=True)
+        fs_dict = catalog.new_catalog_dict()
+        for ncfile in files:
+            zarrify_and_push_to_gcs.zarrify_file(activity_id, ncfile, fs_dict)
+        print(zarr_util.write_activity_catalog(fs_dict, activity_id, file_format=args.catalog_format))
+
+def rechunk_command(args):
+    work = {activity_id: worklist.zarr_stores(activity_id) for activity_id in args.activity_ids}
+    if args.dry_run:
+        for activity_id, stores in work.items():
+            print_work(f"{activity_id} zarr stores", stores)
+        return
+    import rechunk
+    import instrumentation
+    instrumentation.configure(worklist.data_dir+"zarr/stages_rechunk.jsonl")
+    for activity_id, stores in work.items():
+        copied = rechunk.rechunk_activity(
+            activity_id, zarr_names=stores, max_mem=args.max_mem,
+            catalog_format=args.catalog_format, overwrite=args.overwrite,
+        )
+        print(f"{activity_id}: {len(copied)} stores rechunked")
+
+def rebuild_catalog_command(args):
+    # catalog rows follow from the store paths, so no store is opened
+    work = {
+        activity_id: (
+            worklist.zarr_stores(activity_id),
+            set(worklist.zarr_stores(activity_id, "timeseries/")),
+            set(worklist.zarr_stores(activity_id, "pyramids/")),
+        )
+        for activity_id in args.activity_ids
+    }
+    if args.dry_run:
+        for activity_id, (stores, timeseries, pyramids) in work.items():
+            print_work(f"{activity_id} zarr stores", [
+                s+(" (+ timeseries)" if s in timeseries else "")+(" (+ pyramid)" if s in pyramids else "")
+                for s in stores
+            ])
+        return
+    import catalog
+    import zarr_util
+    for activity_id, (stores, timeseries, pyramids) in work.items():
+        fs_dict = catalog.new_catalog_dict()
+        for zarr_name in stores:
+            institution_id, source_id, experiment_id, member_id, table_id, variable_id, grid_label = zarr_name.strip("/").split("/")
+            zarr_util.append_catalog_row(fs_dict, activity_id, institution_id, source_id, experiment_id, member_id, variable_id, zarr_name)
+            if zarr_name in timeseries:
+                fs_dict["zstore_timeseries"][-1] = f"gs://ipcc-{activity_id.lower()}/{activity_id}/timeseries/"+zarr_name
+            if zarr_name in pyramids:
+                fs_dict["zstore_pyramid"][-1] = f"gs://ipcc-{activity_id.lower()}/{activity_id}/pyramids/"+zarr_name
+        print(zarr_util.write_activity_catalog(fs_dict, activity_id, file_format=args.catalog_format))
+
+def publish_command(args):
+    import publish
+    for activity_id in args.activity_ids:
+        path_to_catalog = catalog_path(activity_id, args.catalog_format)
+        if not os.path.exists(path_to_catalog):
+            print(f"{activity_id}: no catalog at {path_to_catalog}, skipped")
+            continue
+        publish.push_activity(activity_id, path_to_catalog, dry_run=args.dry_run)
+
+def scan_command(args):
+    import cfcheck
+    paths = []
+    for activity_id in args.activity_ids:
+        paths += cfcheck.activity_paths(activity_id, interim=not args.zarr_only, zarr=not args.interim_only)
+    if args.dry_run: return print_work("files and stores", paths)
+    findings, files = cfcheck.scan(paths, workers=args.workers)
+    os.makedirs(args.output, exist_ok=True)
+    cfcheck.write_table(findings, os.path.join(args.output, "findings.csv"))
+    cfcheck.write_table(files, os.path.join(args.output, "files.csv"), cfcheck.file_columns)
+    for (check, severity), n in sorted(cfcheck.counts(findings).items(), key=lambda item: cfcheck.severities.index(item[0][1])):
+        print(f"{severity:8s} {check:24s} {n}")
+    status = [summary["status"] for summary in files]
+    print(f"{len(files)} files and stores: "+", ".join(f"{status.count(s)} {s}" for s in ["ok"]+cfcheck.severities))
+    print(f"findings in {args.output}")
+
+def parser():
+    parser = argparse.ArgumentParser(prog="process-ipcc", description="Process the IPCC FAR/SAR/TAR model output archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name, func, help, activity_ids=None):
+        sub = commands.add_parser(name, help=help, description=help)
+        sub.set_defaults(func=func, all_activity_ids=activity_ids)
+        sub.add_argument("--dry-run", action="store_true", help="print the work list and exit")
+        if activity_ids is not None:
+            sub.add_argument("activity_ids", nargs="*", metavar="activity_id", help=f"{', '.join(activity_ids)} (default: all)")
+            sub.add_argument("--catalog-format", default="parquet", choices=["parquet", "csv"])
+        return sub
+
+    command("decode-far", decode_far_command, "decode the raw FAR binaries to interim NetCDF files")
+    sub = command("reformat", reformat_command, "reformat the raw SAR/TAR GRIB1 files to interim NetCDF files", ["SAR", "TAR"])
+    sub.add_argument("--zarr", action="store_true", help="also write the zarr stores and catalogs directly")
+    sub.add_argument("--no-netcdf", action="store_true", help="don't write interim NetCDF files")
+    sub = command("zarrify", zarrify_command, "write the interim NetCDF files to zarr stores and catalogs", worklist.activity_ids)
+    sub.add_argument("--pyramids", action="store_true", help="also write multiscale pyramids of the stores")
+    sub = command("rechunk", rechunk_command, "write time-contiguous copies of the zarr stores", worklist.activity_ids)
+    sub.add_argument("--max-mem", type=float, default=500e6, help="bytes held in memory per pass")
+    sub.add_argument("--overwrite", action="store_true", help="rewrite existing copies")
+    command("catalog", rebuild_catalog_command, "rebuild the catalogs from the zarr stores on disk", worklist.activity_ids)
+    command("publish", publish_command, "push the zarr stores and catalogs to Google Cloud Storage", worklist.activity_ids)
+    sub = command("scan", scan_command, "check the CF metadata of the interim files and zarr stores (headers only)", worklist.activity_ids)
+    sub.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parallel processes")
+    sub.add_argument("--output", default=worklist.data_dir+"audit/", help="directory of findings.csv and files.csv")
+    sub.add_argument("--interim-only", action="store_true", help="only the interim NetCDF files")
+    sub.add_argument("--zarr-only", action="store_true", help="only the zarr stores")
+    return parser
+
+def main(argv=None):
+    arguments = parser()
+    args = arguments.parse_args(argv)
+    if args.all_activity_ids is not None:
+        unknown = [activity_id for activity_id in args.activity_ids if activity_id not in args.all_activity_ids]
+        if unknown: arguments.error(f"unknown activity_id {', '.join(unknown)} (choose from {', '.join(args.all_activity_ids)})")
+        args.activity_ids = args.activity_ids or args.all_activity_ids
+    enter_scripts_dir()
+    args.func(args)
+    return 0
@@ -12,10 +12,25 @@ class cipher:
         baseline_idx = self.bytes_per_data_entry
         byte_idx = self.nbytes_header_cw + self.nbytes_header + self.nbytes_data_cw
         for (ndim, dim_idx) in zip(self.dims, list(range(len(self.dims)))):
-            byte_idx += baseline_idx * idx[dim_idx]
+            byte_idx = byte_idx + baseline_idx * idx[dim_idx]
             
             baseline_idx *= self.dims[dim_idx]
             if dim_idx == self.data_cw_dim:
                 baseline_idx += self.nbytes_data_cw
                 
-        return byte_idx
\ No newline at end of file
+        return byte_idx
+
+    def decode(self, records):
+        # Decode all data entries of a Fortran record file (fortran_records.record_file)
+        # at once. Data records are those of record_values entries (after record_skip
+        # bytes of per-record header); dims are ordered fastest-varying first, so the
+        # result has the same (dims) layout as decoding entry by entry with get_byte_index.
+        field_bytes = self.record_values*self.bytes_per_data_entry
+        offsets = records.field_offsets(field_bytes, skip=self.record_skip)
+        
+        # the first data entry located through the record index must agree with the cipher
+        if hasattr(self, "nbytes_header") and (offsets[0] != self.get_byte_index((0,)*len(self.dims))):
+            raise ValueError(f"{self.name}: record layout of {records.file_name} does not match the cipher")
+        
+        fields = records.fields(field_bytes, dtype=">f4", skip=self.record_skip)
+        return fields.reshape(self.dims[::-1]).T
@@ -0,0 +1,84 @@
+import numpy as np
+
+# Registry of derived variables for the FAR models.
+#
+# Each derived variable is declared as a function of the model and of named source
+# variables. Sources are either other derived variables or raw variables, which are
+# fetched by a model-specific function (e.g. the annual mean of one GISS header record).
+# Nothing is computed until an output asks for it, and every intermediate is computed
+# at most once per evaluator.
+
+class registry:
+    def __init__(self, name):
+        self.name = name
+        self.definitions = {}
+
+    def register(self, name, sources):
+        def decorator(func):
+            self.definitions[name] = (func, sources)
+            return func
+        return decorator
+
+    def __contains__(self, name):
+        return name in self.definitions
+
+class evaluator:
+    def __init__(self, registry, model, fetch):
+        self.registry = registry
+        self.model = model
+        self.fetch = fetch
+        self.cache = {}
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            if name in self.registry:
+                func, sources = self.registry.definitions[name]
+                self.cache[name] = func(self.model, *[self[source] for source in sources])
+            else:
+                self.cache[name] = self.fetch(name)
+        return self.cache[name]
+
+    def output(self, var_name, far_name):
+        # derived variables are registered under their output (CF) name,
+        # everything else is read directly from the source variable
+        if var_name in self.registry: return self[var_name]
+        return self[far_name]
+
+#=========== GFDL MODEL ==============
+gfdl = registry("GFDL")
+
+@gfdl.register("mrso", ["SOILM"])
+def gfdl_soil_moisture(model, soilm):
+    # apply mask to ocean for soil moisture content
+    # HFD 05/30/19: I think this ends up masking some very moist parts of land.
+    # This is where a proper land/ocean mask would be helpful.
+    mrso = np.copy(soilm)
+    mrso[mrso == 15.] = np.nan
+    return mrso
+
+#=========== GISS MODEL ==============
+giss = registry("GISS")
+
+@giss.register("zg", ["1000 MB GEOPOTENTIAL HEIGHT"])
+def giss_geopotential_height(model, z):
+    # express all pressures in terms of meters
+    return z + model.pres_height_offset[:,np.newaxis,np.newaxis,np.newaxis].astype(z.dtype)
+
+@giss.register("ta", ["zg"])
+def giss_layer_temperature(model, zg):
+    # convert geopotential height into approximate temperature of each layer
+    # using hydrostatic balance finite difference; returns (time, pressure, lat, lon)
+    dz = zg[:-1,...] - zg[1:,...]
+    Tf = -model.pres[:,np.newaxis,np.newaxis,np.newaxis]*9.81/287.*dz/model.dp[:,np.newaxis,np.newaxis,np.newaxis]
+    return Tf.swapaxes(0,1).astype(zg.dtype)
+
+@giss.register("rlut", ["NET THERMAL RADIATION AT P0"])
+def giss_toa_outgoing_longwave(model, net_thermal):
+    # sign convention for toa longwave flux
+    return -net_thermal
+
+@giss.register("rls", ["COMPOSITE NET RADIATION AT SURFACE", "COMPOSITE NET SOLAR RADIATION AT SURFCE"])
+def giss_surface_net_longwave(model, net, net_solar):
+    # calculate surface longwave flux from net flux and solar flux
+    # (note sign convention on longwave flux)
+    return -(net - net_solar)
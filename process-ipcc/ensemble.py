@@ -1,7 +1,15 @@
+import os
 import xarray as xr
 import pandas as pd
 import numpy as np
 
+import vertical
+import member_buffer
+import landsea
+import spatial_index
+import cache
+import prefetch
+
 def weighted_mean(da, dim=None, weights=None):
     if weights is None:
         return da.mean(dim)
@@ -22,8 +30,54 @@ def weighted_std(da, dim=None, weights=None):
             (da-weighted_mean(da, dim, weights)).sum(dim)**2 / total_weights
             )
 
+def randomized_svd(X, rank, n_oversamples=10, n_power_iter=4, seed=0):
+    # Truncated SVD of a 2D array by randomized range finding (Halko et al. 2011)
+    # with power iterations; QR re-orthonormalizes between iterations.
+    if hasattr(X, "dask"):
+        import dask.array as dsa
+        # tall-skinny QR (all samples in one chunk, space chunked)
+        X = X.rechunk({0: -1})
+        u, s, vt = dsa.linalg.svd_compressed(
+            X.T, rank, n_oversamples=n_oversamples, n_power_iter=n_power_iter, seed=seed,
+        )
+        return vt.T.compute(), s.compute(), u.T.compute()
+
+    rng = np.random.default_rng(seed)
+    omega = rng.standard_normal((X.shape[1], min(rank+n_oversamples, min(X.shape))))
+    Q, _ = np.linalg.qr(X @ omega)
+    for _ in range(n_power_iter):
+        Z, _ = np.linalg.qr(X.T @ Q)
+        Q, _ = np.linalg.qr(X @ Z)
+    u_b, s, vt = np.linalg.svd(Q.T @ X, full_matrices=False)
+    return (Q @ u_b)[:,:rank], s[:rank], vt[:rank]
+
+def baseline_climatology(da, baseline, x_dim="time"):
+    # Mean over the baseline years (inclusive) by month of the year if the baseline holds
+    # several months (monthly SAR/TAR data), the plain mean otherwise (decadal FAR means)
+    years = da[x_dim].dt.year
+    base = da.isel({x_dim: ((years >= baseline[0]) & (years <= baseline[1])).values})
+    if base.sizes[x_dim] == 0:
+        raise ValueError(f"no {x_dim} values in the baseline {baseline[0]}-{baseline[1]}")
+    months = base[x_dim].dt.month.rename("month")
+    if np.unique(months.values).size > 1:
+        return base.groupby(months).mean(x_dim).load()
+    return base.mean(x_dim).load()
+
+def subtract_climatology(da, climatology, x_dim="time"):
+    # lazy (dask) anomalies: the climatology is only broadcast along x_dim chunk by chunk
+    if da.chunks is None: da = da.chunk()
+    if "month" in climatology.dims:
+        position = pd.Index(climatology["month"].values).get_indexer(da[x_dim].dt.month.values)
+        if (position < 0).any():
+            raise ValueError("the baseline climatology lacks some months of the year")
+        climatology = climatology.chunk().isel(month=xr.DataArray(position, dims=[x_dim])).drop_vars("month")
+    anomalies = da - climatology
+    anomalies.attrs = dict(da.attrs)
+    return anomalies
+
 def open_dataset(file_path,name=None):
-    ds = xr.open_dataset(file_path)
+    # land-/ocean-only variables stored on their grid points are expanded lazily
+    ds = landsea.expand(xr.open_dataset(file_path))
     if name is None: ds.attrs['name'] = file_path.split('.')[-2].split('/')[-1]
     else: ds.attrs['name']=name
     return ds
@@ -37,35 +91,200 @@ class Ensemble:
         # variable data arrays along new dimension 'run'
         self.name = name
         self.ds_dict = dict(zip([run.attrs['name'] for run in ds_list],ds_list))
+        self.token = None
+        # read-ahead of members in loops over runs (0 = off); see prefetch.py
+        self.prefetch_depth = 0
+        self.prefetch_budget = 2e9
+        self.prefetch_stats = None
+        # baseline climatologies by (run, var_name, baseline, x_dim), see climatology()
+        self._climatologies = {}
+        # contiguous storage of the generated ensemble (see member_buffer.py): in memory,
+        # or memory-mapped under buffer_dir; buffer_reserve slots are kept for the
+        # multi-model mean and runs added later (the buffer grows beyond that)
+        self.buffer = None
+        self.buffer_dir = None
+        self.buffer_reserve = 1
+
+    @property
+    def token(self):
+        # identifies the state of the ensemble for the on-disk cache (see cache.py)
+        if self._token is None:
+            datasets = list(self.ds_dict.values()) + ([self.ds] if hasattr(self, "ds") else [])
+            self._token = cache.hash_strings(self.name, *[cache.dataset_token(ds) for ds in datasets])
+        return self._token
+
+    @token.setter
+    def token(self, value):
+        self._token = value
 
+    def members(self, dim=None, runs=None):
+        # (name, dataset) of every run (with dimension dim, among runs), loaded ahead in
+        # the background while the caller computes if prefetch_depth > 0
+        items = [
+            (ds, self.ds_dict[ds]) for ds in self.ds_dict.keys()
+            if ((dim is None) or (dim in self.ds_dict[ds].dims)) and ((runs is None) or (ds in runs))
+        ]
+        if self.prefetch_depth <= 0:
+            yield from items
+            return
+        reader = prefetch.prefetcher(items, depth=self.prefetch_depth, byte_budget=self.prefetch_budget)
+        self.prefetch_stats = reader.stats
+        yield from reader
+
+    @cache.memoized("runs")
     def to_common_spatiotemporal_grid(self,coords,**kwargs):
-        for ds in self.ds_dict.keys():
+        for ds, data in self.members():
             if 'time' in coords:
                 kwargs['fill_value'] = np.nan
-                self.ds_dict[ds] = self.ds_dict[ds].interp(
+                self.ds_dict[ds] = data.interp(
                     coords,
                     method="linear",
                     kwargs=kwargs,
                 )
             else:
-                self.ds_dict[ds] = self.ds_dict[ds].interp(
+                self.ds_dict[ds] = data.interp(
                     coords,
                     method="nearest",
                     kwargs=kwargs
                 )
 
+    @cache.memoized("runs")
+    def to_pressure_levels(self,new_pressure,method="log-linear",dim="pressure",
+                           source_pressure=None,surface_pressure=None,source_edges=None):
+        # Remap all runs onto new_pressure (see vertical.py). The optional source pressures
+        # (e.g. sigma*ps), surface pressures and layer interfaces are given per run name.
+        for ds, data in self.members(dim):
+            self.ds_dict[ds] = vertical.remap_dataset(
+                data,
+                new_pressure,
+                dim=dim,
+                method=method,
+                source_pressure=(source_pressure or {}).get(ds),
+                surface_pressure=(surface_pressure or {}).get(ds),
+                source_edges=(source_edges or {}).get(ds),
+            )
+
+    def climatology(self, var_name, baseline=(1961, 1990), x_dim="time"):
+        # Baseline climatology of var_name for every run (by month of the year for monthly
+        # runs; see baseline_climatology), as a dict by run name. Each run's climatology is
+        # computed in one pass over its baseline period and kept until the run is replaced
+        # (e.g. regridded), so repeated calls and anomalies() don't recompute it.
+        baseline = tuple(baseline)
+        key = lambda run: (run, var_name, baseline, x_dim)
+        stale = [
+            run for run in self.ds_dict.keys()
+            if (x_dim in self.ds_dict[run].dims)
+            and (self._climatologies.get(key(run), (None,))[0] is not self.ds_dict[run])
+        ]
+        for run, data in self.members(x_dim, runs=stale):
+            self._climatologies[key(run)] = (
+                self.ds_dict[run], baseline_climatology(data[var_name], baseline, x_dim),
+            )
+        return {
+            run: self._climatologies[key(run)][1]
+            for run in self.ds_dict.keys() if x_dim in self.ds_dict[run].dims
+        }
+
+    def anomalies(self, var_name, baseline=(1961, 1990), x_dim="time"):
+        # Anomalies of var_name about the baseline climatology for every run, as a dict of
+        # lazy DataArrays by run name (computed when read)
+        climatologies = self.climatology(var_name, baseline, x_dim)
+        anomalies = {}
+        for run, climatology in climatologies.items():
+            anomalies[run] = subtract_climatology(self.ds_dict[run][var_name], climatology, x_dim)
+            anomalies[run].attrs["anomaly_baseline"] = f"{baseline[0]}-{baseline[1]}"
+        return anomalies
+
+    @cache.memoized("runs")
+    def to_anomalies(self, var_name, baseline=(1961, 1990), x_dim="time"):
+        # Replace var_name in every run by its (lazy) anomalies, e.g. before generate_ensemble
+        for run, da in self.anomalies(var_name, baseline, x_dim).items():
+            self.ds_dict[run] = self.ds_dict[run].assign({var_name: da})
+
+    def buffered(self):
+        # True if self.ds is (still) the generated ensemble in self.buffer
+        return (
+            (self.buffer is not None) and hasattr(self, "ds")
+            and (list(self.ds.data_vars) == [self.buffer.name])
+            and self.buffer.backs(self.ds[self.buffer.name])
+        )
+
+    def update_views(self):
+        # point the runs and self.ds at the buffer again (after it was reallocated)
+        name = self.buffer.name
+        for run in self.buffer.runs:
+            if run in self.ds_dict:
+                self.ds_dict[run] = self.ds_dict[run].assign({name: self.buffer.member(run)})
+        self.ds = self.buffer.dataset().assign_attrs(self.ds.attrs)
+
+    def add_member(self, ds):
+        # Add a run; once the ensemble is generated, its variable goes into the next slot
+        # of the buffer (before the multi-model mean, which is updated)
+        run = ds.attrs['name']
+        if (not self.buffered()) or (self.buffer.name not in ds):
+            self.ds_dict[run] = ds
+            self.token = None
+            return
+        data = self.buffer.data
+        self.buffer.add(run, ds[self.buffer.name], attrs=ds.attrs) # checks the grid first
+        self.ds_dict[run] = ds
+        self.token = None
+        if 'mmm' in self.buffer.index:
+            mean = self.buffer.member('mmm').copy(data=self.buffer.mean(exclude=['mmm']))
+            self.buffer.add('mmm', mean, attrs={})
+        if self.buffer.data is not data:
+            self.update_views()
+        else:
+            self.ds_dict[run] = ds.assign({self.buffer.name: self.buffer.member(run)})
+            self.ds = self.buffer.dataset().assign_attrs(self.ds.attrs)
+
+    @cache.memoized("ensemble")
     def generate_ensemble(self,var_name):
-        ds = xr.concat(self.ds_dict.values(),dim='run')
-        self.ds = ds.update({'run': ('run', list(self.ds_dict.keys()))})
-        self.ds[var_name].attrs["units"] = (
-            self.ds_dict[list(self.ds_dict.keys())[0]][var_name].attrs["units"]
+        # The runs (on a common grid) are written one by one into a preallocated float32
+        # buffer; self.ds and var_name in the runs are views of it, so the ensemble takes
+        # no more memory than the runs did
+        runs = [run for run in self.ds_dict.keys() if var_name in self.ds_dict[run]]
+        first = self.ds_dict[runs[0]]
+        path = None
+        if self.buffer_dir is not None:
+            path = os.path.join(self.buffer_dir, f"{self.name}_{var_name}.npy")
+        self.buffer = member_buffer.member_buffer.like(
+            first[var_name], runs, reserve=self.buffer_reserve, path=path, last='mmm',
         )
+        for run, data in self.members(runs=runs):
+            self.buffer.add(run, data[var_name], attrs=data.attrs)
+            self.ds_dict[run] = data.assign({var_name: self.buffer.member(run)})
+        self.ds = self.buffer.dataset().assign_attrs(first.attrs)
+        self.ds[var_name].attrs["units"] = first[var_name].attrs["units"]
+
+    @cache.memoized("return")
+    def extract_points(self, lat, lon, method="nearest", point_dim="station"):
+        # Values at the points (lat, lon) of every run: one gather over the common grid
+        # of the ensemble if it was generated, otherwise one per run on its native grid
+        if hasattr(self, "ds"):
+            return spatial_index.extract(self.ds, lat, lon, method=method, point_dim=point_dim)
+        points = [
+            spatial_index.extract(ds, lat, lon, method=method, point_dim=point_dim)
+            for ds in self.ds_dict.values()
+        ]
+        out = xr.concat(points, dim='run')
+        return out.assign_coords({'run': ('run', list(self.ds_dict.keys()))})
 
+    @cache.memoized("ensemble")
     def multi_model_mean(self):
+        # on the buffer: the mean goes into the last slot
+        if self.buffered():
+            data = self.buffer.data
+            mean = self.buffer.member(self.buffer.runs[0]).copy(data=self.buffer.mean(exclude=['mmm']))
+            self.buffer.add('mmm', mean, attrs={})
+            if self.buffer.data is not data: self.update_views()
+            else: self.ds = self.buffer.dataset().assign_attrs(self.ds.attrs)
+            return
         ds_tmp = weighted_mean(self.ds, dim='run').expand_dims(dim='run')
         ds_tmp.coords['run']=['mmm']
         self.ds = xr.concat([self.ds, ds_tmp],dim='run')
 
+    @cache.memoized("ensemble")
     def calc_trends(self, var_name, x_dim = "time", include_uncertainty = False, include_intercept = False):
         trend_dims = list(self.ds[var_name].dims)
         trend_dims.remove(x_dim)
@@ -79,7 +298,7 @@ class Ensemble:
         
         reordered_dims = list(np.array(list(self.ds[var_name].dims))[reorder_idx])
         
-        n_cells = np.product(trend_shape)
+        n_cells = np.prod(trend_shape)
 
         # convert time to days on x-axis
         x = ((self.ds[x_dim]-np.datetime64('1990'))/np.timedelta64(1,'D')).values[:]
@@ -131,11 +350,99 @@ class Ensemble:
                 trend_unc_arr.reshape(trend_shape),dims=trend_dims
             )
             
+    @cache.memoized("ensemble")
+    def calc_rolling_trends(self, var_name, window, step=1, x_dim="time", min_count=2, include_intercept=False):
+        # Linear trends over every window of `window` consecutive samples along x_dim
+        # (starting every `step` samples), for all cells at once: the sums over each
+        # window of n, x, y, xy and x^2 are differences of cumulative sums, so the cost
+        # is O(n_time) per cell regardless of the number of windows. Missing values are
+        # left out of the sums; windows with fewer than min_count values give NaN.
+        # Works on dask arrays chunked over the other dimensions (not over x_dim).
+        y = self.ds[var_name]
+        if np.issubdtype(self.ds[x_dim].dtype, np.datetime64):
+            x = (self.ds[x_dim]-np.datetime64('1990'))/np.timedelta64(1,'D')
+        else:
+            x = self.ds[x_dim].astype("float64")
+        x0 = float(x.mean()) # center x to keep the sums well conditioned
+        x = x - x0
+
+        valid = y.notnull() & x.notnull()
+        x = x.where(valid, 0.)
+        y = y.astype("float64").where(valid, 0.)
+
+        n_x = self.ds.dims[x_dim]
+        starts = np.arange(0, n_x-window+1, step)
+        def window_sums(values):
+            cumulative = values.cumsum(x_dim).pad({x_dim: (1, 0)}, constant_values=0.)
+            upper = cumulative.isel({x_dim: starts+window}).drop_vars(x_dim, errors="ignore")
+            lower = cumulative.isel({x_dim: starts}).drop_vars(x_dim, errors="ignore")
+            return (upper-lower).rename({x_dim: "window_start"})
+
+        n = window_sums(valid.astype("float64"))
+        sx = window_sums(x)
+        sy = window_sums(y)
+        sxy = window_sums(x*y)
+        sxx = window_sums(x*x)
+
+        enough = n >= min_count
+        slope = ((n*sxy - sx*sy)/(n*sxx - sx**2)).where(enough)
+        coords = {"window_start": self.ds[x_dim].values[starts]}
+        self.ds[var_name+'_rolling_trend'] = (slope*365.25).assign_coords(coords) # convert to year^-1 units
+        self.ds[var_name+'_rolling_trend'].attrs["window"] = window
+
+        if include_intercept:
+            # intercept at x = 0 (1990 for time), as in calc_trends
+            y0 = ((sy - slope*sx)/n - slope*x0).where(enough)
+            self.ds[var_name+'_rolling_trend-y0'] = y0.assign_coords(coords)
+
+    @cache.memoized("return")
+    def eofs(self, var_name, n_modes=10, sample_dims=("run","time"), method="randomized",
+             n_oversamples=10, n_power_iter=4, seed=0):
+        """
+        Empirical orthogonal functions of var_name across the sample dimensions
+        """
+        # Anomalies (about the mean over samples) are weighted by sqrt(cos(latitude)) so
+        # that the modes are those of the area-weighted covariance; cells missing in any
+        # sample are left out. method="exact" uses a dense SVD (for comparison).
+        da = self.ds[var_name]
+        sample_dims = [dim for dim in sample_dims if dim in da.dims]
+        space_dims = [dim for dim in da.dims if dim not in sample_dims]
+        anomalies = da - da.mean(sample_dims)
+        if "latitude" in da.dims:
+            anomalies = anomalies*np.sqrt(np.cos(np.deg2rad(da["latitude"]))).clip(0., None)
+
+        X = anomalies.stack(sample=sample_dims, space=space_dims).transpose("sample", "space")
+        complete = X.notnull().all("sample").compute()
+        X = X.isel(space=complete.values)
+        data = X.data.astype("float64")
+
+        if method == "randomized":
+            u, s, vt = randomized_svd(data, n_modes, n_oversamples, n_power_iter, seed)
+        elif method == "exact":
+            u, s, vt = np.linalg.svd(np.asarray(data), full_matrices=False)
+            u, s, vt = u[:,:n_modes], s[:n_modes], vt[:n_modes]
+        else:
+            raise ValueError(f"unknown EOF method '{method}'")
+        total_variance = float((X**2).sum())
+
+        mode = np.arange(1, s.size+1)
+        patterns = xr.DataArray(vt, dims=["mode", "space"], coords={"mode": mode, "space": X["space"]})
+        patterns = patterns.unstack("space").reindex_like(da.isel({dim: 0 for dim in sample_dims}, drop=True))
+        if "latitude" in da.dims:
+            weights = np.sqrt(np.cos(np.deg2rad(da["latitude"]))).clip(0., None)
+            patterns = patterns/weights.where(weights > 0)
+        pcs = xr.DataArray(u*s, dims=["sample", "mode"], coords={"sample": X["sample"], "mode": mode}).unstack("sample")
+        return xr.Dataset({
+            var_name+"_eof": patterns.transpose("mode", *space_dims),
+            var_name+"_pc": pcs.transpose(*sample_dims, "mode"),
+            var_name+"_explained_variance": xr.DataArray(s**2/total_variance, dims=["mode"], coords={"mode": mode}),
+        })
+
+    @cache.memoized("runs")
     def to_default_grid(self,years=[1990,2020],dlon=3.,dlat=3.):
         new_longitude = np.arange(0+dlon/2.,360,dlon)
         new_latitude = np.arange(-90+dlat/2.,90,dlat)
         
-        reference_date = np.datetime64("1990","D")
         year = np.repeat(np.arange(years[0], years[1]),12).astype("int").astype("str")
         month = np.tile(np.arange(1,13),year.size//12+1)[0:year.size].astype("str")
         date = np.array(
@@ -153,13 +460,13 @@ class Ensemble:
             fill_value=None,
         )
 
-    def to_default_grid_pressure(self,years=[1990,2020]):
+    @cache.memoized("runs")
+    def to_default_grid_pressure(self,years=[1990,2020],vertical_method="log-linear",**kwargs):
         dlon = 3.; dlat = 3.;
         new_longitude = np.arange(0+dlon/2.,360,dlon)
         new_latitude = np.arange(-90+dlat/2.,90,dlat)
         new_pressure = np.array([950.,800.,650.,500.,350.,250.,175.,125.,100.,50.,25.])
         
-        reference_date = np.datetime64("1990","D")
         year = np.repeat(np.arange(years[0], years[1]),12).astype("int").astype("str")
         month = np.tile(np.arange(1,13),year.size//12+1)[0:year.size].astype("str")
         date = np.array(
@@ -169,9 +476,11 @@ class Ensemble:
         new_time = date
 
         self.to_common_spatiotemporal_grid(
-            {'latitude': new_latitude, 'longitude': new_longitude, 'pressure': new_pressure},
+            {'latitude': new_latitude, 'longitude': new_longitude},
             fill_value=None,
         )
+        # source pressure/surface pressure fields are given on the default grid
+        self.to_pressure_levels(new_pressure, method=vertical_method, **kwargs)
         self.to_common_spatiotemporal_grid(
             {'time': new_time},
             fill_value=None,
@@ -0,0 +1,91 @@
+import os
+import numpy as np
+
+# Reader for Fortran unformatted sequential files, as used for all FAR binaries.
+#
+# Every record is written as <4-byte length> <data> <4-byte length>. The markers are
+# scanned once to build an index of record offsets and lengths, which is saved next to
+# the file (<file>.records.npz) and reused as long as the file size and mtime match.
+# Records are then served as zero-copy views into a memory map of the file.
+
+index_suffix = ".records.npz"
+
+def scan_records(buffer, endian=">"):
+    marker = np.dtype(endian+"u4")
+    offsets = []
+    lengths = []
+    offset = 0
+    while offset < buffer.size:
+        length = int(np.frombuffer(buffer, dtype=marker, count=1, offset=offset)[0])
+        end = offset+4+length
+        if end+4 > buffer.size or int(np.frombuffer(buffer, dtype=marker, count=1, offset=end)[0]) != length:
+            raise ValueError(f"inconsistent Fortran record markers at byte {offset}")
+        offsets.append(offset)
+        lengths.append(length)
+        offset = end+4
+    return np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+class record_file:
+    def __init__(self, file_name, endian=">", use_cache=True):
+        self.file_name = file_name
+        self.endian = endian
+        self.buffer = np.memmap(file_name, dtype=np.uint8, mode="r")
+
+        stat = os.stat(file_name)
+        index_name = file_name+index_suffix
+        if use_cache and os.path.isfile(index_name):
+            index = np.load(index_name)
+            if (int(index["size"]) == stat.st_size) and (float(index["mtime"]) == stat.st_mtime):
+                self.offsets, self.lengths = index["offsets"], index["lengths"]
+                return
+
+        self.offsets, self.lengths = scan_records(self.buffer, endian)
+        if use_cache:
+            try:
+                np.savez(index_name, offsets=self.offsets, lengths=self.lengths, size=stat.st_size, mtime=stat.st_mtime)
+            except OSError: pass # e.g. read-only raw data directory
+
+    def __len__(self):
+        return self.offsets.size
+
+    def record_bytes(self, i):
+        start = self.offsets[i]+4
+        return self.buffer[start:start+self.lengths[i]]
+
+    def record(self, i, dtype=">f4", skip=0):
+        # data of record i (after skip bytes of per-record header) as a zero-copy view
+        dtype = np.dtype(dtype)
+        count = int(self.lengths[i]-skip)//dtype.itemsize
+        return np.frombuffer(self.buffer, dtype=dtype, count=count, offset=int(self.offsets[i])+4+skip)
+
+    def data_offsets(self, records, skip=0):
+        return self.offsets[records]+4+skip
+
+    def records(self, records=None, dtype=">f4", skip=0):
+        # stack of equal-length records (indices, slice or boolean mask) as one 2D array;
+        # evenly spaced records are served as a strided zero-copy view
+        if records is None: records = slice(None)
+        offsets = self.offsets[records]
+        lengths = self.lengths[records]
+        if offsets.size == 0:
+            return np.zeros((0, 0), dtype=dtype)
+        if np.any(lengths != lengths[0]):
+            raise ValueError("records of different lengths cannot be stacked")
+
+        dtype = np.dtype(dtype)
+        count = (int(lengths[0])-skip)//dtype.itemsize
+        strides = np.diff(offsets)
+        if offsets.size == 1 or np.all(strides == strides[0]):
+            stride = int(strides[0]) if offsets.size > 1 else int(lengths[0])+8
+            return np.ndarray(
+                shape=(offsets.size, count), dtype=dtype, buffer=self.buffer,
+                offset=int(offsets[0])+4+skip, strides=(stride, dtype.itemsize),
+            )
+        return np.stack([self.record(i, dtype, skip) for i in np.arange(self.offsets.size)[records]])
+
+    def fields(self, field_bytes, dtype=">f4", skip=0):
+        # all records holding one field of field_bytes bytes (after skip bytes of header)
+        return self.records(self.lengths == field_bytes+skip, dtype=dtype, skip=skip)
+
+    def field_offsets(self, field_bytes, skip=0):
+        return self.data_offsets(self.lengths == field_bytes+skip, skip=skip)
@@ -0,0 +1,338 @@
+import os
+import mmap
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray, BackendEntrypoint
+from xarray.core import indexing
+
+# Minimal GRIB edition 1 reader for the SAR/TAR archives of the IPCC-DDC.
+#
+# Only what these files use is supported: regular lat/lon (data representation 0) and
+# Gaussian (4) grids, optional bit-maps and grid-point data with simple packing.
+# Messages are indexed once per file (section headers only); the packed data of a
+# message is only read and unpacked when that message is indexed from the dataset.
+#
+# Dimension and variable names follow the PyNio conventions (e.g. TMP_GDS0_HTGL with
+# dimensions initial_time0_hours, g0_lat_1, g0_lon_2) so that either engine can be used
+# by reformat_SAR_and_TAR.py.
+
+# Subset of the WMO/NCEP parameter table 2: abbreviation, long name, units
+parameter_table = {
+    1: ("PRES", "Pressure", "Pa"),
+    2: ("PRMSL", "Pressure reduced to MSL", "Pa"),
+    7: ("HGT", "Geopotential height", "gpm"),
+    11: ("TMP", "Temperature", "K"),
+    15: ("TMAX", "Maximum temperature", "K"),
+    16: ("TMIN", "Minimum temperature", "K"),
+    32: ("WIND", "Wind speed", "m/s"),
+    33: ("UGRD", "u-component of wind", "m/s"),
+    34: ("VGRD", "v-component of wind", "m/s"),
+    59: ("PRATE", "Precipitation rate", "kg/m^2/s"),
+    61: ("APCP", "Total precipitation", "kg/m^2"),
+    65: ("WEASD", "Water equivalent of accumulated snow depth", "kg/m^2"),
+    66: ("SNOD", "Snow depth", "m"),
+    71: ("TCDC", "Total cloud cover", "%"),
+    91: ("ICEC", "Ice concentration (ice=1;no ice=0)", "proportion"),
+    111: ("NSWRS", "Net short wave radiation (surface)", "W/m^2"),
+    204: ("DSWRF", "Downward short wave radiation flux", "W/m^2"),
+}
+
+# Subset of the WMO level type table 3
+level_table = {
+    1: "SFC",
+    100: "ISBL",
+    102: "MSL",
+    105: "HTGL",
+}
+
+# Subset of the WMO originating center table
+center_table = {
+    1: "Melbourne (WMC)",
+    7: "US National Weather Service - NCEP (WMC)",
+    34: "Japanese Meteorological Agency - Tokyo (RSMC)",
+    54: "Canadian Meteorological Service - Montreal (RSMC)",
+    58: "US Navy - Fleet Numerical Oceanography Center",
+    59: "NOAA Forecast Systems Lab",
+    60: "National Center for Atmospheric Research (NCAR)",
+    74: "U.K. Met Office - Bracknell",
+    78: "Offenbach (RSMC)",
+    98: "European Centre for Medium-Range Weather Forecasts (RSMC)",
+}
+
+time_units = "hours since 1800-01-01 00:00"
+reference_time = np.datetime64("1800-01-01T00:00")
+
+def uint(buf, start, nbytes):
+    return int.from_bytes(buf[start:start+nbytes], "big")
+
+def sint(buf, start, nbytes):
+    # GRIB1 signed integers are sign-and-magnitude, not two's complement
+    value = uint(buf, start, nbytes)
+    sign_bit = 1 << (8*nbytes-1)
+    return -(value & ~sign_bit) if value & sign_bit else value
+
+def ibm_float(buf, start):
+    value = uint(buf, start, 4)
+    sign = -1. if value & 0x80000000 else 1.
+    exponent = (value >> 24) & 0x7f
+    mantissa = value & 0x00ffffff
+    return sign * mantissa * 16.**(exponent-64) / 2.**24
+
+def unpack_bits(data, nbits, n):
+    # Unpack n unsigned integers of nbits bits each, packed big-endian without padding
+    if nbits == 0:
+        return np.zeros(n, dtype=np.uint64)
+    if nbits in (8, 16, 32):
+        return np.frombuffer(data, dtype=f">u{nbits//8}", count=n).astype(np.uint64)
+
+    nbytes = (n*nbits+7)//8
+    width = (nbits+7+7)//8 # bytes spanned by one value at any bit offset
+    raw = np.zeros(nbytes+width, dtype=np.uint8)
+    raw[:nbytes] = np.frombuffer(data, dtype=np.uint8, count=nbytes)
+
+    bit = np.arange(n, dtype=np.uint64) * np.uint64(nbits)
+    byte = (bit >> np.uint64(3)).astype(np.intp)
+    window = np.zeros(n, dtype=np.uint64)
+    for k in range(width):
+        window = (window << np.uint64(8)) | raw[byte+k]
+    shift = np.uint64(8*width-nbits) - (bit & np.uint64(7))
+    return (window >> shift) & np.uint64((1 << nbits)-1)
+
+class grib1_message:
+    pass
+
+def parse_message(buf, offset):
+    msg = grib1_message()
+    msg.offset = offset
+    msg.length = uint(buf, offset+4, 3)
+    if buf[offset+7] != 1:
+        raise ValueError(f"GRIB edition {buf[offset+7]} message at byte {offset} is not supported")
+
+    # Section 1: product definition
+    pds = offset+8
+    pds_length = uint(buf, pds, 3)
+    msg.table_version = buf[pds+3]
+    msg.center = buf[pds+4]
+    flag = buf[pds+7]
+    msg.parameter = buf[pds+8]
+    msg.level_type = buf[pds+9]
+    msg.level = uint(buf, pds+10, 2)
+    century = buf[pds+24]
+    year = (century-1)*100 + buf[pds+12]
+    month, day, hour, minute = buf[pds+13], max(buf[pds+14], 1), buf[pds+15], buf[pds+16]
+    msg.time = np.datetime64(f"{year:04d}-{month:02d}-{day:02d}T{hour:02d}:{minute:02d}")
+    msg.time_range = buf[pds+20]
+    msg.p1 = buf[pds+18]
+    msg.decimal_scale = sint(buf, pds+26, 2)
+    section = pds+pds_length
+
+    # Section 2: grid description
+    if not flag & 128:
+        raise ValueError(f"GRIB message at byte {offset} has no grid description section")
+    gds_length = uint(buf, section, 3)
+    msg.grid_type = buf[section+5]
+    if msg.grid_type not in (0, 4):
+        raise NotImplementedError(f"GRIB1 grid type {msg.grid_type} is not supported")
+    if buf[section+4] != 255 and buf[section+3] == 0:
+        raise NotImplementedError("GRIB1 quasi-regular grids are not supported")
+    msg.ni = uint(buf, section+6, 2)
+    msg.nj = uint(buf, section+8, 2)
+    msg.la1 = sint(buf, section+10, 3)/1000.
+    msg.lo1 = sint(buf, section+13, 3)/1000.
+    msg.la2 = sint(buf, section+17, 3)/1000.
+    msg.lo2 = sint(buf, section+20, 3)/1000.
+    msg.n_gaussian = uint(buf, section+25, 2)
+    msg.scan_mode = buf[section+27]
+    if msg.scan_mode & 0x20:
+        raise NotImplementedError("GRIB1 grids with j-consecutive scanning are not supported")
+    section += gds_length
+
+    # Section 3: bit-map
+    msg.bitmap_offset = None
+    if flag & 64:
+        bms_length = uint(buf, section, 3)
+        if uint(buf, section+4, 2) != 0:
+            raise NotImplementedError("GRIB1 predefined bit-maps are not supported")
+        msg.bitmap_offset = section+6
+        section += bms_length
+
+    # Section 4: binary data
+    bds_flag = buf[section+3]
+    if bds_flag & 0xc0:
+        raise NotImplementedError("only GRIB1 grid-point data with simple packing is supported")
+    msg.binary_scale = sint(buf, section+4, 2)
+    msg.reference_value = ibm_float(buf, section+6)
+    msg.nbits = buf[section+10]
+    msg.data_offset = section+11
+    return msg
+
+def scan_messages(buf):
+    messages = []
+    offset = buf.find(b"GRIB")
+    while offset >= 0:
+        msg = parse_message(buf, offset)
+        messages.append(msg)
+        offset = buf.find(b"GRIB", offset+msg.length)
+    return messages
+
+def decode_message(buf, msg):
+    npoints = msg.ni*msg.nj
+    if msg.bitmap_offset is None:
+        present = None
+        nvalues = npoints
+    else:
+        present = np.unpackbits(
+            np.frombuffer(buf[msg.bitmap_offset:msg.bitmap_offset+(npoints+7)//8], dtype=np.uint8)
+        )[:npoints].astype(bool)
+        nvalues = int(present.sum())
+
+    packed = unpack_bits(
+        buf[msg.data_offset:msg.data_offset+(nvalues*msg.nbits+7)//8], msg.nbits, nvalues
+    )
+    values = (
+        (msg.reference_value + packed * 2.**msg.binary_scale) * 10.**(-msg.decimal_scale)
+    ).astype(np.float32)
+
+    if present is not None:
+        field = np.full(npoints, np.nan, dtype=np.float32)
+        field[present] = values
+        values = field
+    return values.reshape(msg.nj, msg.ni)
+
+def grid_coordinates(msg):
+    if msg.grid_type == 4:
+        nodes = np.polynomial.legendre.leggauss(2*msg.n_gaussian)[0]
+        lat = np.degrees(np.arcsin(nodes))
+        if msg.la1 > msg.la2: lat = lat[::-1]
+    else:
+        lat = np.linspace(msg.la1, msg.la2, msg.nj)
+    lo2 = msg.lo2
+    if (msg.lo2 < msg.lo1) and not (msg.scan_mode & 0x80): lo2 += 360.
+    lon = np.linspace(msg.lo1, lo2, msg.ni)
+    return lat.astype(np.float32), lon.astype(np.float32)
+
+# Message index of every file opened in this process, keyed by path, size and mtime
+_index_cache = {}
+
+def index_file(file_name):
+    stat = os.stat(file_name)
+    key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime)
+    if key not in _index_cache:
+        with open(file_name, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                _index_cache[key] = scan_messages(buf)
+    return _index_cache[key]
+
+class Grib1BackendArray(BackendArray):
+    def __init__(self, file_name, messages, shape):
+        # messages is a (time, level) nested list of messages, or (time,) for single-level fields
+        self.file_name = file_name
+        self.shape = shape
+        self.messages = np.empty(shape[:-2], dtype=object)
+        for idx in np.ndindex(self.messages.shape):
+            self.messages[idx] = messages[idx[0]] if len(idx) == 1 else messages[idx[0]][idx[1]]
+        self.dtype = np.dtype(np.float32)
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.BASIC, self._raw_indexing_method,
+        )
+
+    def _raw_indexing_method(self, key):
+        # only the messages selected along the leading (non-spatial) dimensions are decoded
+        nlead = len(self.shape)-2
+        selected = np.asarray(self.messages[key[:nlead]], dtype=object)
+
+        with open(self.file_name, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                out = np.empty(np.shape(selected)+tuple(self.shape[nlead:]), dtype=np.float32)
+                for idx in np.ndindex(np.shape(selected)):
+                    out[idx] = decode_message(buf, selected[idx])
+        return out[(Ellipsis,)+tuple(key[nlead:])]
+
+def open_grib1(file_name, drop_variables=None):
+    messages = index_file(file_name)
+
+    # group messages into variables by parameter, level type and grid
+    groups = {}
+    for msg in messages:
+        groups.setdefault((msg.parameter, msg.level_type, msg.grid_type, msg.ni, msg.nj), []).append(msg)
+
+    data_vars = {}
+    coords = {}
+    for (parameter, level_type, grid_type, ni, nj), group in groups.items():
+        abbrev, long_name, units = parameter_table.get(parameter, (f"VAR_{parameter}", f"parameter {parameter}", ""))
+        level_abbrev = level_table.get(level_type, str(level_type))
+        name = f"{abbrev}_GDS{grid_type}_{level_abbrev}"
+        if drop_variables is not None and name in drop_variables: continue
+
+        lat_name, lon_name = f"g{grid_type}_lat_1", f"g{grid_type}_lon_2"
+        lat, lon = grid_coordinates(group[0])
+        coords[lat_name] = xr.Variable(lat_name, lat, {"long_name": "latitude", "units": "degrees_north"})
+        coords[lon_name] = xr.Variable(lon_name, lon, {"long_name": "longitude", "units": "degrees_east"})
+
+        times = np.unique([msg.time for msg in group])
+        levels = np.unique([msg.level for msg in group])
+        by_key = {(msg.time, msg.level): msg for msg in group}
+        if len(by_key) != len(times)*len(levels):
+            raise ValueError(f"{name} in {file_name} is not a complete (time, level) hypercube")
+
+        time_name = "initial_time0_hours"
+        hours = ((times-reference_time)/np.timedelta64(1, "h")).astype(np.float64)
+        coords[time_name] = xr.Variable(time_name, hours, {"long_name": "initial time", "units": time_units})
+
+        if len(levels) > 1:
+            level_name = f"lv_{level_abbrev}3"
+            coords[level_name] = xr.Variable(level_name, levels, {"long_name": level_abbrev})
+            dims = (time_name, level_name, lat_name, lon_name)
+            msg_list = [[by_key[(t, l)] for l in levels] for t in times]
+            shape = (len(times), len(levels), nj, ni)
+        else:
+            dims = (time_name, lat_name, lon_name)
+            msg_list = [by_key[(t, levels[0])] for t in times]
+            shape = (len(times), nj, ni)
+
+        attrs = {
+            "center": center_table.get(group[0].center, str(group[0].center)),
+            "long_name": long_name,
+            "units": units,
+            "parameter_number": parameter,
+            "parameter_table_version": group[0].table_version,
+            "level_indicator": level_type,
+            "gds_grid_type": grid_type,
+            "forecast_time": group[0].p1,
+        }
+        if len(levels) == 1: attrs["level"] = int(levels[0])
+
+        data = indexing.LazilyIndexedArray(Grib1BackendArray(file_name, msg_list, shape))
+        data_vars[name] = xr.Variable(dims, data, attrs)
+
+    return xr.Dataset(data_vars, coords=coords)
+
+class Grib1BackendEntrypoint(BackendEntrypoint):
+    description = "Read simple-packed GRIB edition 1 files of the IPCC-DDC SAR/TAR archives"
+
+    open_dataset_parameters = ["filename_or_obj", "drop_variables", "decode_times"]
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None, decode_times=True, **kwargs):
+        ds = open_grib1(str(filename_or_obj), drop_variables=drop_variables)
+        if decode_times:
+            ds = xr.decode_cf(ds, decode_times=True, mask_and_scale=False)
+        return ds
+
+    def guess_can_open(self, filename_or_obj):
+        try:
+            with open(filename_or_obj, "rb") as f:
+                return f.read(4) == b"GRIB"
+        except (TypeError, OSError):
+            return False
+
+def max_abs_difference(file_name, reference_engine="pynio"):
+    # Compare values decoded here against another engine (e.g. PyNio) for every variable
+    ds = xr.open_dataset(file_name, engine=Grib1BackendEntrypoint)
+    ref = xr.open_dataset(file_name, engine=reference_engine)
+    diffs = {}
+    for name in ds.data_vars:
+        if name not in ref.data_vars: continue
+        diffs[name] = float(np.nanmax(np.abs(ds[name].values - ref[name].values.astype(np.float32))))
+    return diffs
@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import time
+import atexit
+import socket
+import resource
+import threading
+import traceback
+import functools
+import contextlib
+
+# Per-stage instrumentation of the pipeline scripts.
+#
+# Stages (open, decode, convert, aggregate, write, zarrify, upload) are wrapped in
+# `with stage(name, **fields) as s:` or decorated with @instrumented(name). Every stage
+# records wall and CPU time, bytes read and written (from /proc/self/io unless the stage
+# sets s.read_bytes/s.written_bytes itself, e.g. for memory-mapped input), the peak RSS
+# of the process so far and an item count (s.items), and is emitted as one JSON line to
+# log_path. If trace_path is set, all stages are also written as a Chrome trace
+# (chrome://tracing, Perfetto) when the process exits.
+#
+# Exceptions are recorded with their traceback; errors="log" then continues with the
+# next statement after the stage instead of re-raising (for per-file failures that
+# should not stop a full rebuild, but must not go unnoticed either).
+
+log_path = None
+trace_path = None
+echo_errors = True
+
+_trace_events = []
+_lock = threading.Lock()
+_t0 = time.perf_counter()
+
+def configure(log=None, trace=None):
+    global log_path, trace_path
+    log_path, trace_path = log, trace
+    if log_path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+
+def io_counters():
+    # characters read/written by this process (Linux); zeros elsewhere
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024.**2 if sys.platform == "darwin" else peak/1024.
+
+class stage_record:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.items = 0
+        self.read_bytes = None
+        self.written_bytes = None
+        self.error = None
+
+def emit(record):
+    with _lock:
+        if log_path is not None:
+            with open(log_path, "a") as f:
+                f.write(json.dumps(record, default=str)+"\n")
+
+@contextlib.contextmanager
+def stage(name, errors="raise", **fields):
+    s = stage_record(name, fields)
+    read0, written0 = io_counters()
+    cpu0 = time.process_time()
+    start = time.perf_counter()
+    status, error = "ok", None
+    try:
+        yield s
+    except Exception as e:
+        status, error = "error", "".join(traceback.format_exception_only(type(e), e)).strip()
+        s.error = error
+        details = traceback.format_exc()
+        if echo_errors:
+            print(f"\n[{name}] failed: {error}", file=sys.stderr)
+        if errors != "log":
+            raise
+    finally:
+        end = time.perf_counter()
+        read1, written1 = io_counters()
+        record = {
+            "stage": name,
+            "status": status,
+            "wall_s": end-start,
+            "cpu_s": time.process_time()-cpu0,
+            "read_bytes": s.read_bytes if s.read_bytes is not None else read1-read0,
+            "written_bytes": s.written_bytes if s.written_bytes is not None else written1-written0,
+            "peak_rss_mb": peak_rss_mb(),
+            "items": s.items,
+            "time": time.time(),
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            **s.fields,
+        }
+        if error is not None:
+            record["error"] = error
+            record["traceback"] = details
+        emit(record)
+        if trace_path is not None:
+            with _lock:
+                _trace_events.append({
+                    "name": name, "cat": status, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                    "ts": (start-_t0)*1e6, "dur": (end-start)*1e6,
+                    "args": {key: value for key, value in record.items() if key not in ("stage", "traceback", "time")},
+                })
+
+def instrumented(name, **stage_fields):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, function=func.__name__, **stage_fields):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def write_trace(path=None):
+    path = path or trace_path
+    if path is None: return
+    with _lock:
+        events = list(_trace_events)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+def summary(path=None):
+    # total wall/CPU time, bytes and items per stage of a JSON lines log
+    import pandas as pd
+    df = pd.read_json(path or log_path, lines=True)
+    return df.groupby(["stage", "status"])[["wall_s", "cpu_s", "read_bytes", "written_bytes", "items"]].sum()
+
+atexit.register(write_trace)
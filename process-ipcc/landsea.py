@@ -0,0 +1,138 @@
+import os
+import hashlib
+import numpy as np
+
+# Land-sea masks and CF "compression by gathering" for land-only and ocean-only fields.
+#
+# Masks are derived once per model grid, either from a supplied file (land area fraction)
+# or from the sentinel values the FAR models use for the other surface type, and cached
+# by a fingerprint of the grid coordinates (in memory and as <mask_dir>/<fingerprint>.npz).
+# Land-only (mrso, snd) and ocean-only (sic) variables are then stored on a 1D dimension
+# of land (ocean) points whose coordinate variable holds the flat index of every point in
+# the (latitude, longitude) grid and a "compress" attribute naming those dimensions
+# (CF conventions, section 8.2). expand() restores full grids lazily on reading.
+
+surface_types = {"mrso": "land", "snd": "land", "sic": "ocean"}
+point_dims = {"land": "landpoint", "ocean": "oceanpoint"}
+grid_dims = ("latitude", "longitude")
+
+mask_dir = "../data/interim/masks/"
+_mask_cache = {}
+
+def grid_fingerprint(lat, lon):
+    h = hashlib.sha1()
+    for coord in (lat, lon):
+        coord = np.ascontiguousarray(coord, dtype="<f8")
+        h.update(str(coord.shape).encode())
+        h.update(coord.tobytes())
+    return h.hexdigest()[:16]
+
+def read_mask_file(path, threshold=0.5):
+    # land where the land area fraction (first data variable, e.g. sftlf or lsm) exceeds threshold
+    import netCDF4 as nc
+    with nc.Dataset(path) as ncdata:
+        name = [name for name in ncdata.variables if name not in ncdata.dimensions][0]
+        fraction = np.ma.filled(ncdata.variables[name][...], 0.).squeeze()
+    if np.nanmax(fraction) > 1.: fraction = fraction/100. # percent
+    return fraction > threshold
+
+def land_mask(lat, lon, derive=None, path=None, use_cache=True):
+    # Boolean (latitude, longitude) array, True over land; None if no mask is available.
+    # derive() is only called if the mask of this grid is not cached yet.
+    fingerprint = grid_fingerprint(lat, lon)
+    if fingerprint in _mask_cache:
+        return _mask_cache[fingerprint]
+
+    cache_name = os.path.join(mask_dir, fingerprint+".npz")
+    if use_cache and os.path.isfile(cache_name):
+        mask = np.load(cache_name)["land"]
+    elif path is not None:
+        mask = read_mask_file(path)
+    elif derive is not None:
+        mask = np.asarray(derive(), dtype=bool)
+    else:
+        return None
+    if mask.shape != (np.size(lat), np.size(lon)):
+        raise ValueError(f"land-sea mask of shape {mask.shape} does not match the grid")
+
+    if use_cache:
+        try:
+            os.makedirs(mask_dir, exist_ok=True)
+            np.savez(cache_name, land=mask, lat=lat, lon=lon)
+        except OSError: pass
+    _mask_cache[fingerprint] = mask
+    return mask
+
+# sentinel-based masks: a grid point belongs to the other surface type if it
+# holds the sentinel at every time (time is the first axis)
+def gfdl_sentinel_mask(soilm):
+    # GFDL soil moisture is exactly 15 over the ocean
+    return np.any(soilm != 15., axis=0)
+
+def uktr_sentinel_mask(soilm_seaice):
+    # UKTR soil moisture (< 99.9) and sea ice (> 100, per thousand + 100) share one field
+    return np.any(soilm_seaice < 99.9, axis=0)
+
+def surface_mask(var_name, land):
+    # points of the surface type a variable is defined on, or None for global variables
+    if (land is None) or (var_name not in surface_types): return None
+    return land if surface_types[var_name] == "land" else ~land
+
+def gather(data, mask):
+    # (..., latitude, longitude) -> (..., points); data is returned as is without mask
+    if mask is None: return data
+    return np.asarray(data)[..., mask]
+
+def compressed_index(mask):
+    # flat (C order) index of the points of mask in the (latitude, longitude) grid
+    return np.flatnonzero(mask).astype(np.int32)
+
+def create_point_dimension(ncdata, var_name, mask):
+    # CF list of gathered points in a netCDF4 dataset/group (only created once per dimension)
+    dim = point_dims[surface_types[var_name]]
+    if dim not in ncdata.dimensions:
+        index = compressed_index(mask)
+        ncdata.createDimension(dim, index.size)
+        points = ncdata.createVariable(dim, "i4", (dim,))
+        points[:] = index
+        points.compress = " ".join(grid_dims)
+        points.long_name = f"{surface_types[var_name]} points"
+    return dim
+
+#=========== READING ==============
+class gathered_array:
+    # full-grid view of a gathered variable; only the requested leading entries are expanded
+    def __init__(self, variable, index, grid_shape):
+        self.variable = variable
+        self.index = np.asarray(index)
+        self.shape = variable.shape[:-1]+tuple(grid_shape)
+        self.dtype = np.dtype(variable.dtype) if variable.dtype.kind == "f" else np.dtype("f8")
+
+    def __getitem__(self, key):
+        from xarray.core import indexing
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self._raw_getitem)
+
+    def _raw_getitem(self, key):
+        lead, grid = key[:-2], key[-2:]
+        values = np.asarray(self.variable[lead+(slice(None),)])
+        full = np.full(values.shape[:-1]+(int(np.prod(self.shape[-2:])),), np.nan, dtype=self.dtype)
+        full[..., self.index] = values
+        return full.reshape(values.shape[:-1]+self.shape[-2:])[(Ellipsis,)+grid]
+
+def expand(ds):
+    # replace variables gathered on CF compressed dimensions by lazily expanded full grids
+    import xarray as xr
+    from xarray.core import indexing
+    ds = ds.copy()
+    for dim in list(ds.dims):
+        if (dim not in ds.coords) or ("compress" not in ds[dim].attrs): continue
+        compressed = ds[dim].attrs["compress"].split()
+        grid_shape = tuple(ds.sizes[name] for name in compressed)
+        index = ds[dim].values
+        for name in list(ds.data_vars):
+            var = ds[name].variable
+            if var.dims[-1:] != (dim,): continue
+            data = indexing.LazilyIndexedArray(gathered_array(var, index, grid_shape))
+            ds[name] = xr.Variable(var.dims[:-1]+tuple(compressed), data, var.attrs)
+        ds = ds.drop_vars(dim)
+    return ds
@@ -0,0 +1,140 @@
+import os
+import numpy as np
+import xarray as xr
+
+# Contiguous storage of one variable of all runs of an ensemble on a common grid.
+#
+# The values live in a single preallocated (run, time, [level], latitude, longitude) array
+# (float32 by default; optionally a memory-mapped .npy file), with a slot per run and a
+# small index holding the runs' names, slots and attributes. Runs are written into their
+# slot as they are added (dask arrays chunk by chunk), and xarray objects are views of the
+# buffer created on demand, so neither concatenating the runs nor reading the ensemble
+# copies the data. Statistics over runs work directly on the buffer. A run named `last`
+# (e.g. the multi-model mean) is kept in the last filled slot as further runs are added,
+# and the buffer is reallocated with more slots when all are taken (views created before
+# then still show the old array).
+
+dtype = np.float32
+
+class member_buffer:
+    def __init__(self, name, dims, coords, capacity, attrs=None, path=None, dtype=None, last=None):
+        # dims/coords: the common grid of the runs (without 'run'); capacity: number of slots
+        self.name = name
+        self.last = last
+        self.dims = tuple(dims)
+        self.coords = {dim: np.asarray(coords[dim]) for dim in self.dims}
+        self.attrs = dict(attrs or {})
+        self.path = path
+        self.data = self.allocate(capacity, dtype or globals()["dtype"], path)
+        self.index = {} # run name -> {"slot": ..., "attrs": ...}
+
+    def allocate(self, capacity, dtype, path):
+        shape = (capacity,)+tuple(self.coords[dim].size for dim in self.dims)
+        if path is None:
+            return np.full(shape, np.nan, dtype=dtype)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        data = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+        data[...] = np.nan
+        return data
+
+    @classmethod
+    def like(cls, da, runs, reserve=0, path=None, dtype=None, last=None):
+        # buffer for the runs (and `reserve` further slots) on the grid of da
+        return cls(da.name, da.dims, {dim: da[dim].values for dim in da.dims}, len(runs)+reserve,
+                   attrs=da.attrs, path=path, dtype=dtype, last=last)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def runs(self):
+        return sorted(self.index, key=lambda run: self.index[run]["slot"])
+
+    @property
+    def capacity(self):
+        return self.data.shape[0]
+
+    def check_grid(self, run, da):
+        for dim in self.dims:
+            if dim not in da.dims:
+                raise ValueError(f"run '{run}' has no dimension '{dim}'")
+            values = da[dim].values
+            if (values.shape != self.coords[dim].shape) or not (values == self.coords[dim]).all():
+                raise ValueError(f"run '{run}' is not on the grid of the ensemble along '{dim}' (regrid it first)")
+
+    def grow(self, capacity=None):
+        # reallocate with more slots (twice as many by default), keeping the filled ones
+        capacity = capacity or 2*self.capacity
+        if capacity <= self.capacity: return
+        n = len(self.index)
+        path = None if self.path is None else self.path+".grow"
+        data = self.allocate(capacity, self.data.dtype, path)
+        data[:n] = self.data[:n]
+        if path is not None:
+            data.flush()
+            os.replace(path, self.path)
+        self.data = data
+
+    def add(self, run, da, attrs=None):
+        # write da into the slot of run; a new run takes the next slot (before `last`,
+        # which moves up), growing the buffer if all slots are taken
+        self.check_grid(run, da)
+        if run in self.index:
+            slot = self.index[run]["slot"]
+        else:
+            if len(self.index) == self.capacity: self.grow()
+            slot = len(self.index)
+            if (self.last in self.index) and (run != self.last):
+                slot = self.index[self.last]["slot"]
+                self.data[slot+1] = self.data[slot]
+                self.index[self.last]["slot"] = slot+1
+        values = da.transpose(*self.dims).data
+        if hasattr(values, "dask"):
+            values.astype(self.data.dtype).store(self.data[slot], lock=False)
+        else:
+            self.data[slot] = values
+        self.index[run] = {"slot": slot, "attrs": dict(attrs if attrs is not None else da.attrs)}
+        return slot
+
+    def values(self):
+        # (run, ...) array of the filled slots (a view)
+        return self.data[:len(self.index)]
+
+    def member(self, run):
+        slot = self.index[run]["slot"]
+        return xr.DataArray(self.data[slot], dims=self.dims, coords=self.coords, name=self.name, attrs=self.attrs)
+
+    def dataarray(self):
+        runs = self.runs
+        return xr.DataArray(
+            self.values(), dims=("run",)+self.dims, coords={"run": runs, **self.coords},
+            name=self.name, attrs=self.attrs,
+        )
+
+    def dataset(self):
+        return self.dataarray().to_dataset()
+
+    def backs(self, da):
+        # True if da is a view of this buffer
+        return isinstance(da.variable._data, np.ndarray) and np.may_share_memory(da.variable._data, self.data)
+
+    def slots(self, exclude=()):
+        return [self.index[run]["slot"] for run in self.runs if run not in exclude]
+
+    def mean(self, exclude=()):
+        # mean over runs (but those excluded), ignoring missing values (accumulated in float64)
+        values = self.values()
+        if exclude: values = values[self.slots(exclude)]
+        count = np.isfinite(values).sum(axis=0)
+        total = np.nansum(values, axis=0, dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(count > 0, total/count, np.nan).astype(self.data.dtype)
+
+    def std(self, exclude=()):
+        values = self.values()
+        if exclude: values = values[self.slots(exclude)]
+        with np.errstate(invalid="ignore"):
+            return np.nanstd(values, axis=0, dtype=np.float64).astype(self.data.dtype)
+
+    def flush(self):
+        if isinstance(self.data, np.memmap): self.data.flush()
@@ -46,6 +46,10 @@ model.nbytes_header = 392
 model.nbytes_data_cw = 8
 model.bytes_per_data_entry = 4
 
+# Fortran record layout: a header record, then one record of nv values per grid point
+model.record_values = model.nv
+model.record_skip = 0
+
 ## Grid information from documentation
 # grid longitude
 model.lon = np.arange(0,360,7.5)
@@ -102,9 +106,9 @@ for line in lines:
     
     try:
         # characters 0:9 give index of variable
-        tmp_variable.first_index = np.int(line[0:9].split('-')[0])-1
+        tmp_variable.first_index = int(line[0:9].split('-')[0])-1
         try:
-            tmp_variable.last_index = np.int(line[0:9].split('-')[1])-1
+            tmp_variable.last_index = int(line[0:9].split('-')[1])-1
         except:
             tmp_variable.last_index = tmp_variable.first_index
     except: pass # ignore lines that do not fit the format for variables
@@ -149,6 +153,10 @@ model.nbytes_header = -16 # truncates first part of data_cw at beginning of file
 model.nbytes_data_cw = 16+256
 model.bytes_per_data_entry = 4
 
+# Fortran record layout: 256-byte header records alternating with one record per field
+model.record_values = model.nx*model.ny
+model.record_skip = 0
+
 ## Grid information from documentation
 # grid longitude
 model.lon = np.arange(1.875, 360, 3.75)
@@ -216,6 +224,10 @@ model.nbytes_header = 0
 model.nbytes_data_cw = 88 # 64+4 + 16+4
 model.bytes_per_data_entry = 4
 
+# Fortran record layout: one record per field, starting with an 80-character title
+model.record_values = model.nx*model.ny
+model.record_skip = 80
+
 ## Grid information from documentation
 model.lon = np.arange(0,360,10)
 model.lat = np.arange(-90,91,7.826)
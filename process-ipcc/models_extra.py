@@ -22,6 +22,12 @@ model.data_cw_dim = 1
 
 model.nheader = 1
 model.ndata = 144
+model.bytes_per_data_entry = 4
+
+# Fortran record layout (no cipher byte lengths: decoded through the record index only),
+# assumed to follow the transient GISS run: one record per field with an 80-character title
+model.record_values = model.nx*model.ny
+model.record_skip = 80
 
 ## Grid information from documentation
 model.lon = np.arange(0,360,10)
@@ -2,10 +2,16 @@ import os
 import netCDF4 as nc
 import numpy as np
 
-def far_to_netcdf(ncfile_name, model):
+import landsea
+
+def far_to_netcdf(ncfile_name, model, persist=True):
     
-    if os.path.isfile(ncfile_name): os.remove(ncfile_name)
-    ncdata = nc.Dataset(ncfile_name,"w","NETCDF4")    
+    # persist=False builds the file in memory only (e.g. when only zarr output is wanted)
+    if persist:
+        if os.path.isfile(ncfile_name): os.remove(ncfile_name)
+        ncdata = nc.Dataset(ncfile_name,"w","NETCDF4")
+    else:
+        ncdata = nc.Dataset(ncfile_name,"w","NETCDF4",diskless=True,persist=False)
 
     time = ncdata.createDimension('time', model.date.size)
     times = ncdata.createVariable("time", "f8",("time",));
@@ -28,4 +34,80 @@ def far_to_netcdf(ncfile_name, model):
     pressures[:] = model.pres
     pressures.units = 'hPa'
 
-    return ncdata
\ No newline at end of file
+    return ncdata
+
+class far_output:
+    """
+    Destination of the decoded variables of one FAR model run
+    """
+    # layout "variable": one file per variable (<var_name>_<run_label>.nc)
+    # layout "run": all variables in one file with shared coordinates (<run_label>.nc)
+    # layout "group": one file (<run_label>.nc) with a group per variable
+    #
+    # on_variable(ds, ncfile_name, var_name) is called with an (undecoded) xarray view
+    # of every finished variable, e.g. to write zarr stores from the same open file.
+    def __init__(self, save_dir, run_label, model, layout="variable", persist=True, on_variable=None):
+        if layout not in ("variable", "run", "group"):
+            raise ValueError(f"unknown NetCDF layout '{layout}'")
+        self.save_dir = save_dir
+        self.run_label = run_label
+        self.model = model
+        self.layout = layout
+        self.persist = persist
+        self.on_variable = on_variable
+        self.ncdata = None
+        self.var_names = []
+
+    def file_name(self, var_name):
+        if self.layout == "variable":
+            return self.save_dir+var_name+"_"+self.run_label+".nc"
+        return self.save_dir+self.run_label+".nc"
+
+    def _open(self, var_name):
+        if self.ncdata is None:
+            self.ncdata = far_to_netcdf(self.file_name(var_name), self.model, persist=self.persist)
+            self.ncdata.setncattr("institution",self.model.name)
+
+    def create_variable(self, var_name, datatype, dimensions, **kwargs):
+        self._open(var_name)
+        parent = self.ncdata.createGroup(var_name) if self.layout == "group" else self.ncdata
+        self.var_names.append(var_name)
+        return parent.createVariable(var_name, datatype, dimensions, **kwargs)
+
+    def create_gathered_variable(self, var_name, datatype, dimensions, mask, **kwargs):
+        # variable defined on the points of mask only (CF compression by gathering):
+        # the trailing (latitude, longitude) dimensions are replaced by a list of points
+        if mask is None:
+            return self.create_variable(var_name, datatype, dimensions, **kwargs)
+        self._open(var_name)
+        point_dim = landsea.create_point_dimension(self.ncdata, var_name, mask)
+        return self.create_variable(var_name, datatype, tuple(dimensions[:-2])+(point_dim,), **kwargs)
+
+    def _emit(self, var_name):
+        if self.on_variable is None: return
+        import xarray as xr
+        group = var_name if self.layout == "group" else None
+        ds = xr.open_dataset(xr.backends.NetCDF4DataStore(self.ncdata, group=group), decode_cf=False)
+        if group is not None:
+            # coordinates and global attributes live in the root group
+            root = xr.open_dataset(xr.backends.NetCDF4DataStore(self.ncdata), decode_cf=False)
+            ds = ds.assign_coords({name: root[name] for name in root.variables})
+            ds.attrs.update(root.attrs)
+        ds = ds.drop_vars([name for name in ds.data_vars if name != var_name])
+        self.on_variable(ds.load(), self.file_name(var_name), var_name)
+
+    def close_variable(self, var_name):
+        # per-variable files are finished as soon as their variable is
+        if self.layout == "variable":
+            self._emit(var_name)
+            self.ncdata.close()
+            self.ncdata = None
+            self.var_names = []
+
+    def close(self):
+        if self.ncdata is None: return
+        for var_name in self.var_names:
+            self._emit(var_name)
+        self.ncdata.close()
+        self.ncdata = None
+        self.var_names = []
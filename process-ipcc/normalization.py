@@ -0,0 +1,87 @@
+import functools
+import numpy as np
+
+# Per-institution quirks of the SAR/TAR archives, as data.
+#
+# Each rule applies to the runs matching all of its selectors (activity, variable,
+# substrings of the institution name or, with "institution_name", the exact name;
+# missing selectors match everything). The matching
+# rules are compiled, in order, into one set of actions per (activity, institution,
+# variable), so a new quirk is a new row here and not an extra pass over the data.
+rules = [
+    # missing data flag used in all archives
+    {"missing_value": -999.},
+    # precipitation from kg m^-2 day^-1 to kg m^-2 s^-1
+    {"variable": "pr", "scale": 1./(24.*60.*60.)},
+    # mean sea level pressure from mbar to Pa for some TAR models
+    {"activity": "TAR", "variable": "psl", "institution": ["CCCma", "CCSR", "CSIRO"], "scale": 100.},
+    # MPIfM latitudes are given in reversed order
+    {"institution_name": ["MPIfM"], "flip_latitude": True},
+    # GFDL mean sea level pressure is actually surface pressure: ignore it
+    {"variable": "psl", "institution": ["GFDL"], "skip": True},
+]
+
+class compiled_rule:
+    def __init__(self):
+        self.skip = False
+        self.missing_values = ()
+        self.scale = 1.
+        self.offset = 0.
+        self.flip_latitude = False
+
+def matches(rule, activity, institution, var_name):
+    if rule.get("activity", activity) != activity: return False
+    if rule.get("variable", var_name) != var_name: return False
+    if ("institution_name" in rule) and (institution not in rule["institution_name"]): return False
+    if "institution" in rule:
+        return any([name in institution for name in rule["institution"]])
+    return True
+
+@functools.lru_cache(maxsize=None)
+def compile_rules(activity, institution, var_name):
+    compiled = compiled_rule()
+    for rule in rules:
+        if not matches(rule, activity, institution, var_name): continue
+        if "missing_value" in rule:
+            compiled.missing_values += (rule["missing_value"],)
+        # compose affine transforms: (x*s1 + o1)*s2 + o2
+        scale, offset = rule.get("scale", 1.), rule.get("offset", 0.)
+        compiled.scale *= scale
+        compiled.offset = compiled.offset*scale + offset
+        compiled.flip_latitude = compiled.flip_latitude or rule.get("flip_latitude", False)
+        compiled.skip = compiled.skip or rule.get("skip", False)
+    return compiled
+
+def apply_rule(values, rule, block_size=2**16):
+    # Masking and scaling fused into a single in-place sweep over cache-sized blocks.
+    # Missing values are flagged on the raw values, before any scaling.
+    flat = values.reshape(-1)
+    scale = values.dtype.type(rule.scale)
+    offset = values.dtype.type(rule.offset)
+    for start in range(0, flat.size, block_size):
+        block = flat[start:start+block_size]
+        missing = np.zeros(block.shape, dtype=bool)
+        for missing_value in rule.missing_values:
+            missing |= (block == missing_value)
+        if rule.scale != 1.: block *= scale
+        if rule.offset != 0.: block += offset
+        block[missing] = np.nan
+    return values
+
+def normalize(ds, var_name, rule):
+    # Apply a compiled rule to ds[var_name] in place (after a single load/cast if needed)
+    variable = ds[var_name].variable
+    if variable.dtype.kind != "f":
+        ds[var_name] = ds[var_name].astype(np.float32)
+        variable = ds[var_name].variable
+    variable.load()
+    values = variable.values
+    if not (values.flags.writeable and values.flags.c_contiguous):
+        values = np.ascontiguousarray(values).copy()
+        variable.values = values
+    apply_rule(values, rule)
+
+    # relabel (not reorder) reversed latitudes
+    if rule.flip_latitude:
+        ds['latitude'].values = ds['latitude'].values[::-1]
+    return ds
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+# Global precision policy for the decoded model output.
+#
+# The raw FAR binaries store big-endian 32-bit floats and the SAR/TAR GRIB files pack
+# far fewer bits than that, so everything is kept as float32 from decoding to the
+# NetCDF and zarr outputs.
+float_dtype = "f4"
+
+# Opt-in bit-rounding: number of explicit mantissa bits to keep per variable
+# (float32 has 23). Rounding trailing bits to zero lets the compressor do its work.
+# e.g. keepbits = {"tas": 12, "pr": 8}
+keepbits = {}
+default_keepbits = None
+
+# Compression used when writing variables to NetCDF
+netcdf_compression = {"zlib": True, "shuffle": True, "complevel": 4}
+
+# Verification report: one row per rounded (or down-cast) variable
+report_columns = ["source", "variable", "dtype", "keepbits", "max_abs_error", "max_rel_error"]
+report = {column: [] for column in report_columns}
+
+def get_keepbits(var_name):
+    return keepbits.get(var_name, default_keepbits)
+
+def bitround(values, nbits):
+    # Round float32 values to nbits explicit mantissa bits (round to nearest, ties to even).
+    # NaNs and infinities are left untouched.
+    values = np.asarray(values, dtype=np.float32)
+    if nbits is None or nbits >= 23: return values.copy()
+    if nbits < 0: raise ValueError("number of mantissa bits to keep must be non-negative")
+
+    maskbits = 23 - nbits
+    half = np.uint32((1 << (maskbits-1)) - 1)
+    shave = np.uint32(~((1 << maskbits) - 1) & 0xffffffff)
+
+    bits = values.view(np.uint32).copy()
+    bits += ((bits >> np.uint32(maskbits)) & np.uint32(1)) + half
+    bits &= shave
+    rounded = bits.view(np.float32)
+    return np.where(np.isfinite(values), rounded, values)
+
+def record_error(source, var_name, reference, values, nbits=None):
+    reference = np.asarray(reference, dtype=np.float64)
+    error = np.abs(np.asarray(values, dtype=np.float64) - reference)
+    valid = np.isfinite(error)
+    nonzero = valid & (reference != 0.)
+
+    report["source"].append(source)
+    report["variable"].append(var_name)
+    report["dtype"].append(str(np.asarray(values).dtype))
+    report["keepbits"].append(nbits)
+    report["max_abs_error"].append(float(error[valid].max()) if valid.any() else np.nan)
+    report["max_rel_error"].append(
+        float((error[nonzero]/np.abs(reference[nonzero])).max()) if nonzero.any() else np.nan
+    )
+
+def apply(values, var_name, source=""):
+    # Cast to the policy dtype, bit-round if requested and record the resulting error
+    reference = np.asarray(values)
+    nbits = get_keepbits(var_name)
+    out = bitround(reference, nbits).astype(float_dtype)
+    record_error(source, var_name, reference, out, nbits)
+    return out
+
+def apply_to_ncvar(ncvar, var_name, source=""):
+    # In-place version for netCDF4 variables (as used by decode_FAR.py)
+    ncvar[...] = apply(np.ma.filled(ncvar[...], np.nan), var_name, source)
+
+def apply_to_dataarray(da, var_name, source=""):
+    return da.copy(data=apply(da.values, var_name, source))
+
+def netcdf_encoding(var_name):
+    encoding = {"dtype": float_dtype}
+    encoding.update(netcdf_compression)
+    return encoding
+
+def zarr_encoding(var_name):
+    # zarr stores keep their default (blosc) compressor
+    return {"dtype": float_dtype}
+
+def write_report(path):
+    # Write the rows recorded so far and start a new report
+    df = pd.DataFrame.from_dict(report)[report_columns]
+    df.to_csv(path, index=False)
+    for column in report_columns: report[column].clear()
+    return df
+
+def merge_reports(paths, path):
+    # One report from several written by write_report (e.g. per work item)
+    frames = [pd.read_csv(p) for p in paths]
+    df = pd.concat(frames, ignore_index=True)[report_columns] if frames else pd.DataFrame(columns=report_columns)
+    df.to_csv(path, index=False)
+    return df
@@ -0,0 +1,80 @@
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+# Read-ahead of ensemble members.
+#
+# While the caller computes on one member, the next `depth` members are loaded in
+# background threads (dask/zarr release the GIL while reading and decompressing, for
+# local as well as fsspec stores). Members are submitted only while the bytes of all
+# loaded-but-unconsumed members stay within byte_budget (at least one member is always
+# in flight), so a slow consumer holds back the readers instead of filling memory.
+# stats records how much of the load time was hidden behind computation.
+
+def open_member(path, storage_options=None):
+    # lazily opened member from a local path or fsspec URL of a zarr store
+    import xarray as xr
+    if "://" in path:
+        import fsspec
+        return xr.open_zarr(fsspec.get_mapper(path, **(storage_options or {})), consolidated=True)
+    return xr.open_zarr(path, consolidated=True)
+
+def load_member(member):
+    if isinstance(member, str): member = open_member(member)
+    return member.load()
+
+def member_nbytes(member):
+    if isinstance(member, str): return 0 # unknown before opening
+    return member.nbytes
+
+class prefetcher:
+    def __init__(self, items, depth=2, byte_budget=2e9, load=load_member, nbytes=member_nbytes):
+        # items: (key, member) pairs; members are datasets (possibly lazy) or zarr paths
+        self.items = list(items)
+        self.depth = depth
+        self.byte_budget = byte_budget
+        self.load = load
+        self.nbytes = nbytes
+        self.stats = {"members": 0, "load_seconds": 0., "wait_seconds": 0., "compute_seconds": 0., "overlap": None}
+        self._lock = threading.Lock()
+
+    def _timed_load(self, member):
+        start = time.perf_counter()
+        result = self.load(member)
+        with self._lock:
+            self.stats["load_seconds"] += time.perf_counter()-start
+        return result
+
+    def __iter__(self):
+        pending = collections.deque()
+        in_flight = 0
+        next_item = 0
+        with ThreadPoolExecutor(max_workers=max(self.depth, 1)) as pool:
+            while (next_item < len(self.items)) or pending:
+                # read ahead within depth and byte budget
+                while (next_item < len(self.items)) and (len(pending) <= self.depth):
+                    key, member = self.items[next_item]
+                    size = self.nbytes(member)
+                    if pending and (in_flight+size > self.byte_budget): break
+                    pending.append((key, pool.submit(self._timed_load, member), size))
+                    in_flight += size
+                    next_item += 1
+
+                key, future, size = pending.popleft()
+                start = time.perf_counter()
+                result = future.result()
+                self.stats["wait_seconds"] += time.perf_counter()-start
+
+                start = time.perf_counter()
+                yield key, result
+                self.stats["compute_seconds"] += time.perf_counter()-start
+                self.stats["members"] += 1
+                in_flight -= size
+        self._update_overlap()
+
+    def _update_overlap(self):
+        # fraction of the load time that ran concurrently with computation
+        load = self.stats["load_seconds"]
+        if load > 0:
+            self.stats["overlap"] = min(max(1.-self.stats["wait_seconds"]/load, 0.), 1.)
@@ -0,0 +1,34 @@
+import os
+
+import instrumentation
+
+# Upload of the zarr stores and catalogs of an activity to its Google Cloud Storage bucket
+# (gsutil must be installed and authenticated for the bucket).
+
+zarr_dir = "../data/zarr/"
+
+def bucket(activity_id):
+    return f"gs://ipcc-{activity_id.lower()}"
+
+def upload(command, activity_id):
+    # gsutil failures don't stop the other activities, but are logged with their exit status
+    with instrumentation.stage("upload", errors="log", activity_id=activity_id, command=command) as s:
+        status = os.system(command=command)
+        if status != 0: raise RuntimeError(f"gsutil exited with status {status}")
+    return s.error is None
+
+def push_activity(activity_id, path_to_catalog, dry_run=False):
+    commands = [
+        f"gsutil -m cp -r {zarr_dir}{activity_id} {bucket(activity_id)}/",
+        f"gsutil -m cp {zarr_dir}{activity_id}/pangeo-{activity_id.lower()}.json  {bucket(activity_id)}",
+        f"gsutil -m cp {path_to_catalog}  {bucket(activity_id)}",
+    ]
+    # csv copy of a parquet catalog, which the collection json points to
+    csv_catalog = os.path.splitext(path_to_catalog)[0]+".csv"
+    if csv_catalog != path_to_catalog:
+        commands.append(f"gsutil -m cp {csv_catalog}  {bucket(activity_id)}")
+    print(f"\nPush {activity_id} data to Google Cloud storage:")
+    for command in commands:
+        print(command)
+        if not dry_run: upload(command, activity_id)
+    return commands
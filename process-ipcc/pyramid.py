@@ -0,0 +1,127 @@
+import shutil
+import numpy as np
+import xarray as xr
+import zarr
+
+import landsea
+import zarr_util
+
+# Multiscale pyramids of the published zarr stores, for quick-look map browsing.
+#
+# A pyramid holds coarsened copies of a store: every temporal aggregation (the native
+# time steps and annual and decadal means where they reduce the time axis) at every
+# spatial level (level n averages blocks of factor**n x factor**n grid cells, weighted by
+# cell area ~ cos(latitude) and ignoring missing values). Each copy is a subgroup
+# <aggregation>/<level> of data/zarr/<activity>/pyramids/<zarr name>, with chunks of whole
+# maps, and the root group lists them in its "multiscales" attribute (zarr multiscales
+# convention), e.g.
+#
+#   {"multiscales": [{"name": "annual", "type": "area-weighted mean",
+#                     "datasets": [{"path": "annual/0", "coarsen": {"latitude": 1, "longitude": 1}, ...}, ...]},
+#                    ...]}
+#
+# Pyramids are registered in the zstore_pyramid column of the activity catalog.
+
+factor = 2
+max_levels = 3
+min_size = 4 # smallest latitude/longitude size of a level
+time_aggregations = {"annual": 1, "decadal": 10} # name: years per mean
+target_chunk_bytes = 2**20
+pyramids_dir = "pyramids/"
+spatial_dims = landsea.grid_dims
+time_dim = "time"
+
+def area_weights(lat):
+    return np.cos(np.deg2rad(lat)).clip(0., None)
+
+def coarsen(ds, n):
+    # area-weighted means over blocks of n x n cells (partial blocks at the edges)
+    if n == 1: return ds
+    weights = area_weights(ds[spatial_dims[0]])
+    blocks = {dim: n for dim in spatial_dims}
+    coarse = {}
+    for name, da in ds.data_vars.items():
+        w = weights.where(da.notnull(), 0.)
+        total = (da*w).coarsen(blocks, boundary="pad").sum()
+        coarse[name] = (total/w.coarsen(blocks, boundary="pad").sum()).assign_attrs(da.attrs)
+    coords = {dim: ds[dim].coarsen({dim: n}, boundary="pad").mean().assign_attrs(ds[dim].attrs) for dim in spatial_dims}
+    return xr.Dataset(coarse, attrs=ds.attrs).assign_coords(coords)
+
+def aggregate(ds, years):
+    # means over groups of `years` calendar years, at the first time step of each group;
+    # None if that doesn't shorten the time axis
+    groups = (ds[time_dim].dt.year.values//years)*years
+    keys, first = np.unique(groups, return_index=True)
+    if keys.size == ds.sizes[time_dim]: return None
+    aggregated = ds.groupby(xr.DataArray(groups, dims=[time_dim], name="group")).mean(time_dim, keep_attrs=True)
+    aggregated = aggregated.rename(group=time_dim).assign_coords({time_dim: ds[time_dim].values[first]})
+    aggregated[time_dim].attrs = ds[time_dim].attrs
+    return aggregated
+
+def levels(ds):
+    # coarsening factors of the spatial levels
+    factors = [1]
+    while len(factors) < max_levels:
+        n = factors[-1]*factor
+        if min(-(-ds.sizes[dim]//n) for dim in spatial_dims) < min_size: break
+        factors.append(n)
+    return factors
+
+def map_chunks(ds):
+    # whole maps, as many time steps per chunk as fit into target_chunk_bytes
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        chunks = [da.sizes[dim] for dim in da.dims]
+        if time_dim in da.dims:
+            map_bytes = da.dtype.itemsize*int(np.prod([da.sizes[dim] for dim in da.dims if dim != time_dim]))
+            chunks[da.dims.index(time_dim)] = max(1, min(da.sizes[time_dim], target_chunk_bytes//map_bytes))
+        encoding[name] = {"chunks": tuple(chunks)}
+    return encoding
+
+def write_pyramid(source_path, target_path):
+    # Pyramid of the store at source_path; returns the multiscales attribute written
+    ds = landsea.expand(xr.open_zarr(source_path))
+    ds = ds.drop_vars([name for name, da in ds.data_vars.items() if not set(spatial_dims) <= set(da.dims)])
+    for variable in ds.variables.values():
+        for key in ("chunks", "preferred_chunks"): variable.encoding.pop(key, None)
+
+    aggregations = {"native": ds}
+    if time_dim in ds.dims:
+        for name, years in time_aggregations.items():
+            aggregated = aggregate(ds, years)
+            if aggregated is not None: aggregations[name] = aggregated
+
+    factors = levels(ds)
+    multiscales = []
+    shutil.rmtree(target_path, ignore_errors=True)
+    for name, aggregated in aggregations.items():
+        datasets = []
+        for level, n in enumerate(factors):
+            path = f"{name}/{level}"
+            coarse = coarsen(aggregated, n)
+            coarse.to_zarr(target_path, group=path, mode="w", encoding=map_chunks(coarse), consolidated=False)
+            datasets.append({
+                "path": path, "level": level, "coarsen": {dim: n for dim in spatial_dims},
+                "shape": {dim: int(size) for dim, size in coarse.sizes.items()},
+            })
+        multiscales.append({"name": name, "type": "area-weighted mean", "time_aggregation": name, "datasets": datasets})
+
+    root = zarr.open_group(target_path, mode="a")
+    root.attrs.update({**ds.attrs, "multiscales": multiscales})
+    zarr.consolidate_metadata(target_path)
+    return multiscales
+
+def pyramid_path(activity_id, zarr_name):
+    return zarr_util.zarr_dir+f"{activity_id}/"+pyramids_dir+zarr_name
+
+def zstore_pyramid(activity_id, zarr_name):
+    return f"gs://ipcc-{activity_id.lower()}/{activity_id}/"+pyramids_dir+zarr_name
+
+def pyramid_store(activity_id, zarr_name, fs_dict=None):
+    # Pyramid of a store written by zarrify, recorded in its catalog row of fs_dict
+    write_pyramid(zarr_util.zarr_dir+f"{activity_id}/"+zarr_name, pyramid_path(activity_id, zarr_name))
+    if fs_dict is not None:
+        prefix = f"gs://ipcc-{activity_id.lower()}/{activity_id}/"
+        row = len(fs_dict["zstore"])-1-fs_dict["zstore"][::-1].index(prefix+zarr_name)
+        fs_dict["zstore_pyramid"][row] = zstore_pyramid(activity_id, zarr_name)
+    return pyramid_path(activity_id, zarr_name)
@@ -0,0 +1,140 @@
+import os
+import shutil
+import itertools
+import numpy as np
+import zarr
+
+import catalog
+import zarr_util
+import instrumentation
+
+# Time-contiguous copies of the published zarr stores.
+#
+# The stores are chunked map-first (one or a few time steps per chunk), so a point time
+# series touches every chunk. rechunk_store() writes a copy whose chunks hold the full time
+# axis for a small spatial tile, in at most two passes that each keep less than max_mem
+# bytes of data in memory (the two-stage plan of the rechunker package):
+#   1. read slabs of whole source time chunks (as many as fit) and write them to an
+#      intermediate store chunked (slab, target tile),
+#   2. read full time series of as many target tiles as fit and write the target chunks.
+# Both passes read and write whole chunks only. Arrays that fit into max_mem are copied
+# in a single pass.
+#
+# Copies go to data/zarr/<activity>/timeseries/<zarr name> and are registered in the
+# zstore_timeseries column of the activity catalog.
+
+max_mem = 500e6
+target_chunk_bytes = 2**20
+time_dim = "time"
+timeseries_dir = "timeseries/"
+
+def dims_of(array):
+    return list(array.attrs["_ARRAY_DIMENSIONS"])
+
+def timeseries_chunks(shape, dims, itemsize, chunk_bytes=None):
+    # the full time axis and a tile of the last (up to two) other dims holding about
+    # chunk_bytes; further dims (e.g. pressure) get one level per chunk
+    chunk_bytes = chunk_bytes or target_chunk_bytes
+    t = dims.index(time_dim)
+    other = [i for i in range(len(shape)) if i != t]
+    chunks = [1]*len(shape)
+    chunks[t] = shape[t]
+    tile = other[-2:]
+    points = max(1, int(chunk_bytes//(shape[t]*itemsize)))
+    side = max(1, int(points**(1./max(1, len(tile)))))
+    for i in tile:
+        chunks[i] = min(shape[i], side)
+    return tuple(chunks)
+
+def plan(shape, dims, itemsize, source_chunks, target_chunks, max_mem=None):
+    # [(chunks, block)] per pass: the chunks of the array written by the pass and the
+    # shape of the blocks it copies (each block is held in memory once)
+    max_mem = max_mem or globals()["max_mem"]
+    nbytes = lambda s: int(np.prod(s))*itemsize
+    if nbytes(shape) <= max_mem:
+        return [(tuple(target_chunks), tuple(shape))]
+    if nbytes(target_chunks) > max_mem:
+        raise ValueError(f"a target chunk {tuple(target_chunks)} needs more than max_mem={max_mem:.0f} bytes")
+
+    t = dims.index(time_dim)
+    slab = list(shape)
+    slab[t] = source_chunks[t]
+    if nbytes(slab) > max_mem:
+        raise ValueError(f"a slab of one source time chunk {tuple(slab)} needs more than max_mem={max_mem:.0f} bytes")
+    slab[t] = min(shape[t], source_chunks[t]*int(max_mem//nbytes(slab)))
+    intermediate = list(target_chunks)
+    intermediate[t] = slab[t]
+
+    # as many target chunks per block as fit, filling the fastest dims first
+    block = list(target_chunks)
+    budget = int(max_mem//nbytes(target_chunks))
+    for i in reversed(range(len(shape))):
+        if i == t: continue
+        n = min(-(-shape[i]//target_chunks[i]), max(1, budget))
+        block[i] = min(shape[i], target_chunks[i]*n)
+        budget //= n
+    return [(tuple(intermediate), tuple(slab)), (tuple(target_chunks), tuple(block))]
+
+def copy_blocks(source, dest, block):
+    for start in itertools.product(*[range(0, n, b) for (n, b) in zip(source.shape, block)]):
+        region = tuple(slice(i, min(i+b, n)) for (i, b, n) in zip(start, block, source.shape))
+        dest[region] = source[region]
+
+def create_like(group, name, array, chunks):
+    created = group.create_dataset(
+        name, shape=array.shape, chunks=chunks, dtype=array.dtype, compressor=array.compressor,
+        filters=array.filters, fill_value=array.fill_value, order=array.order, overwrite=True,
+    )
+    created.attrs.update(array.attrs.asdict())
+    return created
+
+def rechunk_array(array, name, dest_group, tmp_group, max_mem=None, chunk_bytes=None):
+    dims = dims_of(array)
+    if time_dim not in dims or array.ndim == 1:
+        create_like(dest_group, name, array, array.shape)[...] = array[...]
+        return
+    target_chunks = timeseries_chunks(array.shape, dims, array.dtype.itemsize, chunk_bytes)
+    passes = plan(array.shape, dims, array.dtype.itemsize, array.chunks, target_chunks, max_mem)
+    source = array
+    for n, (chunks, block) in enumerate(passes):
+        last = n == len(passes)-1
+        dest = create_like(dest_group if last else tmp_group, name, array, chunks)
+        copy_blocks(source, dest, block)
+        source = dest
+
+def rechunk_store(source_path, target_path, max_mem=None, chunk_bytes=None):
+    source = zarr.open_group(source_path, mode="r")
+    target = zarr.open_group(target_path, mode="w")
+    target.attrs.update(source.attrs.asdict())
+    tmp_path = target_path.rstrip("/")+".intermediate"
+    tmp = zarr.open_group(tmp_path, mode="w")
+    try:
+        for name, array in source.arrays():
+            rechunk_array(array, name, target, tmp, max_mem, chunk_bytes)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    zarr.consolidate_metadata(target_path)
+
+def rechunk_activity(activity_id, zarr_names=None, max_mem=None, catalog_format="parquet", overwrite=False):
+    # Time-contiguous copies of the stores of an activity (or the given ones), registered
+    # in its catalog; returns the names of the stores copied
+    path_to_catalog = zarr_util.zarr_dir+f"{activity_id}/pangeo-{activity_id.lower()}.{catalog_format}"
+    df = catalog.read_catalog(path_to_catalog)
+    df["zstore_timeseries"] = df["zstore_timeseries"].astype(str)
+    prefix = f"gs://ipcc-{activity_id.lower()}/{activity_id}/"
+    copied = []
+    for row, zstore in enumerate(df["zstore"].astype(str)):
+        zarr_name = zstore[len(prefix):]
+        if zarr_names is not None and zarr_name not in zarr_names: continue
+        source = zarr_util.zarr_dir+f"{activity_id}/"+zarr_name
+        target = zarr_util.zarr_dir+f"{activity_id}/"+timeseries_dir+zarr_name
+        if not os.path.exists(source): continue
+        if overwrite or not os.path.exists(target):
+            with instrumentation.stage("rechunk", activity_id=activity_id, zarr_name=zarr_name):
+                rechunk_store(source, target, max_mem)
+            copied.append(zarr_name)
+        df.loc[row, "zstore_timeseries"] = prefix+timeseries_dir+zarr_name
+    catalog.write_catalog(df, path_to_catalog, file_format=catalog_format)
+    if catalog_format != "csv":
+        catalog.write_catalog(df, zarr_util.csv_catalog_path(path_to_catalog), file_format="csv")
+    return copied
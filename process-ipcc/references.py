@@ -0,0 +1,296 @@
+import os
+import json
+import base64
+import numpy as np
+import pandas as pd
+
+import models
+import fortran_records
+import cfconventions
+
+# Virtual zarr datasets (kerchunk/fsspec reference format, version 1) on top of the raw
+# IPCC-DDC FAR binaries.
+#
+# The cipher of each model gives the byte position of every value, so every zarr chunk
+# can be mapped to a (file, offset, length) byte range of the original files: chunks
+# span the largest trailing block of dimensions that is contiguous on disk, up to
+# max_chunk_bytes (whole fields for UKTR and GISS, latitude rows of records for GFDL).
+# Linear unit conversions are expressed as CF scale_factor/add_offset attributes.
+#
+# The references expose the data as stored, not the interim NetCDF files:
+#  - UKTR and GISS variables are the monthly fields, with a month dimension (the
+#    interim files hold their annual means), and GISS longitudes are -180...170 in file
+#    order (the interim files are rolled to start at 0),
+#  - GFDL stores one record of all nv variables per grid point, so the references hold a
+#    single (time, latitude, longitude, record_value) array "records" whose record_value
+#    -2 and -1 are the Fortran control words before each record; record_variable()
+#    selects a variable from it (the per-variable metadata is in the attribute
+#    "record_variables"). Variables with one reference per value would need ~10^5 reads.
+# Outputs that need more than that (GISS ta and rls, the UKTR soil moisture/sea ice
+# split) are not available as virtual variables.
+
+itemsize = 4
+dtype = ">f4"
+reference_date = np.datetime64("1990","D")
+time_units = "days since 1990-1-1 0:0:0"
+max_chunk_bytes = 2**20
+
+class linear_probe:
+    # Stand-in for a netCDF4 variable, used to read off the scale and offset of the
+    # (linear) unit conversion functions in unit_conversion.py
+    def __init__(self):
+        self.values = np.array([0., 1.])
+        self.units = None
+    def __getitem__(self, key):
+        return self.values[key]
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+def flip_sign(ncvar):
+    # sign convention for toa longwave flux (GISS)
+    ncvar[...] = -ncvar[...]
+
+def linear_conversion(convert_units):
+    probe = linear_probe()
+    convert_units(probe)
+    return probe.values[1]-probe.values[0], probe.values[0], probe.units
+
+def element_offsets(model, order):
+    # byte offset of every value (dims ordered as in the cipher), transposed to order
+    offsets = model.get_byte_index(np.indices(model.dims))
+    return np.transpose(offsets, order)
+
+def record_offsets(model):
+    # byte offset of every entry of the GFDL records, (ny, nx, cw+nv), starting with the
+    # cw entries of Fortran control words before each record (so that records are adjacent)
+    offsets = element_offsets(model, (2, 1, 0))
+    cw = model.nbytes_data_cw//itemsize
+    return np.concatenate([offsets[..., :1]+itemsize*np.arange(-cw, 0), offsets], axis=-1)
+
+def chunking(offsets, file_ids):
+    # largest trailing block of dimensions whose values are contiguous in a single file
+    # (and that holds at most max_chunk_bytes, unless a single dimension does)
+    chunks = [1]*offsets.ndim
+    for k in range(offsets.ndim-1, -1, -1):
+        trial = [1]*k + list(offsets.shape[k:])
+        if k < offsets.ndim-1 and int(np.prod(trial))*itemsize > max_chunk_bytes: break
+        nblocks = int(np.prod(offsets.shape[:k]))
+        blocks = offsets.reshape(nblocks, -1)
+        files = file_ids.reshape(nblocks, -1)
+        if np.all(np.diff(blocks, axis=1) == itemsize) and np.all(files == files[:,:1]):
+            chunks = trial
+        else:
+            break
+    return chunks
+
+def encode_inline(values):
+    return "base64:"+base64.b64encode(np.ascontiguousarray(values, dtype="<f8").tobytes()).decode("ascii")
+
+def zarray(shape, chunks, dtype, fill_value="NaN"):
+    return json.dumps({
+        "chunks": [int(c) for c in chunks], "compressor": None, "dtype": dtype,
+        "fill_value": fill_value, "filters": None, "order": "C",
+        "shape": [int(s) for s in shape], "zarr_format": 2,
+    })
+
+def add_coordinate(refs, name, values, attrs):
+    refs[f"{name}/.zarray"] = zarray(np.shape(values), np.shape(values), "<f8")
+    refs[f"{name}/.zattrs"] = json.dumps({"_ARRAY_DIMENSIONS": [name], **attrs})
+    refs[f"{name}/0"] = encode_inline(values)
+
+def add_variable(refs, name, dims, offsets, file_ids, urls, attrs):
+    chunks = chunking(offsets, file_ids)
+    refs[f"{name}/.zarray"] = zarray(offsets.shape, chunks, dtype)
+    refs[f"{name}/.zattrs"] = json.dumps({"_ARRAY_DIMENSIONS": dims, **attrs})
+
+    nchunks = [s//c for (s, c) in zip(offsets.shape, chunks)]
+    length = int(np.prod(chunks))*itemsize
+    for chunk_idx in np.ndindex(*nchunks):
+        first = tuple(i*c for (i, c) in zip(chunk_idx, chunks))
+        refs[f"{name}/"+".".join([str(i) for i in chunk_idx])] = [
+            urls[int(file_ids[first])], int(offsets[first]), length
+        ]
+
+def variable_attrs(var_name, units, description, convert_units=None, missing_value=None):
+    attrs = {
+        "standard_name": cfconventions.standard_names[var_name],
+        "long_name": cfconventions.long_names[var_name],
+        "description": description,
+        "units": units,
+    }
+    if missing_value is not None:
+        attrs["missing_value"] = missing_value
+    if convert_units is not None:
+        scale, offset, units = linear_conversion(convert_units)
+        attrs["scale_factor"], attrs["add_offset"] = float(scale), float(offset)
+        if units is not None: attrs["units"] = units
+    return attrs
+
+def base_refs(model, institution):
+    refs = {
+        ".zgroup": json.dumps({"zarr_format": 2}),
+        ".zattrs": json.dumps({"Conventions": "CF-1.7", "institution": institution}),
+    }
+    add_coordinate(refs, "latitude", model.lat, {"units": "degrees north", "axis": "Y", "standard_name": "latitude"})
+    return refs
+
+def add_time(refs, dates):
+    add_coordinate(refs, "time", (dates-reference_date)/np.timedelta64(1, "D"), {"units": time_units, "axis": "T"})
+
+#=========== GFDL MODEL ==============
+def gfdl_refs(file_names, urls):
+    model = models.gfdl
+    refs = base_refs(model, model.name)
+    add_time(refs, model.date[:len(file_names)])
+    add_coordinate(refs, "longitude", model.lon, {"units": "degrees east", "axis": "X", "standard_name": "longitude"})
+    add_coordinate(refs, "pressure", model.pres, {"units": "hPa"})
+
+    # (ny, nx, cw+nv) records per file; one file per decade
+    offsets = record_offsets(model)
+    cw = offsets.shape[-1]-model.nv
+    add_coordinate(refs, "record_value", np.arange(-cw, model.nv), {"long_name": "index in the grid point record"})
+    nt = len(file_names)
+    var_offsets = np.broadcast_to(offsets, (nt,)+offsets.shape)
+    file_ids = np.broadcast_to(np.arange(nt)[:,None,None,None], var_offsets.shape)
+
+    record_variables = {}
+    for far_name, var_name in model.output_names.items():
+        var = model.variables[var_name]
+        units = "K" if var_name == "tas" else var.units
+        attrs = variable_attrs(
+            var_name, units, var.description.strip(), model.unit_conversions.get(far_name),
+            missing_value=15. if var_name == "mrso" else None,
+        )
+        record_variables[var_name] = {"first": int(var.first_index), "last": int(var.last_index), **attrs}
+    attrs = {
+        "long_name": "grid point records of all variables",
+        "description": "record_value < 0 are Fortran control words; see record_variables",
+        "record_variables": record_variables,
+    }
+    add_variable(refs, "records", ["time", "latitude", "longitude", "record_value"],
+                 np.ascontiguousarray(var_offsets), np.ascontiguousarray(file_ids), urls, attrs)
+    return refs
+
+def record_variable(ds, var_name):
+    # (time, [pressure], latitude, longitude) variable of a GFDL virtual dataset, decoded
+    # as described by the record_variables attribute of its records
+    info = dict(ds["records"].attrs["record_variables"][var_name])
+    first, last = info.pop("first"), info.pop("last")
+    da = ds["records"].sel(record_value=slice(first, last))
+    if last > first:
+        da = da.rename(record_value="pressure").assign_coords(pressure=ds["pressure"].values)
+    else:
+        da = da.isel(record_value=0, drop=True)
+    da = da.transpose("time", ..., "latitude", "longitude")
+    if "missing_value" in info: da = da.where(da != info.pop("missing_value"))
+    scale, offset = info.pop("scale_factor", 1.), info.pop("add_offset", 0.)
+    return (da*scale+offset).rename(var_name).assign_attrs(info)
+
+#=========== UKTR MODEL ==============
+def uktr_refs(file_names, urls):
+    model = models.uktr
+    refs = base_refs(model, model.name)
+    add_time(refs, model.date[:len(file_names)])
+    add_coordinate(refs, "month", np.arange(1, 13), {"long_name": "month of year"})
+    add_coordinate(refs, "longitude", model.lon, {"units": "degrees east", "axis": "X", "standard_name": "longitude"})
+
+    # (nv, nm, ny, nx) per file; one file per decade
+    offsets = element_offsets(model, (2, 3, 1, 0))
+    nt = len(file_names)
+    for far_name, var_name in model.output_names.items():
+        # soil moisture and sea ice share one field and are split by thresholds
+        if far_name in ("SOILM", "SEAICE"): continue
+        idx = model.var_shortnames.index(far_name)
+        field = offsets[model.var_idx[idx]]
+        var_offsets = np.broadcast_to(field, (nt,)+field.shape)
+        file_ids = np.broadcast_to(np.arange(nt)[:,None,None,None], var_offsets.shape)
+        attrs = variable_attrs(
+            var_name, model.var_units[idx], model.var_descriptions[idx], model.unit_conversions.get(far_name),
+        )
+        add_variable(refs, var_name, ["time", "month", "latitude", "longitude"],
+                     np.ascontiguousarray(var_offsets), np.ascontiguousarray(file_ids), urls, attrs)
+    return refs
+
+#=========== GISS MODEL ==============
+def giss_refs(file_names, urls):
+    model = models.giss
+    refs = base_refs(model, model.name)
+    add_time(refs, model.date)
+    add_coordinate(refs, "month", np.arange(1, 13), {"long_name": "month of year"})
+    # The documentation seems to give the wrong grid since the Greenwich Meridian is at lon=180 instead of lon=0;
+    # values are kept in file order, so longitudes start at -180 (monotonic)
+    add_coordinate(refs, "longitude", np.arange(-180., 180., 10.),
+                   {"units": "degrees east", "axis": "X", "standard_name": "longitude"})
+
+    # variable meta data from the record titles
+    records = fortran_records.record_file(file_names[0])
+    lines = [records.record_bytes(i)[:80].tobytes().decode("UTF-8") for i in range(model.nv)]
+    variables = models.get_variable_info(lines)
+
+    # (nv, nt, nm, ny, nx) in a single file
+    offsets = element_offsets(model, (2, 4, 3, 1, 0))
+    for far_name, var_name in model.output_names.items():
+        var = variables[far_name]
+        # derived from several source variables (see derived.py)
+        if var_name in ("ta", "rls"): continue
+        var_offsets = offsets[var.first_index]
+        file_ids = np.zeros(var_offsets.shape, dtype=int)
+        convert_units = model.unit_conversions.get(far_name)
+        if var_name == "rlut": convert_units = flip_sign
+        attrs = variable_attrs(var_name, var.units, var.description, convert_units)
+        add_variable(refs, var_name, ["time", "month", "latitude", "longitude"],
+                     np.ascontiguousarray(var_offsets), file_ids, urls, attrs)
+    return refs
+
+model_refs = {"GFDL": gfdl_refs, "UKTR": uktr_refs, "GISS": giss_refs}
+
+def generate(model_name, file_names, url_prefix=None):
+    # file_names: local raw files (one per decade for GFDL and UKTR); url_prefix replaces
+    # their directory in the references (e.g. a gs:// or https:// copy of the archive)
+    if url_prefix is None:
+        urls = [os.path.abspath(f) for f in file_names]
+    else:
+        urls = [url_prefix.rstrip("/")+"/"+os.path.basename(f) for f in file_names]
+    return {"version": 1, "refs": model_refs[model_name](file_names, urls)}
+
+def write_json(references, path):
+    with open(path, "w") as f:
+        json.dump(references, f)
+
+def write_parquet(references, path, record_size=10000):
+    # fsspec's parquet reference layout: metadata in .zmetadata, chunk references of
+    # every array in <array>/refs.<i>.parq with one row per chunk in C order
+    refs = references["refs"]
+    metadata = {key: json.loads(value) for key, value in refs.items() if key.split("/")[-1].startswith(".")}
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, ".zmetadata"), "w") as f:
+        json.dump({"metadata": metadata, "record_size": record_size}, f)
+
+    for key in metadata:
+        if not key.endswith("/.zarray"): continue
+        name = key[:-len("/.zarray")]
+        zarr_meta = metadata[key]
+        nchunks = [int(np.ceil(s/c)) for (s, c) in zip(zarr_meta["shape"], zarr_meta["chunks"])]
+        rows = {"path": [], "offset": [], "size": [], "raw": []}
+        for chunk_idx in np.ndindex(*nchunks):
+            ref = refs.get(f"{name}/"+".".join([str(i) for i in chunk_idx]))
+            if isinstance(ref, list):
+                rows["path"].append(ref[0]); rows["offset"].append(ref[1]); rows["size"].append(ref[2]); rows["raw"].append(None)
+            else:
+                raw = None if ref is None else base64.b64decode(ref[len("base64:"):])
+                rows["path"].append(None); rows["offset"].append(0); rows["size"].append(0); rows["raw"].append(raw)
+        df = pd.DataFrame(rows)
+        os.makedirs(os.path.join(path, name), exist_ok=True)
+        for i, start in enumerate(range(0, len(df), record_size)):
+            df.iloc[start:start+record_size].to_parquet(os.path.join(path, name, f"refs.{i}.parq"), index=False)
+
+def open_virtual_dataset(reference_path, remote_protocol="file", **storage_options):
+    import xarray as xr
+    return xr.open_dataset(
+        "reference://", engine="zarr",
+        backend_kwargs={
+            "consolidated": False,
+            "storage_options": {"fo": reference_path, "remote_protocol": remote_protocol,
+                                "remote_options": storage_options},
+        },
+    )
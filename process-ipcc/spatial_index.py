@@ -0,0 +1,93 @@
+import numpy as np
+import xarray as xr
+
+import landsea
+
+# Spatial index of a (latitude, longitude) grid for extracting values at arbitrary points.
+#
+# The grid points are stored as 3D unit vectors in a KD-tree, so nearest neighbours are
+# found by chord distance on the sphere without any special cases for the dateline,
+# the poles or irregular spacing (Gaussian latitudes, GISS bands). Bilinear neighbours
+# bracket each point along the sorted latitudes and (periodic) longitudes, so ascending,
+# descending and shifted coordinates all work. Indices are cached by grid fingerprint.
+
+_index_cache = {}
+
+def unit_vectors(lat, lon):
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+    return np.stack([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)], axis=-1)
+
+def bracket(coord, points, periodic=False):
+    # lower/upper indices into coord and weight of the upper neighbour for every point
+    order = np.argsort(coord)
+    sorted_coord = np.asarray(coord, dtype=np.float64)[order]
+    points = np.asarray(points, dtype=np.float64)
+    if periodic:
+        sorted_coord = np.append(sorted_coord, sorted_coord[0]+360.)
+        points = sorted_coord[0] + np.mod(points-sorted_coord[0], 360.)
+        lower = np.clip(np.searchsorted(sorted_coord, points, side="right")-1, 0, coord.size-1)
+        upper = lower+1
+        weight = (points-sorted_coord[lower])/(sorted_coord[upper]-sorted_coord[lower])
+        upper = np.mod(upper, coord.size)
+    else:
+        lower = np.clip(np.searchsorted(sorted_coord, points, side="right")-1, 0, coord.size-2)
+        upper = lower+1
+        # points beyond the outermost values take the edge value
+        weight = np.clip((points-sorted_coord[lower])/(sorted_coord[upper]-sorted_coord[lower]), 0., 1.)
+    return order[lower], order[upper], weight
+
+class grid_index:
+    def __init__(self, lat, lon):
+        from scipy.spatial import cKDTree
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        lon2d, lat2d = np.meshgrid(self.lon, self.lat)
+        self.tree = cKDTree(unit_vectors(lat2d.ravel(), lon2d.ravel()))
+
+    def nearest(self, lat, lon):
+        # (latitude, longitude) indices and weights, shape (points, 1)
+        _, flat = self.tree.query(unit_vectors(np.asarray(lat), np.asarray(lon)))
+        iy, ix = np.unravel_index(flat, (self.lat.size, self.lon.size))
+        return iy[:,np.newaxis], ix[:,np.newaxis], np.ones((iy.size, 1))
+
+    def bilinear(self, lat, lon):
+        # (latitude, longitude) indices and weights of the 4 surrounding grid points, shape (points, 4)
+        y0, y1, wy = bracket(self.lat, lat)
+        x0, x1, wx = bracket(self.lon, lon, periodic=True)
+        iy = np.stack([y0, y0, y1, y1], axis=-1)
+        ix = np.stack([x0, x1, x0, x1], axis=-1)
+        weights = np.stack([(1-wy)*(1-wx), (1-wy)*wx, wy*(1-wx), wy*wx], axis=-1)
+        return iy, ix, weights
+
+    def query(self, lat, lon, method="nearest"):
+        if method == "nearest": return self.nearest(lat, lon)
+        if method == "bilinear": return self.bilinear(lat, lon)
+        raise ValueError(f"unknown point extraction method '{method}'")
+
+def get_index(lat, lon):
+    fingerprint = landsea.grid_fingerprint(lat, lon)
+    if fingerprint not in _index_cache:
+        _index_cache[fingerprint] = grid_index(lat, lon)
+    return _index_cache[fingerprint]
+
+def extract(obj, lat, lon, method="nearest", point_dim="station", lat_dim="latitude", lon_dim="longitude"):
+    """
+    Values of a DataArray or Dataset at the points (lat, lon)
+    """
+    # one vectorized gather of all neighbours of all points (over all other dimensions),
+    # then a weighted sum over neighbours that leaves out missing values
+    lat, lon = np.atleast_1d(lat), np.atleast_1d(lon)
+    index = get_index(obj[lat_dim].values, obj[lon_dim].values)
+    iy, ix, weights = index.query(lat, lon, method)
+
+    dims = (point_dim, "neighbor")
+    values = obj.isel({lat_dim: xr.DataArray(iy, dims=dims), lon_dim: xr.DataArray(ix, dims=dims)})
+    values = values.drop_vars([lat_dim, lon_dim], errors="ignore")
+    weights = xr.DataArray(weights, dims=dims)
+    out = (values*weights).sum("neighbor")/weights.where(values.notnull()).sum("neighbor")
+    out = out.assign_coords({lat_dim: (point_dim, lat), lon_dim: (point_dim, lon)})
+    out.attrs = obj.attrs
+    if isinstance(obj, xr.Dataset):
+        for name in out.data_vars:
+            out[name].attrs = obj[name].attrs
+    return out
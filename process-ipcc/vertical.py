@@ -0,0 +1,171 @@
+import hashlib
+import collections
+import numpy as np
+import xarray as xr
+
+# Vertical remapping onto fixed pressure levels.
+#
+# Source pressures are either the (nominal) pressure coordinate of a dataset or a field
+# that varies by column, e.g. sigma levels times surface pressure for the GFDL model.
+# Weights are built once per (source pressures, target pressures, surface pressure,
+# method) and applied as array operations over all columns, runs and times at once.
+# Targets below the surface (or outside the source column) are masked.
+
+weights_cache_size = 32
+_weights_cache = collections.OrderedDict()
+
+def fingerprint(*arrays):
+    h = hashlib.sha1()
+    for a in arrays:
+        if a is None:
+            h.update(b"None")
+            continue
+        a = np.ascontiguousarray(a)
+        h.update(str((a.shape, a.dtype.str)).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+def weights_key(method, *arrays):
+    return (method, fingerprint(*arrays))
+
+def cached(key, build):
+    # weights of key from the cache, or built by build() and cached
+    if key in _weights_cache:
+        _weights_cache.move_to_end(key)
+        return _weights_cache[key]
+    weights = build()
+    _weights_cache[key] = weights
+    if len(_weights_cache) > weights_cache_size:
+        _weights_cache.popitem(last=False)
+    return weights
+
+def layer_edges(levels):
+    # layer interfaces halfway between levels (in log-pressure), last axis is the level axis
+    lp = np.log(levels)
+    mid = 0.5*(lp[...,1:] + lp[...,:-1])
+    first = lp[...,:1] - (mid[...,:1]-lp[...,:1])
+    last = lp[...,-1:] + (lp[...,-1:]-mid[...,-1:])
+    return np.exp(np.concatenate([first, mid, last], axis=-1))
+
+def edges_from_thickness(levels, thickness):
+    # layer interfaces of layers given by their mid-level pressures and thicknesses (e.g. GISS model.pres, model.dp)
+    levels, thickness = np.asarray(levels, dtype=np.float64), np.abs(np.asarray(thickness, dtype=np.float64))
+    order = np.argsort(levels)
+    levels, thickness = levels[order], thickness[order]
+    return np.concatenate([levels[:1]-thickness[:1]/2., levels+thickness/2.])
+
+def sigma_pressure(sigma, surface_pressure, dim="pressure"):
+    # pressure of sigma levels (e.g. GFDL model.sigm) in every column of a surface pressure field
+    return xr.DataArray(np.asarray(sigma), dims=[dim])*surface_pressure
+
+def log_linear_weights(source_p, target_p, surface_p=None):
+    # source_p (..., nsrc) increasing along the last axis; target_p (ntgt,)
+    # returns lower indices and weights of the upper neighbour (..., ntgt) and validity
+    def build_weights():
+        lp = np.log(source_p)
+        lt = np.log(target_p)
+        nsrc = lp.shape[-1]
+
+        count = (lp[...,np.newaxis,:] <= lt[:,np.newaxis]).sum(axis=-1)
+        i0 = np.clip(count-1, 0, nsrc-2)
+        l0 = np.take_along_axis(lp, i0, axis=-1)
+        l1 = np.take_along_axis(lp, i0+1, axis=-1)
+        w = (lt-l0)/(l1-l0)
+
+        valid = (lt >= lp[...,:1]) & (lt <= lp[...,-1:])
+        if surface_p is not None:
+            valid &= (target_p <= surface_p[...,np.newaxis])
+        return i0, w, valid
+    return cached(weights_key("log-linear", source_p, target_p, surface_p), build_weights)
+
+def conservative_weights(source_edges, target_edges, surface_p=None):
+    # layer overlap weights (..., ntgt, nsrc) from increasing interface pressures;
+    # the parts of layers below the surface do not count
+    def build_weights():
+        s_lo, s_hi = source_edges[...,np.newaxis,:-1], source_edges[...,np.newaxis,1:]
+        t_lo, t_hi = target_edges[:-1,np.newaxis], target_edges[1:,np.newaxis]
+        if surface_p is not None:
+            s_hi = np.minimum(s_hi, surface_p[...,np.newaxis,np.newaxis])
+        overlap = np.clip(np.minimum(s_hi, t_hi) - np.maximum(s_lo, t_lo), 0., None)
+
+        # keep target layers that are at least half covered by the source column
+        coverage = overlap.sum(axis=-1)
+        valid = coverage >= 0.5*(target_edges[1:]-target_edges[:-1])
+        return overlap, valid
+    return cached(weights_key("conservative", source_edges, target_edges, surface_p), build_weights)
+
+def apply_log_linear(x, i0, w, valid):
+    # x (..., columns..., nsrc); weights (columns..., ntgt)
+    lead = x.shape[:x.ndim-i0.ndim]
+    i0 = np.broadcast_to(i0, lead+i0.shape)
+    x0 = np.take_along_axis(x, i0, axis=-1)
+    x1 = np.take_along_axis(x, i0+1, axis=-1)
+    out = x0 + w*(x1-x0)
+    return np.where(valid, out, np.nan)
+
+def apply_conservative(x, overlap, valid):
+    present = np.isfinite(x)
+    x = np.where(present, x, 0.)
+    total = np.einsum("...ts,...s->...t", overlap, x)
+    norm = np.einsum("...ts,...s->...t", overlap, present.astype(overlap.dtype))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = total/norm
+    return np.where(valid & (norm > 0), out, np.nan)
+
+def remap(da, target, dim="pressure", method="log-linear", source_pressure=None, surface_pressure=None, source_edges=None):
+    """
+    Remap da along dim onto the target pressure levels
+    """
+    # source_pressure: DataArray of pressure at the levels of da (same units as target),
+    # by default the dim coordinate itself; it may vary by column (e.g. sigma*ps).
+    # surface_pressure: optional DataArray over the columns for below-ground masking.
+    # source_edges: layer interfaces for the conservative method (by default halfway
+    # between levels in log-pressure), increasing along the last axis.
+    target = np.asarray(target, dtype=np.float64)
+    if source_pressure is None:
+        source_pressure = da[dim].variable
+    if surface_pressure is not None:
+        source_pressure, surface_pressure = xr.broadcast(
+            xr.DataArray(source_pressure), xr.DataArray(surface_pressure), exclude=[dim]
+        )
+    col_dims = [d for d in da.dims if (d != dim) and (d in source_pressure.dims)]
+    lead_dims = [d for d in da.dims if (d != dim) and (d not in col_dims)]
+
+    source_p = source_pressure.transpose(*col_dims, dim).values
+    surface_p = None if surface_pressure is None else surface_pressure.transpose(*col_dims).values.astype(np.float64)
+
+    # work with increasing pressure along the level axis
+    x = da.transpose(*lead_dims, *col_dims, dim).values
+    ascending = source_p.reshape(-1, source_p.shape[-1])[0]
+    if ascending[0] > ascending[-1]:
+        source_p = source_p[...,::-1]
+        x = x[...,::-1]
+    target_order = np.argsort(target)
+    sorted_target = target[target_order]
+
+    if method == "log-linear":
+        i0, w, valid = log_linear_weights(np.asarray(source_p, dtype=np.float64), sorted_target, surface_p)
+        out = apply_log_linear(x, i0, w, valid)
+    elif method == "conservative":
+        if source_edges is None:
+            source_edges = layer_edges(np.asarray(source_p, dtype=np.float64))
+        source_edges = np.asarray(source_edges, dtype=np.float64)
+        overlap, valid = conservative_weights(source_edges, layer_edges(sorted_target), surface_p)
+        out = apply_conservative(x, overlap, valid)
+    else:
+        raise ValueError(f"unknown vertical remapping method '{method}'")
+    out = out[...,np.argsort(target_order)].astype(da.dtype if da.dtype.kind == "f" else np.float64)
+
+    coords = {d: da[d] for d in lead_dims+col_dims if d in da.coords}
+    coords[dim] = xr.Variable(dim, target, da[dim].attrs if dim in da.coords else {})
+    result = xr.DataArray(out, dims=lead_dims+col_dims+[dim], coords=coords, attrs=da.attrs, name=da.name)
+    return result.transpose(*[d for d in da.dims if d in result.dims], *[d for d in result.dims if d not in da.dims])
+
+def remap_dataset(ds, target, dim="pressure", **kwargs):
+    # remap every data variable with the vertical dimension; others are passed through
+    remapped = {name: remap(ds[name], target, dim=dim, **kwargs) for name in ds.data_vars if dim in ds[name].dims}
+    out = ds.drop_vars(list(remapped.keys())+[dim], errors="ignore")
+    out = out.assign_coords({dim: xr.Variable(dim, np.asarray(target), ds[dim].attrs if dim in ds.coords else {})})
+    for name, da in remapped.items():
+        out[name] = da
+    return out
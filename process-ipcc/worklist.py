@@ -0,0 +1,56 @@
+import os
+
+# Work lists of the pipeline stages, from a single pass over the data directories.
+# Standard library only, so that listing the work (dry runs, queueing) doesn't import
+# the numerical stack.
+
+data_dir = "../data/"
+activity_ids = ["FAR", "SAR", "TAR"] # as in zarr_util
+
+# subdirectories of data/zarr/<activity>/ that hold copies rather than published stores
+derived_store_dirs = ["timeseries", "pyramids"]
+
+def entries(path):
+    try:
+        with os.scandir(path) as it:
+            return sorted((entry for entry in it if not entry.name.startswith(".")), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return []
+
+def raw_files(activity_id):
+    # (institution, var_name, file_name) of the raw SAR/TAR files
+    files = []
+    for institution in entries(data_dir+f"raw/{activity_id}/"):
+        if not institution.is_dir(): continue
+        for var in entries(institution.path):
+            if not var.is_dir(): continue
+            files += [(institution.name, var.name, entry.name) for entry in entries(var.path) if entry.is_file()]
+    return files
+
+def far_files():
+    # raw FAR files (relative to data/raw/FAR/), all decoded together by decode_FAR.py
+    files = []
+    def walk(path, prefix):
+        for entry in entries(path):
+            if entry.is_dir(): walk(entry.path, prefix+entry.name+"/")
+            else: files.append(prefix+entry.name)
+    walk(data_dir+"raw/FAR/", "")
+    return files
+
+def interim_files(activity_id):
+    return [entry.name for entry in entries(data_dir+f"interim/{activity_id}/") if entry.name.endswith(".nc")]
+
+def zarr_stores(activity_id, subdir=""):
+    # zarr names (institution/source/experiment/member/table/variable/grid/) of the stores
+    # in data/zarr/<activity>/<subdir>, found by their group metadata
+    stores = []
+    def walk(path, prefix, depth):
+        for entry in entries(path):
+            if not entry.is_dir(): continue
+            if depth == 0 and subdir == "" and entry.name in derived_store_dirs: continue
+            if depth == 6:
+                if os.path.exists(os.path.join(entry.path, ".zgroup")): stores.append(prefix+entry.name+"/")
+            else:
+                walk(entry.path, prefix+entry.name+"/", depth+1)
+    walk(data_dir+f"zarr/{activity_id}/"+subdir, "", 0)
+    return stores
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+
+import instrumentation
+
+# Work queue for running a rebuild on several nodes.
+#
+# The pipeline enumerates work items (a raw or interim file and the handler that processes
+# it) into a SQLite ledger on a shared filesystem. Workers on any node claim items one at a
+# time with a lease: claims happen inside an exclusive (BEGIN IMMEDIATE) transaction, so two
+# workers never claim the same item, and a worker thread renews the lease while the item is
+# processed. Leases of crashed workers expire, and their items are re-queued (or marked
+# failed after max_attempts). Failed items are retried the same way, after the items
+# queued in the meantime.
+#
+# Handlers return a JSON-serializable result (e.g. catalog rows), which is stored with the
+# item, and optionally follow-up items (e.g. zarrify an interim file once it is written).
+#
+# The ledger uses SQLite's default rollback journal: WAL mode needs shared memory and does
+# not work across nodes. The shared filesystem must support POSIX locks (NFSv4, Lustre, ...).
+
+lease_seconds = 600.
+max_attempts = 3
+poll_seconds = 10.
+
+schema = """
+create table if not exists items (
+    item_id text primary key,
+    kind text not null,
+    activity_id text,
+    args text not null,
+    status text not null default 'pending',
+    attempts integer not null default 0,
+    max_attempts integer not null,
+    worker text,
+    lease_expires real,
+    queued real,
+    started real,
+    finished real,
+    error text,
+    result text
+)
+"""
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+def work_item(kind, activity_id=None, **args):
+    # item ids are deterministic, so enumerating the same work twice doesn't duplicate it
+    item_id = kind+":"+(activity_id or "")+":"+json.dumps(args, sort_keys=True)
+    return {"item_id": item_id, "kind": kind, "activity_id": activity_id, "args": args}
+
+class transaction:
+    # exclusive write transaction on a fresh connection (safe to use from any thread)
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __enter__(self):
+        self.db = self.queue.connect()
+        self.db.execute("begin immediate")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("commit" if exc_type is None else "rollback")
+        self.db.close()
+
+class ledger:
+    def __init__(self, path, lease=None, attempts=None):
+        self.path = path
+        self.lease = lease or lease_seconds
+        self.max_attempts = attempts or max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.transaction() as db:
+            db.execute(schema)
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=120, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def transaction(self):
+        return transaction(self)
+
+    def add(self, items):
+        now = time.time()
+        with self.transaction() as db:
+            before = db.total_changes
+            db.executemany(
+                "insert or ignore into items (item_id, kind, activity_id, args, max_attempts, queued) values (?, ?, ?, ?, ?, ?)",
+                [(item["item_id"], item["kind"], item["activity_id"], json.dumps(item["args"]), self.max_attempts, now) for item in items],
+            )
+            return db.total_changes-before
+
+    def requeue_expired(self, db, now):
+        # items whose worker stopped renewing its lease
+        db.execute(
+            "update items set status = case when attempts >= max_attempts then 'failed' else 'pending' end, "
+            "worker = null, lease_expires = null, error = 'lease expired (worker ' || worker || ')' "
+            "where status = 'running' and lease_expires < ?", (now,),
+        )
+
+    def claim(self, worker, kinds=None):
+        now = time.time()
+        with self.transaction() as db:
+            self.requeue_expired(db, now)
+            query = "select * from items where status = 'pending'"
+            params = []
+            if kinds:
+                query += " and kind in ("+",".join("?"*len(kinds))+")"
+                params += list(kinds)
+            row = db.execute(query+" order by queued, rowid limit 1", params).fetchone()
+            if row is None: return None
+            db.execute(
+                "update items set status = 'running', worker = ?, lease_expires = ?, started = ?, attempts = attempts + 1 where item_id = ?",
+                (worker, now+self.lease, now, row["item_id"]),
+            )
+            row = db.execute("select * from items where item_id = ?", (row["item_id"],)).fetchone()
+        item = dict(row)
+        item["args"] = json.loads(item["args"])
+        return item
+
+    def heartbeat(self, item_id, worker):
+        # renew the lease; False if it was lost (expired and re-queued or claimed by someone else)
+        with self.transaction() as db:
+            changed = db.execute(
+                "update items set lease_expires = ? where item_id = ? and worker = ? and status = 'running'",
+                (time.time()+self.lease, item_id, worker),
+            ).rowcount
+        return changed == 1
+
+    def complete(self, item_id, worker, result=None, follow_up=()):
+        with self.transaction() as db:
+            changed = db.execute(
+                "update items set status = 'done', finished = ?, lease_expires = null, error = null, result = ? "
+                "where item_id = ? and worker = ? and status = 'running'",
+                (time.time(), json.dumps(result), item_id, worker),
+            ).rowcount
+            if changed == 1:
+                db.executemany(
+                    "insert or ignore into items (item_id, kind, activity_id, args, max_attempts, queued) values (?, ?, ?, ?, ?, ?)",
+                    [(item["item_id"], item["kind"], item["activity_id"], json.dumps(item["args"]), self.max_attempts, time.time()) for item in follow_up],
+                )
+        return changed == 1
+
+    def fail(self, item_id, worker, error):
+        with self.transaction() as db:
+            changed = db.execute(
+                "update items set status = case when attempts >= max_attempts then 'failed' else 'pending' end, "
+                "worker = null, lease_expires = null, finished = ?, queued = ?, error = ? "
+                "where item_id = ? and worker = ? and status = 'running'",
+                (time.time(), time.time(), error, item_id, worker),
+            ).rowcount
+        return changed == 1
+
+    def retry_failed(self, kinds=None):
+        # give failed items another max_attempts tries
+        with self.transaction() as db:
+            query = "update items set status = 'pending', attempts = 0, error = null where status = 'failed'"
+            params = []
+            if kinds:
+                query += " and kind in ("+",".join("?"*len(kinds))+")"
+                params += list(kinds)
+            return db.execute(query, params).rowcount
+
+    def counts(self):
+        db = self.connect()
+        try:
+            rows = db.execute("select kind, status, count(*) as n from items group by kind, status").fetchall()
+        finally:
+            db.close()
+        return {(row["kind"], row["status"]): row["n"] for row in rows}
+
+    def items(self, status=None, kind=None):
+        db = self.connect()
+        try:
+            query, params = "select * from items where 1", []
+            if status is not None:
+                query += " and status = ?"
+                params.append(status)
+            if kind is not None:
+                query += " and kind = ?"
+                params.append(kind)
+            rows = db.execute(query+" order by rowid", params).fetchall()
+        finally:
+            db.close()
+        items = [dict(row) for row in rows]
+        for item in items:
+            item["args"] = json.loads(item["args"])
+            item["result"] = json.loads(item["result"]) if item["result"] is not None else None
+        return items
+
+    def finished(self, kinds=None):
+        # True when no item (of the given kinds) is pending or running
+        return not any(
+            status in ("pending", "running") and (not kinds or kind in kinds)
+            for (kind, status) in self.counts()
+        )
+
+class lease_keeper:
+    # renews the lease of the item being processed from a background thread
+    def __init__(self, queue, item_id, worker):
+        self.queue, self.item_id, self.worker = queue, item_id, worker
+        self.lost = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease/3.):
+            if not self.queue.heartbeat(self.item_id, self.worker):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.thread.join()
+
+def work(queue, handlers, worker=None, kinds=None, wait=True, max_items=None):
+    # Claim and process items until the queue is drained. handlers maps item kinds to
+    # functions handler(activity_id, **args) returning a result or (result, follow_up items).
+    # With wait=True, idle workers keep polling while other workers still hold items,
+    # since those may fail, expire or add follow-up items.
+    worker = worker or worker_name()
+    kinds = kinds or list(handlers.keys())
+    processed = 0
+    while max_items is None or processed < max_items:
+        item = queue.claim(worker, kinds)
+        if item is None:
+            if wait and not queue.finished(kinds):
+                time.sleep(poll_seconds)
+                continue
+            break
+
+        handler = handlers[item["kind"]]
+        with lease_keeper(queue, item["item_id"], worker) as keeper:
+            with instrumentation.stage("work_item", errors="log", kind=item["kind"], item_id=item["item_id"], worker=worker, attempt=item["attempts"]) as s:
+                output = handler(item["activity_id"], **item["args"])
+                result, follow_up = output if isinstance(output, tuple) else (output, ())
+        if keeper.lost:
+            print(f"\nLost the lease of {item['item_id']}; its result is discarded")
+        elif s.error is not None:
+            queue.fail(item["item_id"], worker, s.error)
+        else:
+            queue.complete(item["item_id"], worker, result, follow_up)
+        processed += 1
+    return processed
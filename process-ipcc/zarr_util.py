@@ -0,0 +1,113 @@
+import os
+import xarray as xr
+import catalog
+import landsea
+
+# Mapping of CMIP-style experiment_id to the run label used in the file names of each assessment report
+experiment_id_dict = {
+    "1pctCO2": {"FAR":"1P", "SAR":"GG"},
+    "historical": {"FAR":"1P", "SAR":"GS", "TAR":"SRES-A2"},
+    "piControl": {"FAR":"CI", "SAR":"CI"}
+}
+source_id_attrs = {"FAR": "institution", "SAR": "institution", "TAR": "institution"}
+
+activity_ids = ["FAR","SAR","TAR"]
+variable_ids = ["tas", "psl", "pr", "rsds", "sn", "sic", "tasmax", "tasmin", "uas", "vas", "sfcWind"]
+table_id = "Amon"
+grid_label = "gn"
+
+zarr_dir = "../data/zarr/"
+
+def dataset_ids(activity_id, ncfile, institution_id):
+    # experiment_id, source_id and member_id of every store a (would-be) interim file maps to
+    ids = []
+    for experiment_id in experiment_id_dict.keys():
+        if activity_id not in experiment_id_dict[experiment_id]: continue # experiment doesn't exist
+        if experiment_id_dict[experiment_id][activity_id] not in ncfile: continue # wrong experiment
+
+        # If different source_id and member_id for a single institution (as in SAR)
+        if activity_id == 'SAR':
+            source_id = institution_id+'-'+str(ncfile[2:4])
+            member_id = f"r{ncfile[7:8]}i1p1f1"
+        else:
+            source_id = institution_id
+            member_id = "r1i1p1f1"
+        ids.append((experiment_id, source_id, member_id))
+    return ids
+
+def get_zarr_name(institution_id, source_id, experiment_id, member_id, variable_id):
+    return f"{institution_id}/{source_id}/{experiment_id}/{member_id}/{table_id}/{variable_id}/{grid_label}/"
+
+def append_catalog_row(fs_dict, activity_id, institution_id, source_id, experiment_id, member_id, variable_id, zarr_name):
+    fs_dict["activity_id"].append(activity_id)
+    fs_dict["institution_id"].append(institution_id)
+    fs_dict["source_id"].append(source_id)
+    fs_dict["experiment_id"].append(experiment_id)
+    fs_dict["member_id"].append(member_id)
+    fs_dict["table_id"].append(table_id)
+    fs_dict["variable_id"].append(variable_id)
+    fs_dict["grid_label"].append(grid_label)
+    fs_dict["zstore"].append(f"gs://ipcc-{activity_id.lower()}/{activity_id}/"+zarr_name)
+    fs_dict["dcpp_init_year"].append("NaN")
+    fs_dict["zstore_timeseries"].append("")
+    fs_dict["zstore_pyramid"].append("")
+
+def open_interim(path):
+    # Datasets of an interim NetCDF file, opened undecoded: the file itself or, for
+    # files with a group per variable, each group with the coordinates of the root group
+    import netCDF4 as nc
+    with nc.Dataset(path) as ncdata:
+        groups = list(ncdata.groups.keys())
+    if len(groups) == 0:
+        return [xr.open_dataset(path, decode_cf=False)]
+
+    root = xr.open_dataset(path, decode_cf=False)
+    datasets = []
+    for group in groups:
+        ds = xr.open_dataset(path, group=group, decode_cf=False)
+        ds = ds.assign_coords({name: root[name] for name in root.variables})
+        ds.attrs.update(root.attrs)
+        datasets.append(ds)
+    return datasets
+
+def write_zarr(ds, activity_id, ncfile, variable_id, fs_dict, encoding=None):
+    # Write one variable of a dataset to every zarr store it belongs to and record
+    # the corresponding catalog rows. ncfile is the file name of the interim NetCDF
+    # file this dataset corresponds to (whether or not that file is actually written).
+    if variable_id not in variable_ids: return []
+    if variable_id not in ds.data_vars: return []
+
+    # one store per variable, even for multi-variable (per-run) datasets
+    ds = ds.drop_vars([name for name in ds.data_vars if name != variable_id])
+    # the published stores hold full grids, also of variables gathered on land/ocean points
+    ds = landsea.expand(ds)
+
+    institution_id = ds.attrs[source_id_attrs[activity_id]]
+    zarr_names = []
+    for (experiment_id, source_id, member_id) in dataset_ids(activity_id, os.path.basename(ncfile), institution_id):
+        zarr_name = get_zarr_name(institution_id, source_id, experiment_id, member_id, variable_id)
+        ds.to_zarr(zarr_dir+f"{activity_id}/"+zarr_name, mode='w', consolidated=True, encoding=encoding)
+        append_catalog_row(fs_dict, activity_id, institution_id, source_id, experiment_id, member_id, variable_id, zarr_name)
+        zarr_names.append(zarr_name)
+    return zarr_names
+
+def csv_catalog_path(path_to_catalog):
+    return os.path.splitext(path_to_catalog)[0]+".csv"
+
+def write_activity_catalog(fs_dict, activity_id, file_format="parquet"):
+    os.makedirs(zarr_dir+f"{activity_id}/", exist_ok=True)
+
+    catalog_name = f"pangeo-{activity_id.lower()}.{file_format}"
+    path_to_catalog = zarr_dir+f"{activity_id}/"+catalog_name
+    catalog.write_catalog(fs_dict, path_to_catalog, file_format=file_format)
+    # parquet catalogs (for catalog.Catalog) get a csv copy next to them for intake-esm
+    if file_format != "csv":
+        catalog.write_catalog(fs_dict, csv_catalog_path(path_to_catalog), file_format="csv")
+
+    # Write catalog json to Zarr data folder
+    catalog.write_collection_json(
+        f"../catalogs/pangeo-{activity_id.lower()}.json",
+        zarr_dir+f"{activity_id}/pangeo-{activity_id.lower()}.json",
+        f"https://storage.googleapis.com/ipcc-{activity_id.lower()}/"+os.path.basename(csv_catalog_path(path_to_catalog))
+    )
+    return path_to_catalog
@@ -0,0 +1,61 @@
+
+import time
+import numpy as np
+import xarray as xr
+import sys
+
+sys.path.append("../process-ipcc")
+import ensemble
+
+# Compares the randomized EOF solver (Ensemble.eofs) with a dense SVD on a synthetic
+# ensemble on the default 3 degree grid: a few large-scale modes plus noise.
+n_runs = 3
+years = [1990, 2020]
+n_modes = 10
+dlon = 3.; dlat = 3.
+use_dask = False
+
+rng = np.random.default_rng(42)
+longitude = np.arange(0+dlon/2.,360,dlon)
+latitude = np.arange(-90+dlat/2.,90,dlat)
+time_axis = np.arange(f"{years[0]}-01", f"{years[1]}-01", dtype="datetime64[M]").astype("datetime64[D]")
+lon2d, lat2d = np.meshgrid(np.deg2rad(longitude), np.deg2rad(latitude))
+
+# modes: low order spherical-harmonic-like patterns with decreasing amplitude
+patterns = np.stack([np.cos(k*lat2d)*np.cos(l*lon2d) for k in range(1, 5) for l in range(0, 3)])
+amplitudes = 2.**-np.arange(patterns.shape[0])
+
+ds_list = []
+for r in range(n_runs):
+    pcs = rng.standard_normal((time_axis.size, patterns.shape[0]))*amplitudes
+    field = np.einsum("tm,myx->tyx", pcs, patterns) + 0.05*rng.standard_normal((time_axis.size,)+lat2d.shape)
+    ds = xr.Dataset(
+        {"tas": (("time","latitude","longitude"), field.astype("float32"))},
+        coords={"time": time_axis, "latitude": latitude, "longitude": longitude},
+        attrs={"name": f"synthetic-{r}"},
+    )
+    ds["tas"].attrs["units"] = "K"
+    ds_list.append(ds)
+
+ens = ensemble.Ensemble("synthetic", ds_list)
+ens.generate_ensemble("tas")
+if use_dask:
+    ens.ds = ens.ds.chunk({"latitude": 20})
+
+results = {}
+for method in ["exact", "randomized"]:
+    start = time.perf_counter()
+    results[method] = ens.eofs("tas", n_modes=n_modes, method=method)
+    print(f"{method:>10}: {time.perf_counter()-start:.3f} s")
+
+exact, approx = results["exact"], results["randomized"]
+ev_error = np.abs(approx["tas_explained_variance"]-exact["tas_explained_variance"])/exact["tas_explained_variance"]
+print("relative error of explained variance per mode:", np.round(ev_error.values, 6))
+
+# principal angles between the spanned subspaces (area weighted patterns)
+weights = np.sqrt(np.cos(np.deg2rad(latitude)))[:,np.newaxis]
+def weighted_basis(eof):
+    basis = (eof.values*weights).reshape(eof.sizes["mode"], -1).T
+    return np.linalg.qr(basis)[0]
+cosines = np.linalg.svd(weighted_basis(exact["tas_eof"]).T @ weighted_basis(approx["tas_eof"]), compute_uv=False)
+print("largest principal angle between EOF subspaces (degrees):", np.rad2deg(np.arccos(np.clip(cosines.min(), -1, 1))))
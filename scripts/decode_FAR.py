@@ -1,89 +1,118 @@
-
-import struct
-import netCDF4 as nc
 import numpy as np
 import os
 import sys
 
 sys.path.append("../process-ipcc")
-import decoding as de
+import fortran_records
 import models
 import netcdf_util
+import catalog
+import zarr_util
+import precision
+import derived
+import landsea
+import instrumentation
 
 load_dir = "../data/raw/FAR/"
 save_dir = "../data/interim/FAR/"
 
+# Output modes: interim NetCDF files (later zarrified by zarrify_and_push_to_gcs.py)
+# and/or final zarr stores plus catalog written directly from the decoded arrays
+write_netcdf = True
+write_zarr = False
+catalog_format = "parquet"
+
+# NetCDF layout: "variable" (one file per variable), "run" (all variables of a model run
+# in one file with shared coordinates) or "group" (one file with a group per variable)
+netcdf_layout = "variable"
+
+# Output variables to produce (CF names), or None for all of them
+output_variables = None
+
+# Store land-only (mrso, snd) and ocean-only (sic) variables on their grid points only
+# (CF compression by gathering) in the interim NetCDF files; land-sea masks are read from
+# a land area fraction file per model name if given, otherwise derived from the models'
+# sentinel values. The zarr stores always hold full grids (see zarr_util.write_zarr).
+gather_surface_fields = False
+mask_files = {}
+
+# Per-stage timings, bytes, peak memory and failures (JSON lines; optional Chrome trace)
+stage_log = save_dir+"stages_FAR.jsonl"
+chrome_trace = None
+instrumentation.configure(stage_log, chrome_trace)
+
 os.system(command = f"mkdir -p {save_dir}")
+fs_dict = catalog.new_catalog_dict()
+
+def emit_zarr(ds, ncfile_name, var_name):
+    with instrumentation.stage("zarrify", activity_id="FAR", var_name=var_name, file_name=os.path.basename(ncfile_name)) as s:
+        s.items = len(zarr_util.write_zarr(ds, "FAR", ncfile_name, var_name, fs_dict))
 
 # GFDL decadal mean
 model = models.gfdl
 nt = 10
-V = np.zeros((nt,)+model.dims)
+V = np.zeros((nt,)+model.dims, dtype=precision.float_dtype)
 for t_idx in range(nt):
-    with open(load_dir+"GFDL_1P/IPCC_DDC_FAR_GFDL_R15TR1P_D_1/ann.dec."+str((t_idx+1)*10), "rb") as binary_file:
-        # Read the whole file at once
-        bytes = binary_file.read()
-    
-    Vtmp = np.zeros(model.dims)
-    for idx in range(Vtmp.size):
-        
-        # get index of flattened array
-        unravel_idx = np.unravel_index(idx, model.dims)
-        
-        # get first index of data entry in binary file
-        # note: function parameters are different for each model!
-        byte_idx = model.get_byte_index(unravel_idx)
-        
-        # unpack binary data which are saved as 32-bit floats
-        Vtmp[unravel_idx] = (
-            struct.unpack(">f",bytes[byte_idx:byte_idx+4])[0]
-        )
-
-    V[t_idx,...] = Vtmp
+    # decode all entries at once through the Fortran record index
+    # note: record layouts are different for each model (checked against the cipher)!
+    file_name = load_dir+"GFDL_1P/IPCC_DDC_FAR_GFDL_R15TR1P_D_1/ann.dec."+str((t_idx+1)*10)
+    with instrumentation.stage("decode", model=model.name, file_name=os.path.basename(file_name)) as s:
+        records = fortran_records.record_file(file_name)
+        V[t_idx,...] = model.decode(records)
+        s.read_bytes, s.items = os.path.getsize(file_name), V[t_idx].size
     
 # swap dimensions to standard order
 V = V.swapaxes(2,3)
 
+# GFDL source variables (by FAR name) are slices of the decoded array;
+# derived variables (see process-ipcc/derived.py) are only computed when requested
+def gfdl_source(far_name):
+    var = model.variables[model.output_names[far_name]]
+    if var.last_index > var.first_index:
+        return V[:,var.first_index:var.last_index+1,:,:]
+    return V[:,var.first_index,:,:]
+fields = derived.evaluator(derived.gfdl, model, gfdl_source)
+
+# land-sea mask (ocean where soil moisture holds its sentinel value)
+land = landsea.land_mask(
+    model.lat, model.lon, path=mask_files.get(model.name),
+    derive=lambda: landsea.gfdl_sentinel_mask(gfdl_source("SOILM")),
+) if gather_surface_fields else None
+
+output = netcdf_util.far_output(
+    save_dir, "decadal_FAR_GFDL-1P", model, layout=netcdf_layout,
+    persist=write_netcdf, on_variable=emit_zarr if write_zarr else None,
+)
 print("Processing ",model.name," files.")
 # Create Netcdf files for a few variables of interest, defined at the very top of the notebook.
 for far_name in list(model.output_names.keys()):
     var_name = model.output_names[far_name]
+    if (output_variables is not None) and (var_name not in output_variables): continue
     print("- saving",var_name,end=" ")
     
     # Create netCDF4 file and resave the output to it
-    ncfile_name = save_dir+var_name+"_decadal_FAR_GFDL-1P.nc"
-    ncdata = netcdf_util.far_to_netcdf(ncfile_name, model)
+    ncfile_name = output.file_name(var_name)
     
     # read meta-data from GFDL documentation text file (submitted to IPCC-DDC w/ data)
     var = model.variables[var_name]
+    data = fields.output(var_name, far_name)
+    mask = landsea.surface_mask(var_name, land)
     
     # special case: variables with pressure dimension
-    if var.last_index > var.first_index:
-        nlev = var.last_index-var.first_index+1
-        ncvar = ncdata.createVariable(var_name,'f8',('time','pressure','latitude','longitude',))
-        for p in range(nlev):
-            ncvar[:,p,:,:] = V[:,var.first_index + p,:,:]
-        ncvar.description = var.description.strip()
-        ncvar.units = var.units
-        
+    if data.ndim == 4:
+        ncvar = output.create_variable(var_name,precision.float_dtype,('time','pressure','latitude','longitude',),**precision.netcdf_compression)
     else:
-        ncvar = ncdata.createVariable(var_name,'f8',('time','latitude','longitude',))
-        ncvar[:,:,:] = np.squeeze(V[:,var.first_index,:,:])
-        ncvar.description = var.description.strip()
-        ncvar.units = var.units
-
-        # apply mask to ocean for soil moisture content
-        # HFD 05/30/19: I think this ends up masking some very moist parts of land.
-        # This is where a proper land/ocean mask would be helpful.
-        if var_name == "mrso":
-            tmp = V[:,var.first_index,:,:]
-            tmp[tmp == 15.] = np.nan
-            ncvar[:,:,:] = tmp
+        ncvar = output.create_gathered_variable(var_name,precision.float_dtype,('time','latitude','longitude',),mask,**precision.netcdf_compression)
+    ncvar[...] = landsea.gather(data, mask)
+    ncvar.description = var.description.strip()
+    ncvar.units = var.units
         
     # apply unit conversion if necessary
     if far_name in list(model.unit_conversions.keys()):
         convert_units = model.unit_conversions[far_name]
-        convert_units(ncvar)
+        with instrumentation.stage("convert", model=model.name, var_name=var_name) as s:
+            convert_units(ncvar)
+            s.items = ncvar.size
         print("(converted units)")
     else:
         print("")
@@ -91,35 +120,28 @@ for far_name in list(model.output_names.keys()):
     # exceptions
     if var_name == "tas": ncvar.units = "K" # from "degrees K" to just "K"
     
-    ncdata.setncattr("institution",model.name)
-    ncdata.close()
+    # cast to the precision policy dtype and apply optional bit-rounding
+    precision.apply_to_ncvar(ncvar, var_name, source=os.path.basename(ncfile_name))
+
+    with instrumentation.stage("write", model=model.name, var_name=var_name, file_name=os.path.basename(ncfile_name)) as s:
+        s.items = ncvar.size
+        output.close_variable(var_name)
+with instrumentation.stage("write", model=model.name, layout=netcdf_layout):
+    output.close()
 
 
 # UKTR decadal mean
 model = models.uktr
 model.nt = 3
 
-Vmonth = np.zeros((model.nt,)+model.dims)
+Vmonth = np.zeros((model.nt,)+model.dims, dtype=precision.float_dtype)
 # loop through files for each decadal-mean
 for t_idx in range(model.nt):
-    with open(load_dir+"UKTR_1P/IPCC_DDC_FAR_UKTR_1P_D_1/trans_years"+model.file_years[t_idx]+".bin", "rb") as binary_file:
-        # Read the whole file at once
-        bytes = binary_file.read()
-    
-    Vtmp = np.zeros(model.dims)
-    for idx in range(Vtmp.size):
-        # get index of flattened array
-        unravel_idx = np.unravel_index(idx, model.dims)
-        
-        # get first index of data entry in binary file
-        # note: function parameters are different for each model!
-        byte_idx = model.get_byte_index(unravel_idx)
-        
-        # unpack binary data which are saved as 32-bit floats
-        Vtmp[unravel_idx] = (
-            struct.unpack(">f",bytes[byte_idx:byte_idx+4])[0]
-        )
-    Vmonth[t_idx,...] = Vtmp
+    file_name = load_dir+"UKTR_1P/IPCC_DDC_FAR_UKTR_1P_D_1/trans_years"+model.file_years[t_idx]+".bin"
+    with instrumentation.stage("decode", model=model.name, file_name=os.path.basename(file_name)) as s:
+        records = fortran_records.record_file(file_name)
+        Vmonth[t_idx,...] = model.decode(records)
+        s.read_bytes, s.items = os.path.getsize(file_name), Vmonth[t_idx].size
 
 # swap dimensions to give (nv, nt, nm, ny, nx)
 Vmonth = np.transpose(Vmonth, (3, 0, 4, 2, 1))
@@ -127,156 +149,168 @@ Vmonth = np.transpose(Vmonth, (3, 0, 4, 2, 1))
 # annual mean
 days_in_month = [31, 28.25, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 days_in_year = np.sum(days_in_month)
-V = np.zeros((model.nv,model.nt,model.ny,model.nx))
-for t_idx in range(model.nt):
-    for m_idx in range(12):
-        V[:,t_idx,:,:] += Vmonth[:,t_idx,m_idx,:,:]*days_in_month[m_idx]/days_in_year
+V = np.zeros((model.nv,model.nt,model.ny,model.nx), dtype=precision.float_dtype)
+with instrumentation.stage("aggregate", model=model.name) as s:
+    for t_idx in range(model.nt):
+        for m_idx in range(12):
+            V[:,t_idx,:,:] += Vmonth[:,t_idx,m_idx,:,:]*days_in_month[m_idx]/days_in_year
+    s.items = Vmonth.size
 
+# land-sea mask (soil moisture and sea ice share the first field, see below)
+land = landsea.land_mask(
+    model.lat, model.lon, path=mask_files.get(model.name),
+    derive=lambda: landsea.uktr_sentinel_mask(V[0]),
+) if gather_surface_fields else None
+
+output = netcdf_util.far_output(
+    save_dir, "decadal_FAR_UKTR-1P", model, layout=netcdf_layout,
+    persist=write_netcdf, on_variable=emit_zarr if write_zarr else None,
+)
 print("Processing ",model.name," files.")
 # Create Netcdf files for a few variables of interest, defined at the very top of the notebook.
 for far_name in list(model.output_names.keys()):
     var_name = model.output_names[far_name]
+    if (output_variables is not None) and (var_name not in output_variables): continue
     print("- saving",var_name,end=" ")
     
     # UKTR-specific meta-data for order of variables in binary
     idx = model.var_shortnames.index(far_name)
 
-    ncfile_name = save_dir+var_name+"_decadal_FAR_UKTR-1P.nc"
-    ncdata = netcdf_util.far_to_netcdf(ncfile_name, model)
+    ncfile_name = output.file_name(var_name)
+    mask = landsea.surface_mask(var_name, land)
     
-    ncvar = ncdata.createVariable(var_name,'f8',('time','latitude','longitude',))
+    ncvar = output.create_gathered_variable(var_name,precision.float_dtype,('time','latitude','longitude',),mask,**precision.netcdf_compression)
 
     # Soil moisture is special case because it contains both sea ice and soil moisture data.
     # Someone at the Met Office thought they were very clever... took HFD weeks to decode this... Thank you for CF conventions
     if far_name == "SOILM":
         soil_moisture = np.copy(V[0,:,:,:])
         soil_moisture[soil_moisture >= 99.9] = np.nan
-        ncvar[:,:,:] = soil_moisture
+        data = soil_moisture
     elif far_name == "SEAICE":
         sea_ice_conc = np.copy(V[0,:,:,:])
         sea_ice_conc[sea_ice_conc <= 100.] = 0
-        ncvar[:,:,:] = sea_ice_conc*1.e-3 # convert from per-thousand to fraction
+        data = sea_ice_conc*1.e-3 # convert from per-thousand to fraction
         
     # read UKTR-specific meta-data from hard-coded variables
     else:
-        ncvar[:,:,:] = V[model.var_idx[idx],:,:,:]
+        data = V[model.var_idx[idx],:,:,:]
+    ncvar[...] = landsea.gather(data, mask)
     ncvar.description = model.var_descriptions[idx]
     ncvar.units = model.var_units[idx]
     
     # unit conversion
     if far_name in list(model.unit_conversions.keys()):
         convert_units = model.unit_conversions[far_name]
-        convert_units(ncvar)
+        with instrumentation.stage("convert", model=model.name, var_name=var_name) as s:
+            convert_units(ncvar)
+            s.items = ncvar.size
         print("(converted units)")
     else:
         print("")
     
-    ncdata.setncattr("institution",model.name)
-    ncdata.close()
+    # cast to the precision policy dtype and apply optional bit-rounding
+    precision.apply_to_ncvar(ncvar, var_name, source=os.path.basename(ncfile_name))
+
+    with instrumentation.stage("write", model=model.name, var_name=var_name, file_name=os.path.basename(ncfile_name)) as s:
+        s.items = ncvar.size
+        output.close_variable(var_name)
+with instrumentation.stage("write", model=model.name, layout=netcdf_layout):
+    output.close()
 
 # GISS decadal mean
 model = models.giss
 
-Vmonth = np.zeros(model.dims)
-with open(load_dir+"GISS_1P/IPCC_DDC_FAR_GISS_SCA_DATA_1/10yr_climo_1960-2059.bin", "rb") as binary_file:
-    bytes = binary_file.read()
-
-    # Read meta data from the header for later
-    lines = []
-    for i in range(model.nv):
-        lines.append(bytes[
-            4+(model.nbytes_data_cw + model.nx*model.ny*model.bytes_per_data_entry)*i:
-            4+(model.nbytes_data_cw + model.nx*model.ny*model.bytes_per_data_entry)*i+80
-        ].decode("UTF-8"))
-    
-    # read data byte by byte
-    for idx in range(Vmonth.size):
-        # get index of flattened array
-        unravel_idx = np.unravel_index(idx, model.dims)
-
-        # get first index of data entry in binary file
-        # note: function parameters are different for each model!
-        byte_idx = model.get_byte_index(unravel_idx)
-
-        # unpack binary data which are saved as 32-bit floats (4 bytes)
-        Vmonth[unravel_idx] = (
-            struct.unpack(">f",bytes[byte_idx:byte_idx+4])[0])
+file_name = load_dir+"GISS_1P/IPCC_DDC_FAR_GISS_SCA_DATA_1/10yr_climo_1960-2059.bin"
+with instrumentation.stage("open", model=model.name, file_name=os.path.basename(file_name)) as s:
+    records = fortran_records.record_file(file_name)
+
+    # Read meta data from the record titles for later
+    lines = [records.record_bytes(i)[:80].tobytes().decode("UTF-8") for i in range(model.nv)]
+    s.items = model.nv
+
+# zero-copy view of all data entries (converted to float32 only as needed,
+# so the bytes are actually read in the aggregate stages below)
+Vmonth = model.decode(records)
         
 # swap dimensions to give (nv, nt, nm, ny, nx)
 Vmonth = np.transpose(Vmonth, (2, 4, 3, 1, 0))
     
-# annual mean
+# annual mean weights
 days_in_month = [31, 28.25, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 days_in_year = np.sum(days_in_month)
-V = np.zeros((model.nv,model.nt,model.ny,model.nx))
-for t_idx in range(model.nt):
-    for m_idx in range(12):
-        V[:,t_idx,:,:] += Vmonth[:,t_idx,m_idx,:,:]*days_in_month[m_idx]/days_in_year
+month_weights = np.array(days_in_month)/days_in_year
 
 # The documentation seems to give the wrong grid since the Greenwich Meridian is at lon=180 instead of lon=0
 model.lon = np.roll(np.mod(model.lon-180.,360),model.nx//2) # fixed longitude
-V = np.roll(V,model.nx//2,axis=-1) # fixed variables according to longitude shift
-
-# express all pressures in terms of meters
-for i in range(len(model.pres_height_offset)):
-    V[7+i:7+(i+1),:,:,:] += model.pres_height_offset[i]
     
 # GISS-specific function for extracting usable meta data from header string
 variables = models.get_variable_info(lines)
 
+# GISS source variables (by header name): annual mean and longitude shift are only
+# computed for the variables an output needs; derived variables (hydrostatic layer
+# temperature, longwave fluxes; see process-ipcc/derived.py) are computed on request
+def giss_source(far_name):
+    var = variables[far_name]
+    with instrumentation.stage("aggregate", model=model.name, var_name=far_name) as s:
+        Vann = np.einsum("vtmyx,m->vtyx", Vmonth[var.first_index:var.last_index+1], month_weights)
+        Vann = np.roll(Vann, model.nx//2, axis=-1).astype(precision.float_dtype) # fixed variables according to longitude shift
+        s.read_bytes, s.items = Vmonth[var.first_index:var.last_index+1].nbytes, Vann.size
+    if var.last_index > var.first_index: return Vann
+    return Vann[0]
+fields = derived.evaluator(derived.giss, model, giss_source)
+
+output = netcdf_util.far_output(
+    save_dir, "decadal_FAR_GISS-SCA-1P", model, layout=netcdf_layout,
+    persist=write_netcdf, on_variable=emit_zarr if write_zarr else None,
+)
 print("Processing ",model.name," files.")
 # Create Netcdf files for a few variables of interest
 for far_name in list(model.output_names.keys()):
 
     var_name = model.output_names[far_name]
+    if (output_variables is not None) and (var_name not in output_variables): continue
     print("- saving",var_name,end=" ")
 
-    ncfile_name = save_dir+var_name+"_decadal_FAR_GISS-SCA-1P.nc"
-    ncdata = netcdf_util.far_to_netcdf(ncfile_name, model)
+    ncfile_name = output.file_name(var_name)
         
     # GISS-specific object containing variable meta-data
     var = variables[far_name]
+    data = fields.output(var_name, far_name)
     
     # special case of variables that depend on pressure
-    if (var.last_index > var.first_index):
-        
-        # convert geopotential height into approximate temperature using hydrostatic balance finite difference
-        if "1000 MB GEOPOTENTIAL HEIGHT" in var.name:
-            # use the hydrostatic balance equation to solve for the temperature of each layer
-            dz = V[var.first_index:var.last_index,:,:,:]-V[var.first_index+1:var.last_index+1,:,:,:]
-            Tf = -model.pres[:,np.newaxis,np.newaxis,np.newaxis]*9.81/287.*dz/model.dp[:,np.newaxis,np.newaxis,np.newaxis]
-
-            ncvar = ncdata.createVariable(var_name,'f8',('time','pressure','latitude','longitude',))
-            ncvar[:,:,:,:] = Tf.swapaxes(0,1)[:,:,:,:]
-            ncvar.description = var.description[8:]
-            ncvar.units = var.units
+    if data.ndim == 4:
+        ncvar = output.create_variable(var_name,precision.float_dtype,('time','pressure','latitude','longitude',),**precision.netcdf_compression)
+        ncvar.description = var.description[8:]
 
     # surface (or otherwise spatially 2D variables)
     else:
-        ncvar = ncdata.createVariable(var_name,'f8',('time','latitude','longitude',))
-        ncvar[:,:,:] = V[var.first_index,:,:,:]
+        ncvar = output.create_variable(var_name,precision.float_dtype,('time','latitude','longitude',),**precision.netcdf_compression)
         ncvar.description = var.description
-        ncvar.units = var.units
+    ncvar[...] = data
+    ncvar.units = var.units
 
     # unit conversions
     if var.name in list(model.unit_conversions.keys()):
         convert_units = model.unit_conversions[var.name]
-        convert_units(ncvar)
+        with instrumentation.stage("convert", model=model.name, var_name=var_name) as s:
+            convert_units(ncvar)
+            s.items = ncvar.size
         print("(converted units)")
     else:
         print("")
-    
 
-    # sign convention for toa longwave flux
-    if var_name == "rlut": ncvar[...] = -ncvar[...]
+    # cast to the precision policy dtype and apply optional bit-rounding
+    precision.apply_to_ncvar(ncvar, var_name, source=os.path.basename(ncfile_name))
 
-    # calculate surface longwave flux from net flux and solar flux
-    if var_name == "rls": # note: rls variable for GISS is actually net flux
-        
-        inv_map = {v: k for k, v in model.output_names.items()}
-        rss_var = variables[inv_map['rss']]
-        # note sign convention on longwave flux
-        ncvar[...] = -(V[var.first_index,:,:,:] - V[rss_var.first_index,:,:,:])
+    with instrumentation.stage("write", model=model.name, var_name=var_name, file_name=os.path.basename(ncfile_name)) as s:
+        s.items = ncvar.size
+        output.close_variable(var_name)
+with instrumentation.stage("write", model=model.name, layout=netcdf_layout):
+    output.close()
+
+if write_zarr:
+    zarr_util.write_activity_catalog(fs_dict, "FAR", file_format=catalog_format)
 
-    ncdata.setncattr("institution",model.name)
-    ncdata.close()
+# Maximum error per variable introduced by the precision policy
+precision.write_report(save_dir+"precision_report_FAR.csv")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import sys
+import argparse
+import subprocess
+import multiprocessing
+
+sys.path.append("../process-ipcc")
+import workqueue
+import worklist
+
+# Rebuild of the FAR/SAR/TAR archive by several workers (on one or more nodes) sharing a
+# work queue ledger (see process-ipcc/workqueue.py). From the scripts directory:
+#
+#   python3 distributed_rebuild.py enqueue            # once: enumerate the raw files
+#   python3 distributed_rebuild.py work [-n 4]        # on every node (n local worker processes)
+#   python3 distributed_rebuild.py status
+#   python3 distributed_rebuild.py retry              # re-queue items that failed max_attempts times
+#   python3 distributed_rebuild.py catalog [--push]   # once all items are done
+#
+# Work items: "decode-far" (all of decode_FAR.py), "reformat" (one raw SAR/TAR file) and
+# "zarrify" (one interim NetCDF file, queued as soon as it is written). The catalog rows of
+# the zarr stores are kept in the ledger and written to the activity catalogs at the end,
+# and the precision reports of the reformatted files are merged into one per activity.
+# Workers only import the modules of the items they process.
+
+ledger_path = "../data/queue/ledger.sqlite"
+precision_dir = "precision/" # per-file precision reports, in data/interim/<activity>/
+
+def decode_far(activity_id):
+    subprocess.run([sys.executable, "decode_FAR.py"], check=True)
+    save_dir = "../data/interim/FAR/"
+    return None, [zarrify_item("FAR", ncfile) for ncfile in sorted(os.listdir(save_dir)) if ncfile.endswith(".nc")]
+
+def reformat(activity_id, institution, var_name, file_name):
+    import catalog
+    import precision
+    import reformat_SAR_and_TAR
+    os.makedirs(f"../data/interim/{activity_id}/"+precision_dir, exist_ok=True)
+    fs_dict = catalog.new_catalog_dict()
+    try:
+        ncfile_name = reformat_SAR_and_TAR.reformat_file(activity_id, institution, var_name, file_name, fs_dict)
+    finally:
+        # rows of this file only (write_report starts a new report)
+        precision.write_report(f"../data/interim/{activity_id}/"+precision_dir+f"{institution}_{var_name}_{file_name}.csv")
+    # with write_zarr the zarr stores are already written (and their rows in fs_dict)
+    if ncfile_name is None or reformat_SAR_and_TAR.write_zarr or not reformat_SAR_and_TAR.write_netcdf:
+        return fs_dict, []
+    return fs_dict, [zarrify_item(activity_id, os.path.basename(ncfile_name))]
+
+def zarrify(activity_id, ncfile):
+    import catalog
+    import zarrify_and_push_to_gcs
+    os.makedirs(f"../data/zarr/{activity_id}/", exist_ok=True)
+    fs_dict = catalog.new_catalog_dict()
+    zarrify_and_push_to_gcs.zarrify_file(activity_id, ncfile, fs_dict)
+    return fs_dict
+
+def zarrify_item(activity_id, ncfile):
+    return workqueue.work_item("zarrify", activity_id, ncfile=ncfile)
+
+handlers = {"decode-far": decode_far, "reformat": reformat, "zarrify": zarrify}
+
+def enqueue(queue):
+    items = [workqueue.work_item("decode-far", "FAR")]
+    for activity_id in ["SAR", "TAR"]:
+        for institution, var_name, file_name in worklist.raw_files(activity_id):
+            items.append(workqueue.work_item("reformat", activity_id, institution=institution, var_name=var_name, file_name=file_name))
+    print(f"{queue.add(items)} of {len(items)} items queued")
+
+def work(path, kinds=None):
+    return workqueue.work(workqueue.ledger(path), handlers, kinds=kinds)
+
+def status(queue):
+    for (kind, state), n in sorted(queue.counts().items()):
+        print(f"{kind:12s} {state:8s} {n}")
+    for item in queue.items(status="failed"):
+        print(f"\n{item['item_id']} ({item['attempts']} attempts): {item['error']}")
+
+def write_precision_reports():
+    import precision
+    for activity_id in ["SAR", "TAR"]:
+        directory = f"../data/interim/{activity_id}/"+precision_dir
+        paths = [entry.path for entry in worklist.entries(directory) if entry.name.endswith(".csv")]
+        if len(paths) == 0: continue
+        path = f"../data/interim/{activity_id}/precision_report_{activity_id}.csv"
+        precision.merge_reports(paths, path)
+        print(f"{activity_id}: precision report of {len(paths)} files in {path}")
+
+def write_catalogs(queue, push=False):
+    import catalog
+    import zarr_util
+    if not queue.finished():
+        raise RuntimeError("items are still pending or running (see status)")
+    for activity_id in zarr_util.activity_ids:
+        fs_dict = catalog.new_catalog_dict()
+        for item in queue.items(status="done"):
+            if item["activity_id"] != activity_id or not item["result"]: continue
+            for column in fs_dict:
+                fs_dict[column] += item["result"][column]
+        if len(fs_dict["zstore"]) == 0: continue
+        path_to_catalog = zarr_util.write_activity_catalog(fs_dict, activity_id, file_format="parquet")
+        print(f"{activity_id}: {len(fs_dict['zstore'])} zarr stores in {path_to_catalog}")
+        if push:
+            import publish
+            publish.push_activity(activity_id, path_to_catalog)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the archive with workers sharing a work queue")
+    parser.add_argument("command", choices=["enqueue", "work", "status", "retry", "catalog"])
+    parser.add_argument("--ledger", default=ledger_path)
+    parser.add_argument("-n", "--processes", type=int, default=1, help="local worker processes")
+    parser.add_argument("--kinds", nargs="*", choices=list(handlers.keys()), help="only work on these items")
+    parser.add_argument("--push", action="store_true", help="push the zarr stores and catalogs to GCS")
+    args = parser.parse_args()
+
+    queue = workqueue.ledger(args.ledger)
+    if args.command == "enqueue":
+        enqueue(queue)
+    elif args.command == "work":
+        if args.processes == 1:
+            work(args.ledger, args.kinds)
+        else:
+            processes = [multiprocessing.Process(target=work, args=(args.ledger, args.kinds)) for _ in range(args.processes)]
+            for process in processes: process.start()
+            for process in processes: process.join()
+        status(queue)
+    elif args.command == "status":
+        status(queue)
+    elif args.command == "retry":
+        print(f"{queue.retry_failed(args.kinds)} items re-queued")
+    elif args.command == "catalog":
+        write_catalogs(queue, push=args.push)
+        write_precision_reports()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Write kerchunk-style references that expose the raw FAR binaries as lazy zarr datasets
+# (no decoding step and no copy of the data). Open them with
+#     references.open_virtual_dataset("../data/references/FAR/GFDL.json")
+# or with any fsspec "reference://" filesystem.
+# GFDL variables are selected from the grid point records with
+#     references.record_variable(ds, "tas")
+
+import os
+import sys
+
+sys.path.append("../process-ipcc")
+import models
+import references
+
+load_dir = "../data/raw/FAR/"
+save_dir = "../data/references/FAR/"
+
+# Location of the raw files in the references: None for the local files, or the
+# URL of a copy of each model's raw directory (e.g. "gs://<bucket>/FAR/GFDL_1P/...")
+url_prefix = {"GFDL": None, "UKTR": None, "GISS": None}
+
+# reference format: "json" or "parquet"
+reference_format = "json"
+
+os.system(command = f"mkdir -p {save_dir}")
+
+file_names = {
+    "GFDL": [load_dir+"GFDL_1P/IPCC_DDC_FAR_GFDL_R15TR1P_D_1/ann.dec."+str((t_idx+1)*10) for t_idx in range(10)],
+    "UKTR": [load_dir+"UKTR_1P/IPCC_DDC_FAR_UKTR_1P_D_1/trans_years"+years+".bin" for years in models.uktr.file_years],
+    "GISS": [load_dir+"GISS_1P/IPCC_DDC_FAR_GISS_SCA_DATA_1/10yr_climo_1960-2059.bin"],
+}
+
+for model_name in file_names.keys():
+    print("Writing references for",model_name)
+    refs = references.generate(model_name, file_names[model_name], url_prefix=url_prefix[model_name])
+    if reference_format == "parquet":
+        references.write_parquet(refs, save_dir+model_name+".parq")
+    else:
+        references.write_json(refs, save_dir+model_name+".json")
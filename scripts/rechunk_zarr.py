@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import sys
+import argparse
+
+sys.path.append("../process-ipcc")
+import rechunk
+import zarr_util
+import instrumentation
+
+# Writes time-contiguous copies of the zarr stores in data/zarr/<activity>/ (for fast point
+# time series) to data/zarr/<activity>/timeseries/ and registers them in the activity
+# catalogs (zstore_timeseries column). Run after zarrify_and_push_to_gcs.py, e.g.
+#
+#   python3 rechunk_zarr.py FAR SAR TAR --max-mem 2e9
+#   python3 rechunk_zarr.py SAR --stores UKMO/UKMO-GG/1pctCO2/r1i1p1f1/Amon/tas/gn/
+
+instrumentation.configure("../data/zarr/stages_rechunk.jsonl")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write time-contiguous copies of the zarr stores")
+    parser.add_argument("activity_ids", nargs="*", default=zarr_util.activity_ids)
+    parser.add_argument("--stores", nargs="*", help="zarr names (relative to the activity directory)")
+    parser.add_argument("--max-mem", type=float, default=rechunk.max_mem, help="bytes held in memory per pass")
+    parser.add_argument("--catalog-format", default="parquet", choices=["parquet", "csv"])
+    parser.add_argument("--overwrite", action="store_true", help="rewrite existing copies")
+    args = parser.parse_args()
+
+    for activity_id in args.activity_ids:
+        copied = rechunk.rechunk_activity(
+            activity_id, zarr_names=args.stores, max_mem=args.max_mem,
+            catalog_format=args.catalog_format, overwrite=args.overwrite,
+        )
+        print(f"{activity_id}: {len(copied)} stores rechunked")
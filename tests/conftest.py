@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules of the pipeline are imported by name, as in scripts/
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(root, "process-ipcc"), os.path.join(root, "scripts"), root):
+    if path not in sys.path: sys.path.append(path)
@@ -0,0 +1,56 @@
+import json
+
+import cfcheck
+
+def write_store(path, metadata):
+    path.mkdir(parents=True)
+    with open(path/".zmetadata", "w") as f:
+        json.dump({"metadata": {".zgroup": {"zarr_format": 2}, **metadata}, "zarr_consolidated_format": 1}, f)
+    return str(path)
+
+def array(dims, attrs, dtype="<f4"):
+    shape = [2]*len(dims)
+    return {"shape": shape, "dtype": dtype}, {"_ARRAY_DIMENSIONS": dims, **attrs}
+
+def store_metadata(**arrays):
+    metadata = {".zattrs": {"Conventions": "CF-1.7"}}
+    for name, (zarray, zattrs) in arrays.items():
+        metadata[f"{name}/.zarray"], metadata[f"{name}/.zattrs"] = zarray, zattrs
+    return metadata
+
+def coordinates():
+    return {
+        "time": array(["time"], {"units": "days since 1990-1-1"}, "<f8"),
+        "latitude": array(["latitude"], {"units": "degrees_north"}, "<f8"),
+        "longitude": array(["longitude"], {"units": "degrees_east"}, "<f8"),
+    }
+
+tas_attrs = {"standard_name": "air_temperature", "long_name": "Near-Surface Air Temperature", "units": "K"}
+
+def test_scalar_coordinate_is_not_a_data_variable(tmp_path):
+    path = write_store(tmp_path/"store", store_metadata(
+        tas=array(["time", "latitude", "longitude"], {**tas_attrs, "coordinates": "height"}),
+        height=array([], {"units": "m"}, "<f8"),
+        **coordinates(),
+    ))
+    findings, [summary] = cfcheck.scan([path], workers=1)
+    assert findings == []
+    assert summary["status"] == "ok"
+    assert summary["data_variables"] == "tas"
+
+def test_findings_of_wrong_metadata(tmp_path):
+    path = write_store(tmp_path/"store", store_metadata(
+        tas=array(["time", "latitude", "longitude"], {"standard_name": "air_temperature", "units": "degC"}),
+        time=array(["time"], {"units": "days"}, "<f8"),
+        latitude=array(["latitude"], {"units": "degrees north"}, "<f8"),
+    ))
+    findings, [summary] = cfcheck.scan([path], workers=1)
+    checks = {(finding["variable"], finding["check"], finding["severity"]) for finding in findings}
+    assert checks == {
+        ("tas", "wrong-units", "error"),
+        ("tas", "missing-long_name", "warning"),
+        ("tas", "missing-coordinate", "error"),
+        ("time", "coordinate-units", "error"),
+        ("latitude", "coordinate-units", "warning"),
+    }
+    assert (summary["errors"], summary["warnings"], summary["status"]) == (3, 2, "error")
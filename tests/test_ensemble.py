@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+xr = pytest.importorskip("xarray")
+
+import ensemble
+
+def run(name, value, lat=(-45., 0., 45.)):
+    data = np.full((4, len(lat), 4), value, dtype=np.float32)
+    data[0, 0, 0] = np.nan
+    ds = xr.Dataset(
+        {"tas": (("time", "latitude", "longitude"), data, {"units": "K"})},
+        coords={"time": np.arange(4), "latitude": list(lat), "longitude": [0., 90., 180., 270.]},
+    )
+    ds.attrs["name"] = name
+    return ds
+
+def test_add_member_after_multi_model_mean():
+    ens = ensemble.Ensemble("test", [run("a", 1.), run("b", 2.)])
+    ens.generate_ensemble("tas")
+    ens.multi_model_mean()
+    assert list(ens.ds["run"].values) == ["a", "b", "mmm"]
+    assert ens.buffered()
+
+    ens.add_member(run("c", 6.))
+    ens.add_member(run("d", 7.))
+    assert list(ens.ds["run"].values) == ["a", "b", "c", "d", "mmm"]
+    assert float(ens.ds["tas"].sel(run="mmm")[1, 1, 1]) == pytest.approx(4.)
+    assert np.isnan(ens.ds["tas"].sel(run="mmm")[0, 0, 0])
+    assert float(ens.ds["tas"].sel(run="c")[1, 1, 1]) == 6.
+    # the runs are views of the (reallocated) buffer
+    assert all(ens.buffer.backs(ens.ds_dict[name]["tas"]) for name in "abcd")
+    assert ens.buffer.backs(ens.ds["tas"])
+
+def test_add_member_off_grid_leaves_ensemble_unchanged():
+    ens = ensemble.Ensemble("test", [run("a", 1.), run("b", 2.)])
+    ens.generate_ensemble("tas")
+    with pytest.raises(ValueError):
+        ens.add_member(run("c", 3., lat=(-60., 0., 60.)))
+    assert list(ens.ds_dict) == ["a", "b"]
+    assert list(ens.ds["run"].values) == ["a", "b"]
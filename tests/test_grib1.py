@@ -0,0 +1,29 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+xr = pytest.importorskip("xarray")
+
+import grib1
+from benchmarks import synthetic
+
+@pytest.mark.parametrize("nbits,decimal_scale", [(16, 2), (12, 1)])
+def test_simple_packing_round_trip(tmp_path, nbits, decimal_scale):
+    # values written with the synthetic GRIB1 writer decode to within the packing precision
+    nt, ny, nx = 3, 7, 8
+    path = synthetic.write_grib1_file(str(tmp_path/"tas.grb"), nt=nt, ny=ny, nx=nx, nbits=nbits, decimal_scale=decimal_scale)
+    expected = synthetic.sar_field(nt, ny, nx)
+
+    ds = xr.open_dataset(path, engine=grib1.Grib1BackendEntrypoint)
+    [name] = list(ds.data_vars)
+    assert ds[name].dims == ("initial_time0_hours", "g0_lat_1", "g0_lon_2")
+    np.testing.assert_allclose(ds["g0_lat_1"].values, np.linspace(90., -90., ny), atol=1e-3)
+    np.testing.assert_allclose(ds["g0_lon_2"].values, np.linspace(0., 360., nx, endpoint=False), atol=1e-3)
+    assert list(ds["initial_time0_hours"].values.astype("datetime64[M]").astype(str)) == ["1990-01", "1990-02", "1990-03"]
+
+    # packing step of the widest field (values are rounded to half a step, the reference
+    # value to IBM precision), plus float32 rounding
+    spans = [(field.max()-field.min())*10.**decimal_scale for field in expected.astype(np.float64)]
+    step = max(2.**np.ceil(np.log2(span/(2**nbits-1))) for span in spans)*10.**(-decimal_scale)
+    values = ds[name].values
+    assert values.dtype == np.float32
+    assert np.abs(values.astype(np.float64)-expected).max() <= step+1e-4
@@ -0,0 +1,76 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+xr = pytest.importorskip("xarray")
+pytest.importorskip("fsspec")
+pytest.importorskip("zarr")
+
+from benchmarks import synthetic
+
+@pytest.fixture
+def far_files(tmp_path, monkeypatch, request):
+    # synthetic raw files of a model, and the virtual dataset of their references
+    monkeypatch.chdir(tmp_path)
+    root = synthetic.workspace(str(tmp_path))
+    import models
+    import references
+    model = getattr(models, request.param.lower())
+    files = synthetic.write_far_files(root, model, n_files=None if model.name == "GISS" else 2)
+    path = str(tmp_path/"references.json")
+    references.write_json(references.generate(model.name, files), path)
+    return model, files, references.open_virtual_dataset(path)
+
+def decoded(model, files):
+    import fortran_records
+    return [model.decode(fortran_records.record_file(f, use_cache=False)) for f in files]
+
+def converted(values, da):
+    # raw values with the linear unit conversion of a virtual variable
+    return values*da.encoding.get("scale_factor", 1.)+da.encoding.get("add_offset", 0.)
+
+@pytest.mark.parametrize("far_files", ["GFDL"], indirect=True)
+def test_gfdl_records(far_files):
+    import references
+    model, files, ds = far_files
+    assert ds.sizes == {"time": 2, "latitude": model.ny, "longitude": model.nx, "record_value": model.nv+2, "pressure": 9}
+    fields = decoded(model, files)
+    info = ds["records"].attrs["record_variables"]
+
+    tas = references.record_variable(ds, "tas")
+    assert tas.dims == ("time", "latitude", "longitude")
+    for t, field in enumerate(fields):
+        np.testing.assert_array_equal(tas.values[t], field[info["tas"]["first"]].T)
+
+    ta = references.record_variable(ds, "ta")
+    assert ta.dims == ("time", "pressure", "latitude", "longitude")
+    first, last = info["ta"]["first"], info["ta"]["last"]
+    np.testing.assert_array_equal(ta.values[1], np.transpose(fields[1][first:last+1], (0, 2, 1)))
+
+    # the soil moisture sentinel of ocean points is masked
+    mrso = references.record_variable(ds, "mrso")
+    ocean = fields[0][info["mrso"]["first"]].T == 15.
+    assert ocean.any() and np.isnan(mrso.values[0][ocean]).all()
+
+@pytest.mark.parametrize("far_files", ["UKTR"], indirect=True)
+def test_uktr_fields(far_files):
+    model, files, ds = far_files
+    fields = decoded(model, files)
+    for var_name in ds.data_vars:
+        idx = model.var_idx[model.var_shortnames.index({v: k for k, v in model.output_names.items()}[var_name])]
+        for t, field in enumerate(fields):
+            expected = converted(np.transpose(field[:, :, idx, :], (2, 1, 0)), ds[var_name])
+            np.testing.assert_allclose(ds[var_name].values[t], expected, rtol=1e-6)
+
+@pytest.mark.parametrize("far_files", ["GISS"], indirect=True)
+def test_giss_fields(far_files):
+    import fortran_records
+    import models
+    model, files, ds = far_files
+    assert np.all(np.diff(ds["longitude"].values) > 0)
+    [field] = decoded(model, files)
+    records = fortran_records.record_file(files[0], use_cache=False)
+    variables = models.get_variable_info([records.record_bytes(i)[:80].tobytes().decode("UTF-8") for i in range(model.nv)])
+    for far_name, var_name in model.output_names.items():
+        if var_name not in ds: continue
+        expected = converted(np.transpose(field[:, :, variables[far_name].first_index], (3, 2, 1, 0)), ds[var_name])
+        np.testing.assert_allclose(ds[var_name].values, expected, rtol=1e-6)
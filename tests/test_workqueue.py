@@ -0,0 +1,80 @@
+import time
+import multiprocessing
+
+import pytest
+
+import instrumentation
+import workqueue
+
+instrumentation.echo_errors = False
+
+def touch(activity_id, name, log):
+    # records every time an item is processed
+    with open(log, "a") as f:
+        f.write(name+"\n")
+    time.sleep(0.01)
+    return {"name": name}
+
+def broken(activity_id, name):
+    raise RuntimeError(f"cannot process {name}")
+
+def run_worker(path, log):
+    queue = workqueue.ledger(path)
+    workqueue.work(queue, {"touch": touch}, wait=False)
+
+def items(n, log):
+    return [workqueue.work_item("touch", "FAR", name=f"file{i}", log=log) for i in range(n)]
+
+def test_enqueue_is_idempotent(tmp_path):
+    queue = workqueue.ledger(str(tmp_path/"ledger.sqlite"))
+    log = str(tmp_path/"log")
+    assert queue.add(items(5, log)) == 5
+    assert queue.add(items(5, log)) == 0
+    assert queue.add(items(7, log)) == 2
+    assert queue.counts() == {("touch", "pending"): 7}
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_every_item_is_processed_once_by_several_processes(tmp_path):
+    path, log = str(tmp_path/"ledger.sqlite"), str(tmp_path/"log")
+    queue = workqueue.ledger(path)
+    queue.add(items(40, log))
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=run_worker, args=(path, log)) for _ in range(4)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join(60)
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    with open(log) as f:
+        processed = f.read().split()
+    assert sorted(processed) == sorted(f"file{i}" for i in range(40))
+    assert queue.counts() == {("touch", "done"): 40}
+    assert len({item["worker"] for item in queue.items()}) > 1
+    assert all(item["attempts"] == 1 and item["result"]["name"] == item["args"]["name"] for item in queue.items())
+
+def test_expired_lease_is_requeued(tmp_path):
+    queue = workqueue.ledger(str(tmp_path/"ledger.sqlite"), lease=0.2)
+    queue.add(items(1, str(tmp_path/"log")))
+    first = queue.claim("crashed")
+    assert queue.claim("other") is None # still leased
+    time.sleep(0.3)
+    second = queue.claim("other")
+    assert second["item_id"] == first["item_id"]
+    assert second["attempts"] == 2
+    # the first worker lost its lease and can't finish the item anymore
+    assert not queue.heartbeat(first["item_id"], "crashed")
+    assert not queue.complete(first["item_id"], "crashed", {})
+    assert queue.complete(second["item_id"], "other", {})
+    assert queue.counts() == {("touch", "done"): 1}
+
+def test_item_fails_after_max_attempts(tmp_path):
+    queue = workqueue.ledger(str(tmp_path/"ledger.sqlite"), attempts=2)
+    queue.add([workqueue.work_item("broken", "SAR", name="bad.grb")])
+    assert workqueue.work(queue, {"broken": broken}, wait=False) == 2
+    [item] = queue.items()
+    assert item["status"] == "failed"
+    assert item["attempts"] == 2
+    assert "cannot process bad.grb" in item["error"]
+
+    assert queue.retry_failed() == 1
+    assert queue.items()[0]["status"] == "pending"